@@ -0,0 +1,128 @@
+"""Local Postgres fixture with the box/prize columns the pricing jobs touch."""
+import os
+import random
+import uuid
+from urllib.parse import urlparse
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS box (
+    id uuid PRIMARY KEY,
+    name text NOT NULL,
+    image_url text,
+    slug text,
+    is_live boolean NOT NULL DEFAULT true,
+    category text,
+    tags text[],
+    splash_image text,
+    edge numeric,
+    is_hidden boolean NOT NULL DEFAULT false
+);
+
+CREATE TABLE IF NOT EXISTS prize (
+    id uuid PRIMARY KEY,
+    box_id uuid REFERENCES box (id),
+    name text,
+    weight numeric,
+    value numeric,
+    condition text,
+    set text,
+    finish text,
+    mass numeric,
+    mass_unit text,
+    image text,
+    withdrawable boolean NOT NULL DEFAULT true,
+    tcgplayer_url text,
+    purple_mana_new_inv_id text,
+    is_deleted boolean NOT NULL DEFAULT false,
+    is_manually_priced boolean NOT NULL DEFAULT false
+);
+"""
+
+CONDITION_SLUGS = ['near-mint', 'lightly-played', 'moderately-played', 'heavily-played', 'damaged']
+CATEGORIES = ['pokemon', 'magic', 'yugioh', 'one-piece']
+
+def connect(database_url=None):
+    """Connect to the benchmark database (BENCH_DATABASE_URL, no SSL by default)"""
+    database_url = database_url or os.getenv('BENCH_DATABASE_URL')
+    if not database_url:
+        raise RuntimeError("BENCH_DATABASE_URL is not set")
+    parsed_url = urlparse(database_url)
+    return psycopg2.connect(
+        dbname=parsed_url.path[1:],
+        user=parsed_url.username,
+        password=parsed_url.password,
+        host=parsed_url.hostname,
+        port=parsed_url.port or 5432,
+        sslmode=os.getenv('BENCH_DATABASE_SSLMODE', 'disable')
+    )
+
+def reset_schema(conn):
+    cur = conn.cursor()
+    cur.execute("DROP TABLE IF EXISTS prize")
+    cur.execute("DROP TABLE IF EXISTS box")
+    cur.execute(SCHEMA_SQL)
+    conn.commit()
+
+def seed_catalog(conn, boxes=20, prizes_per_box=25, page_base_url="https://www.tcgplayer.com",
+                 shared_url_ratio=0.15, multi_condition_ratio=0.2, manual_ratio=0.03,
+                 deleted_ratio=0.02, seed=1):
+    """Insert a synthetic catalog; returns (box_count, prize_count)
+
+    shared_url_ratio of prizes reuse a TCGplayer URL already used in another
+    box, and multi_condition_ratio reuse a Purple Mana product id with a
+    different condition, the two shapes the real catalog has that make
+    per-URL updates and per-condition lookups fan out.
+    """
+    rng = random.Random(seed)
+    box_rows = []
+    prize_rows = []
+    seen_products = []
+    for b in range(boxes):
+        box_id = uuid.UUID(int=rng.getrandbits(128), version=4)
+        name = f"Bench Box {b}" if b % 17 else f"Bench Rewards Box {b}"
+        box_rows.append((
+            box_id, name, f"https://images.example/box/{b}.png", f"bench-box-{b}", True,
+            rng.choice(CATEGORIES), [], f"https://images.example/splash/{b}.png", 12, False
+        ))
+        for p in range(prizes_per_box):
+            roll = rng.random()
+            if seen_products and roll < shared_url_ratio:
+                # Same card, same listing page, different box
+                product_id, condition_index = rng.choice(seen_products)
+            elif seen_products and roll < shared_url_ratio + multi_condition_ratio:
+                # Same card in another condition: same Purple Mana product, own listing filter
+                product_id, _ = rng.choice(seen_products)
+                condition_index = rng.randrange(len(CONDITION_SLUGS))
+            else:
+                product_id = rng.randint(10000, 600000)
+                condition_index = rng.randrange(len(CONDITION_SLUGS))
+                seen_products.append((product_id, condition_index))
+            condition_name = CONDITION_SLUGS[condition_index].replace('-', ' ').title()
+            prize_rows.append((
+                uuid.UUID(int=rng.getrandbits(128), version=4), box_id, f"Bench Card {product_id}",
+                rng.choice([1, 5, 25, 100, 500, 2500]), round(rng.uniform(0.1, 300), 2),
+                condition_name, "Bench Set", "Holofoil",
+                10, "g", f"https://images.example/card/{product_id}.png", True,
+                f"{page_base_url}/product/{product_id}?Language=English&Condition={condition_name.replace(' ', '+')}",
+                f"{product_id}-{CONDITION_SLUGS[condition_index]}",
+                rng.random() < deleted_ratio, rng.random() < manual_ratio
+            ))
+
+    cur = conn.cursor()
+    execute_values(cur, """
+        INSERT INTO box (id, name, image_url, slug, is_live, category, tags, splash_image, edge, is_hidden)
+        VALUES %s
+    """, [(str(r[0]),) + r[1:] for r in box_rows], page_size=1000)
+    execute_values(cur, """
+        INSERT INTO prize (id, box_id, name, weight, value, condition, set, finish, mass, mass_unit,
+                           image, withdrawable, tcgplayer_url, purple_mana_new_inv_id,
+                           is_deleted, is_manually_priced)
+        VALUES %s
+    """, [(str(r[0]), str(r[1])) + r[2:] for r in prize_rows], page_size=1000)
+    cur.execute("ANALYZE box")
+    cur.execute("ANALYZE prize")
+    conn.commit()
+    return len(box_rows), len(prize_rows)
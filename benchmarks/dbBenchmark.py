@@ -0,0 +1,245 @@
+"""Compare the DB write and read strategies the pricing and push scripts use.
+
+Every strategy runs --repeat times at each scale, in a shuffled order, and
+each run gets a freshly generated catalog in BENCH_DATABASE_URL, so no
+strategy inherits the cache, dead tuples or HOT chains an earlier one left.
+The table reports the median run with its min and max.
+
+--record writes the results to benchmarks/baselines/db_baseline.json and
+--compare flags strategies whose median got slower than that file's by more
+than --tolerance. No baseline is committed: timings only compare on the same
+host and Postgres, so record one there before comparing against it.
+
+    python benchmarks/dbBenchmark.py --scales 1 10 100 --record
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from psycopg2.extras import execute_batch, execute_values
+
+import catalogFixture
+import generateCatalog
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines', 'db_baseline.json')
+
+# -- write strategies -------------------------------------------------------
+
+def write_execute_batch_by_id(conn, id_prices, url_prices):
+    """updatePrizePricing.update_prize_table"""
+    cur = conn.cursor()
+    execute_batch(cur, "UPDATE prize SET value = %s WHERE id = %s", id_prices)
+    conn.commit()
+    return len(id_prices)
+
+def write_values_join_by_id(conn, id_prices, url_prices):
+    """One UPDATE ... FROM (VALUES ...) per page of ids"""
+    cur = conn.cursor()
+    execute_values(cur, """
+        UPDATE prize SET value = v.value
+        FROM (VALUES %s) AS v (value, id)
+        WHERE prize.id = v.id::uuid
+    """, id_prices, template="(%s::numeric, %s)", page_size=1000)
+    conn.commit()
+    return len(id_prices)
+
+def write_per_url_commit(conn, id_prices, url_prices):
+    """process_url_batch: one UPDATE and one commit per scraped URL"""
+    cur = conn.cursor()
+    for price, url in url_prices:
+        cur.execute("UPDATE prize SET value = %s WHERE tcgplayer_url = %s", (price, url))
+        conn.commit()
+    return len(url_prices)
+
+def write_per_url_single_commit(conn, id_prices, url_prices):
+    """update_values: one UPDATE per URL, one commit"""
+    cur = conn.cursor()
+    for price, url in url_prices:
+        cur.execute("UPDATE prize SET value = %s WHERE tcgplayer_url = %s", (price, url))
+    conn.commit()
+    return len(url_prices)
+
+def write_values_join_by_url(conn, id_prices, url_prices):
+    """One UPDATE ... FROM (VALUES ...) keyed on tcgplayer_url"""
+    cur = conn.cursor()
+    execute_values(cur, """
+        UPDATE prize SET value = v.value
+        FROM (VALUES %s) AS v (value, url)
+        WHERE prize.tcgplayer_url = v.url
+    """, url_prices, template="(%s::numeric, %s)", page_size=1000)
+    conn.commit()
+    return len(url_prices)
+
+# -- read strategies --------------------------------------------------------
+
+LIVE_BOXES_SQL = ("SELECT id, name, image_url, slug, is_live, category, tags, splash_image, edge, is_hidden "
+                  "from box where is_live = True and LOWER(name) NOT LIKE '%rewards%'")
+BOX_PRIZES_SQL = ("select name, weight, value, condition, set, finish, mass, mass_unit, image, withdrawable, id "
+                  "from prize where box_id = %s and is_deleted = False")
+
+def read_n_plus_one(conn):
+    """The push scripts: one prize query per live box"""
+    cur = conn.cursor()
+    cur.execute(LIVE_BOXES_SQL)
+    rows = 0
+    for box_row in cur.fetchall():
+        cur.execute(BOX_PRIZES_SQL, (box_row[0],))
+        rows += len(cur.fetchall())
+    return rows
+
+def read_single_join(conn):
+    """All live boxes and their prizes in one round trip"""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT b.id, p.name, p.weight, p.value, p.condition, p.set, p.finish, p.mass, p.mass_unit,
+               p.image, p.withdrawable, p.id
+        FROM box b
+        JOIN prize p ON p.box_id = b.id AND p.is_deleted = False
+        WHERE b.is_live = True AND LOWER(b.name) NOT LIKE '%rewards%'
+        ORDER BY b.id
+    """)
+    return len(cur.fetchall())
+
+def read_any_array(conn):
+    """Live boxes, then all their prizes with box_id = ANY(...)"""
+    cur = conn.cursor()
+    cur.execute(LIVE_BOXES_SQL)
+    box_ids = [str(row[0]) for row in cur.fetchall()]
+    cur.execute("select box_id, name, weight, value, condition, set, finish, mass, mass_unit, image, "
+                "withdrawable, id from prize where box_id = ANY(%s::uuid[]) and is_deleted = False", (box_ids,))
+    return len(cur.fetchall())
+
+WRITE_STRATEGIES = [
+    ('execute_batch_by_id', write_execute_batch_by_id),
+    ('values_join_by_id', write_values_join_by_id),
+    ('per_url_commit', write_per_url_commit),
+    ('per_url_single_commit', write_per_url_single_commit),
+    ('values_join_by_url', write_values_join_by_url),
+]
+
+READ_STRATEGIES = [
+    ('n_plus_one_box_query', read_n_plus_one),
+    ('single_join', read_single_join),
+    ('any_array', read_any_array),
+]
+
+def load_workload(conn, seed):
+    """The prices an API pass and a scrape pass would write"""
+    rng = random.Random(seed)
+    cur = conn.cursor()
+    cur.execute("SELECT id FROM prize WHERE is_manually_priced = false")
+    id_prices = [(round(rng.uniform(0.1, 300), 2), str(row[0])) for row in cur.fetchall()]
+    cur.execute("""
+        SELECT DISTINCT tcgplayer_url FROM prize
+        WHERE tcgplayer_url IS NOT NULL AND is_deleted = false AND is_manually_priced = false
+    """)
+    url_prices = [(round(rng.uniform(0.1, 300), 2), row[0]) for row in cur.fetchall()]
+    return id_prices, url_prices
+
+def time_call(func, *args):
+    start = time.perf_counter()
+    items = func(*args)
+    return time.perf_counter() - start, items
+
+def run_trial(gen_args, kind, func, seed):
+    """One timed run of a strategy against a freshly generated catalog"""
+    counts = generateCatalog.generate(gen_args)
+    conn = catalogFixture.connect()
+    try:
+        if kind == 'write':
+            id_prices, url_prices = load_workload(conn, seed)
+            seconds, items = time_call(func, conn, id_prices, url_prices)
+        else:
+            seconds, items = time_call(func, conn)
+    finally:
+        conn.close()
+    return counts, seconds, items
+
+def run_scale(scale, args):
+    gen_args = generateCatalog.build_parser().parse_args(['--scale', str(scale), '--seed', str(args.seed)])
+    strategies = ([('write', name, func) for name, func in WRITE_STRATEGIES]
+                  + [('read', name, func) for name, func in READ_STRATEGIES])
+    trials = [strategy for strategy in strategies for _ in range(args.repeat)]
+    # Interleaved, so drift over the run (autovacuum, a busy host) spreads across strategies
+    random.Random(args.seed).shuffle(trials)
+    timings = {}
+    items_by_strategy = {}
+    box_count = prize_count = 0
+    for kind, name, func in trials:
+        (box_count, prize_count), seconds, items = run_trial(gen_args, kind, func, args.seed)
+        timings.setdefault(name, []).append(seconds)
+        items_by_strategy[name] = items
+    results = []
+    for kind, name, _ in strategies:
+        runs = timings[name]
+        seconds = statistics.median(runs)
+        items = items_by_strategy[name]
+        results.append({"scale": scale, "kind": kind, "strategy": name, "items": items,
+                        "runs": len(runs), "seconds": round(seconds, 4),
+                        "min_seconds": round(min(runs), 4), "max_seconds": round(max(runs), 4),
+                        "items_per_sec": round(items / seconds, 1) if seconds else None})
+    return {"scale": scale, "boxes": box_count, "prizes": prize_count, "results": results}
+
+def compare(runs, baseline, tolerance):
+    previous = {(r['scale'], r['strategy']): r['seconds']
+                for run in baseline.get('runs', []) for r in run['results']}
+    regressions = []
+    for run in runs:
+        for r in run['results']:
+            before = previous.get((r['scale'], r['strategy']))
+            if before and r['seconds'] > before * (1 + tolerance):
+                regressions.append((r['scale'], r['strategy'], before, r['seconds']))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scales', type=float, nargs='+', default=[1, 10])
+    parser.add_argument('--repeat', type=int, default=5, help="runs per strategy; the median is reported")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--record', action='store_true', help="write the baseline for this host")
+    parser.add_argument('--compare', action='store_true', help="fail if slower than the baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+
+    runs = [run_scale(scale, args) for scale in args.scales]
+
+    print(f"{'scale':>6} {'kind':<6} {'strategy':<24} {'items':>8} {'median s':>9} {'min s':>9} {'max s':>9} "
+          f"{'items/s':>10}")
+    for run in runs:
+        for r in run['results']:
+            print(f"{r['scale']:>6} {r['kind']:<6} {r['strategy']:<24} {r['items']:>8} {r['seconds']:>9} "
+                  f"{r['min_seconds']:>9} {r['max_seconds']:>9} {r['items_per_sec']!s:>10}")
+
+    if args.compare:
+        if not os.path.exists(BASELINE_PATH):
+            print(f"No baseline at {BASELINE_PATH}; run with --record first")
+            sys.exit(1)
+        with open(BASELINE_PATH) as f:
+            regressions = compare(runs, json.load(f), args.tolerance)
+        for scale, strategy, before, after in regressions:
+            print(f"REGRESSION scale={scale} {strategy}: {before}s -> {after}s")
+        if regressions:
+            sys.exit(1)
+
+    if args.record:
+        os.makedirs(os.path.dirname(BASELINE_PATH), exist_ok=True)
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump({
+                "recorded_at": datetime.now().isoformat(timespec='seconds'),
+                "host": platform.node(),
+                "python": platform.python_version(),
+                "repeat": args.repeat,
+                "runs": runs,
+            }, f, indent=2)
+        print(f"Baseline saved to {BASELINE_PATH}")
+
+if __name__ == "__main__":
+    main()
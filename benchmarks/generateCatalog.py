@@ -0,0 +1,54 @@
+"""Fill BENCH_DATABASE_URL with a synthetic box/prize catalog at a chosen scale.
+
+    python benchmarks/generateCatalog.py --scale 10
+    python benchmarks/generateCatalog.py --boxes 500 --prizes-per-box 80 --shared-url-ratio 0.3
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import catalogFixture
+
+# Roughly today's catalog; --scale multiplies the box count
+BASE_BOXES = 60
+BASE_PRIZES_PER_BOX = 40
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', type=float, default=1, help="multiplier on today's box count")
+    parser.add_argument('--boxes', type=int, help="exact box count (overrides --scale)")
+    parser.add_argument('--prizes-per-box', type=int, default=BASE_PRIZES_PER_BOX)
+    parser.add_argument('--shared-url-ratio', type=float, default=0.15)
+    parser.add_argument('--multi-condition-ratio', type=float, default=0.2)
+    parser.add_argument('--page-base-url', default="https://www.tcgplayer.com")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--append', action='store_true', help="keep existing rows instead of resetting")
+    return parser
+
+def generate(args):
+    boxes = args.boxes or max(1, int(BASE_BOXES * args.scale))
+    conn = catalogFixture.connect()
+    try:
+        if not args.append:
+            catalogFixture.reset_schema(conn)
+        start = time.perf_counter()
+        box_count, prize_count = catalogFixture.seed_catalog(
+            conn,
+            boxes=boxes,
+            prizes_per_box=args.prizes_per_box,
+            page_base_url=args.page_base_url,
+            shared_url_ratio=args.shared_url_ratio,
+            multi_condition_ratio=args.multi_condition_ratio,
+            seed=args.seed,
+        )
+        elapsed = time.perf_counter() - start
+    finally:
+        conn.close()
+    print(f"Inserted {box_count} boxes and {prize_count} prizes in {elapsed:.1f}s")
+    return box_count, prize_count
+
+if __name__ == "__main__":
+    generate(build_parser().parse_args())
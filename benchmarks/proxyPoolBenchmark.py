@@ -0,0 +1,111 @@
+"""Proxy pool behaviour against local stand-in exits, without Chrome.
+
+Starts the TCGplayer page stand-in and three forward proxies (fast, slow and
+throttled), then has --drivers simulated drivers fetch pages through the
+proxies they are given, recording each page in a proxyPool.ProxyPool and
+rotating when it says so. Prints each exit's share of the traffic; a healthy
+pool moves most of it onto the fast exit.
+
+    python benchmarks/proxyPoolBenchmark.py --drivers 4 --pages 400
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from urllib.error import HTTPError, URLError
+from urllib.request import ProxyHandler, build_opener
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import proxyPool
+import standins
+
+# tcgplayerPage.CHALLENGE_MARKERS, without pulling in selenium
+CHALLENGE_MARKERS = ('access denied', 'just a moment', 'verify you are human', 'unusual traffic')
+
+def fetch(proxy, url):
+    """(ok, seconds, challenged) for one page through one proxy"""
+    opener = build_opener(ProxyHandler({'http': proxy}))
+    start = time.perf_counter()
+    try:
+        with opener.open(url, timeout=10) as response:
+            body = response.read().decode('utf-8', 'replace')
+            ok = 'listing-item__listing-data__info__price' in body
+            return ok, time.perf_counter() - start, False
+    except HTTPError as e:
+        body = e.read().decode('utf-8', 'replace').lower()
+        challenged = any(marker in body for marker in CHALLENGE_MARKERS)
+        return False, time.perf_counter() - start, challenged
+    except URLError:
+        return False, time.perf_counter() - start, False
+
+def run_driver(pool, urls, lock, traffic, rotations):
+    proxy = pool.acquire()
+    while True:
+        with lock:
+            if not urls:
+                break
+            url = urls.pop()
+            traffic[proxy] = traffic.get(proxy, 0) + 1
+        ok, seconds, challenged = fetch(proxy, url)
+        pool.record(proxy, ok, seconds, challenged)
+        if pool.should_rotate(proxy):
+            pool.release(proxy)
+            proxy = pool.acquire(exclude=(proxy,))
+            with lock:
+                rotations.append(proxy)
+    pool.release(proxy)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--drivers', type=int, default=4)
+    parser.add_argument('--pages', type=int, default=400)
+    parser.add_argument('--output', help="write the report as JSON to this path")
+    args = parser.parse_args()
+
+    pages = standins.start_tcgplayer_pages(standins.FaultProfile(latency_ms=10, seed=1))
+    exits = {
+        "fast": standins.start_forward_proxy(standins.FaultProfile(latency_ms=20, jitter_ms=10, seed=2)),
+        "slow": standins.start_forward_proxy(standins.FaultProfile(latency_ms=300, jitter_ms=100, seed=3)),
+        "throttled": standins.start_forward_proxy(standins.FaultProfile(latency_ms=20, seed=4),
+                                                  challenge_rate=0.6, seed=5),
+    }
+    names = {server.base_url: name for name, server in exits.items()}
+    pool = proxyPool.ProxyPool(list(names))
+
+    urls = [f"{pages.base_url}/product/{100000 + i}/card" for i in range(args.pages)]
+    lock = threading.Lock()
+    traffic = {}
+    rotations = []
+    start = time.perf_counter()
+    threads = [threading.Thread(target=run_driver, args=(pool, urls, lock, traffic, rotations))
+               for _ in range(args.drivers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    print(f"{args.pages} pages through {args.drivers} drivers in {elapsed:.1f}s, {len(rotations)} rotations")
+    print(f"{'exit':<10} {'share':>7} {'success':>8} {'ewma s':>8} {'score':>7}")
+    report = pool.report()
+    for entry in report:
+        share = traffic.get(entry['proxy'], 0) / args.pages
+        print(f"{names[entry['proxy']]:<10} {share:>7.1%} {entry['success_rate']:>8} "
+              f"{entry['ewma_seconds']!s:>8} {entry['score']:>7}")
+
+    for server in [pages, *exits.values()]:
+        server.stop()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"config": vars(args), "seconds": round(elapsed, 3),
+                       "exits": [dict(entry, name=names[entry['proxy']],
+                                      pages=traffic.get(entry['proxy'], 0)) for entry in report]}, f, indent=2)
+        print(f"Report saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
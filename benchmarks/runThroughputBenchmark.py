@@ -0,0 +1,198 @@
+"""End-to-end throughput benchmark against local stand-ins.
+
+Seeds BENCH_DATABASE_URL with a synthetic catalog, starts the fake tRPC,
+TCGplayer and Pullbox servers, then runs the API pricing job, the push job and
+(with --scraper, which needs Chrome) the browser scraper against them.
+Reports items/sec and p50/p99 latency per job.
+
+    BENCH_DATABASE_URL=postgresql://postgres@localhost/pullbox_bench \
+        python benchmarks/runThroughputBenchmark.py --boxes 20 --prizes-per-box 25
+"""
+import argparse
+import contextlib
+import functools
+import io
+import json
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import catalogFixture
+import standins
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+class LatencyRecorder:
+    def __init__(self):
+        self.samples = []
+        self._lock = threading.Lock()
+
+    def wrap(self, func):
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.samples.append(time.perf_counter() - start)
+        return timed
+
+def summarize(name, items, elapsed, recorder):
+    p50 = percentile(recorder.samples, 50)
+    p99 = percentile(recorder.samples, 99)
+    return {
+        "job": name,
+        "items": items,
+        "seconds": round(elapsed, 3),
+        "items_per_sec": round(items / elapsed, 2) if elapsed else None,
+        "p50_ms": round(p50 * 1000, 2) if p50 is not None else None,
+        "p99_ms": round(p99 * 1000, 2) if p99 is not None else None,
+    }
+
+@contextlib.contextmanager
+def patched(module, name, replacement):
+    original = getattr(module, name)
+    setattr(module, name, replacement)
+    try:
+        yield
+    finally:
+        setattr(module, name, original)
+
+@contextlib.contextmanager
+def quiet(enabled):
+    if not enabled:
+        yield
+        return
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+def bench_price_api(item_count, quiet_output):
+    import updatePrizePricing
+    recorder = LatencyRecorder()
+    with patched(updatePrizePricing, 'make_api_request', recorder.wrap(updatePrizePricing.make_api_request)):
+        start = time.perf_counter()
+        with quiet(quiet_output):
+            updatePrizePricing.main()
+        elapsed = time.perf_counter() - start
+    return summarize("price-api", item_count, elapsed, recorder)
+
+def bench_push(box_count, quiet_output):
+    import httpPolicy
+    import pushBoxes
+    from pricingConfig import load_config
+    recorder = LatencyRecorder()
+    # Every Pullbox POST goes through httpPolicy.request, with or without a session
+    with patched(httpPolicy, 'request', recorder.wrap(httpPolicy.request)):
+        start = time.perf_counter()
+        with quiet(quiet_output):
+            pushBoxes.query_box_table(load_config('staging'))
+        elapsed = time.perf_counter() - start
+    return summarize("push", box_count, elapsed, recorder)
+
+def bench_scraper(quiet_output):
+    import updateWithScrapingNoVPN as scraper
+    recorder = LatencyRecorder()
+    original_batch = scraper.process_url_batch
+    timed_batch = recorder.wrap(original_batch)
+
+    def per_url_batch(driver, urls, position, prize_ids_by_url=None, supervisor=None):
+        results = []
+        for url in urls:
+            # A plain list per URL, so the supervisor's requeue isn't available here
+            if supervisor is not None:
+                driver = supervisor.driver_for_next_page()
+            results.extend(timed_batch(driver, [url], position, prize_ids_by_url))
+            if supervisor is not None:
+                supervisor.page_done()
+        return results
+
+    with patched(scraper, 'process_url_batch', per_url_batch):
+        start = time.perf_counter()
+        with quiet(quiet_output):
+            scraper.main()
+        elapsed = time.perf_counter() - start
+    return summarize("scrape", len(recorder.samples), elapsed, recorder)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--boxes', type=int, default=20)
+    parser.add_argument('--prizes-per-box', type=int, default=25)
+    parser.add_argument('--latency-ms', type=float, default=40, help="stand-in base latency")
+    parser.add_argument('--jitter-ms', type=float, default=20)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--error-status', type=int, default=500)
+    parser.add_argument('--scraper', action='store_true', help="also run the browser scraper (needs Chrome)")
+    parser.add_argument('--output', help="write the report as JSON to this path")
+    parser.add_argument('--verbose', action='store_true', help="show the jobs' own output")
+    args = parser.parse_args()
+
+    faults = dict(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                  error_rate=args.error_rate, error_status=args.error_status, seed=7)
+    api_key = "bench-key"
+    trpc = standins.start_fake_trpc(standins.FaultProfile(**faults))
+    pages = standins.start_tcgplayer_pages(standins.FaultProfile(**faults))
+    pullbox = standins.start_mock_pullbox(standins.FaultProfile(**faults), api_key=api_key)
+
+    conn = catalogFixture.connect()
+    catalogFixture.reset_schema(conn)
+    box_count, prize_count = catalogFixture.seed_catalog(
+        conn, boxes=args.boxes, prizes_per_box=args.prizes_per_box, page_base_url=pages.base_url)
+    conn.close()
+    print(f"Seeded {box_count} boxes and {prize_count} prizes")
+
+    bench_url = os.environ['BENCH_DATABASE_URL']
+    os.environ.update({
+        'STAGING_DATABASE_URL': bench_url,
+        'PRODUCTION_DATABASE_URL': bench_url,
+        'DATABASE_SSLMODE': os.getenv('BENCH_DATABASE_SSLMODE', 'disable'),
+        'PURPLE_MANA_API_URL': f"{trpc.base_url}/api/trpc/catalogProducts.getOne,catalogProducts.getSalesHistory",
+        'PULLBOX_API_URL': f"{pullbox.base_url}/boxes",
+        'PULLBOX_API_KEY': api_key,
+        'DISCORD_WEBHOOK_URL': '',
+        'FAILED_WEBHOOK': '',
+    })
+
+    report = []
+    live_boxes = box_count - len([b for b in range(args.boxes) if b % 17 == 0])
+    # The jobs drop debug and error files into the working directory
+    with tempfile.TemporaryDirectory() as workdir:
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            report.append(bench_price_api(prize_count, not args.verbose))
+            report.append(bench_push(live_boxes, not args.verbose))
+            if args.scraper:
+                report.append(bench_scraper(not args.verbose))
+        finally:
+            os.chdir(cwd)
+
+    for server in (trpc, pages, pullbox):
+        server.stop()
+
+    print(f"{'job':<10} {'items':>7} {'seconds':>9} {'items/s':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for row in report:
+        print(f"{row['job']:<10} {row['items']:>7} {row['seconds']:>9} {row['items_per_sec']!s:>9} "
+              f"{row['p50_ms']!s:>9} {row['p99_ms']!s:>9}")
+    print(f"Stand-in traffic: tRPC {trpc.counters}, pages {pages.counters}, pullbox {pullbox.counters}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"config": vars(args), "results": report}, f, indent=2)
+        print(f"Report saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+"""Local stand-ins for purplemana.com, TCGplayer, the Pullbox API and proxy exits.
+
+Each server runs on 127.0.0.1 in a daemon thread with configurable latency and
+error rate so the pricing jobs can be pointed at it through their env vars.
+"""
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlparse, parse_qs
+from urllib.request import ProxyHandler, build_opener
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TRPC_RECORDINGS_DIR = os.path.join(HERE, 'fixtures', 'trpc')
+TCGPLAYER_PAGES_DIR = os.path.join(HERE, 'fixtures', 'tcgplayer')
+
+CONDITIONS = ['Near Mint', 'Lightly Played', 'Moderately Played', 'Heavily Played', 'Damaged']
+
+LISTING_PAGE_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head><title>Product {product_id}</title></head>
+<body>
+<button class="tcg-standard-button"><span class="tcg-standard-button__content">Add to Cart</span></button>
+<section class="listings">
+{listings}
+</section>
+</body>
+</html>
+"""
+
+LISTING_TEMPLATE = """<div class="listing-item">
+  <div class="listing-item__listing-data">
+    <div class="listing-item__listing-data__info">
+      <div class="listing-item__listing-data__info__price">${price:.2f}</div>
+    </div>
+  </div>
+</div>"""
+
+class FaultProfile:
+    """Latency and failure injection shared by every stand-in"""
+
+    def __init__(self, latency_ms=0, jitter_ms=0, error_rate=0.0, error_status=500, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def apply(self):
+        """Sleep for the configured latency; return an error status or None"""
+        with self._lock:
+            delay = self.latency_ms + self._random.uniform(0, self.jitter_ms)
+            fail = self._random.random() < self.error_rate
+        if delay:
+            time.sleep(delay / 1000)
+        return self.error_status if fail else None
+
+def synthetic_price(numeric_id, condition_index=0):
+    """Deterministic price for a product id so runs are comparable"""
+    base = (int(numeric_id) % 9973) / 100 + 0.25
+    return round(base * (1 - 0.12 * condition_index), 2)
+
+def synthetic_getone_response(numeric_id):
+    tcglow = {condition: synthetic_price(numeric_id, i) for i, condition in enumerate(CONDITIONS)}
+    return [
+        {"result": {"data": {"json": {"id": str(numeric_id), "tcglow": tcglow}}}},
+        {"result": {"data": {"json": []}}},
+    ]
+
+def record_getone_response(numeric_id, response_json, recordings_dir=TRPC_RECORDINGS_DIR):
+    """Save a real batch response so the fake server can replay it"""
+    os.makedirs(recordings_dir, exist_ok=True)
+    with open(os.path.join(recordings_dir, f"{numeric_id}.json"), 'w') as f:
+        json.dump(response_json, f)
+
+class _StandinHandler(BaseHTTPRequestHandler):
+    server_version = "PullboxStandin/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type="application/json"):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _fault(self):
+        status = self.server.faults.apply()
+        if status is not None:
+            self.server.count('errors')
+            if status == 429:
+                self.send_response(429)
+                self.send_header("Retry-After", "1")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+            else:
+                self._send(status, json.dumps({"error": "injected failure"}))
+            return True
+        return False
+
+class FakeTrpcHandler(_StandinHandler):
+    """Answers catalogProducts.getOne batches from recordings or synthetic data"""
+
+    def do_GET(self):
+        self.server.count('requests')
+        if self._fault():
+            return
+        query = parse_qs(urlparse(self.path).query)
+        try:
+            batch_input = json.loads(query['input'][0])
+            numeric_id = str(batch_input['0']['json']['id'])
+        except (KeyError, IndexError, ValueError):
+            self._send(400, json.dumps({"error": "bad input"}))
+            return
+
+        recording = os.path.join(self.server.recordings_dir, f"{numeric_id}.json")
+        if os.path.exists(recording):
+            with open(recording) as f:
+                self._send(200, f.read())
+        elif numeric_id.isdigit():
+            self._send(200, json.dumps(synthetic_getone_response(numeric_id)))
+        else:
+            self._send(404, json.dumps({"error": "unknown product"}))
+
+class TcgplayerPageHandler(_StandinHandler):
+    """Serves saved listing pages from fixtures/tcgplayer/<product_id>.html"""
+
+    def do_GET(self):
+        self.server.count('requests')
+        if self._fault():
+            return
+        parts = [p for p in urlparse(self.path).path.split('/') if p]
+        if len(parts) < 2 or parts[0] != 'product':
+            self._send(404, "not found", "text/plain")
+            return
+        product_id = parts[1]
+
+        saved_page = os.path.join(self.server.pages_dir, f"{product_id}.html")
+        if os.path.exists(saved_page):
+            with open(saved_page, encoding='utf-8') as f:
+                self._send(200, f.read(), "text/html; charset=utf-8")
+            return
+        if not product_id.isdigit():
+            self._send(404, "not found", "text/plain")
+            return
+        listings = "\n".join(
+            LISTING_TEMPLATE.format(price=synthetic_price(product_id) * (1 + 0.03 * i))
+            for i in range(5)
+        )
+        self._send(200, LISTING_PAGE_TEMPLATE.format(product_id=product_id, listings=listings),
+                   "text/html; charset=utf-8")
+
+class MockPullboxHandler(_StandinHandler):
+    """Accepts box payloads the way the Pullbox box endpoint does"""
+
+    def do_POST(self):
+        self.server.count('requests')
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length)
+        if self.server.api_key and self.headers.get('Authorization') != self.server.api_key:
+            self._send(401, json.dumps({"error": "unauthorized"}))
+            return
+        if self._fault():
+            return
+        try:
+            box = json.loads(body)
+        except ValueError:
+            self._send(400, json.dumps({"error": "invalid json"}))
+            return
+        with self.server.lock:
+            self.server.boxes[box.get('id')] = box
+        self._send(200, json.dumps({"ok": True, "id": box.get('id')}))
+
+CHALLENGE_PAGE = """<!DOCTYPE html>
+<html><head><title>Access Denied</title></head>
+<body><h1>Access Denied</h1><p>Please verify you are human.</p></body></html>
+"""
+
+# Forwarding must not loop back through whatever proxy the environment sets
+_direct_opener = build_opener(ProxyHandler({}))
+
+class ForwardProxyHandler(_StandinHandler):
+    """A plain-HTTP forward proxy standing in for one VPN exit.
+
+    Adds the exit's latency and errors on top of the target's, and answers a
+    share of requests with a block page to play a throttled IP. CONNECT is not
+    supported, so point it at the plain-HTTP stand-ins.
+    """
+
+    def do_GET(self):
+        self.server.count('requests')
+        if self._fault():
+            return
+        with self.server.lock:
+            challenged = self.server.random.random() < self.server.challenge_rate
+        if challenged:
+            self.server.count('challenges')
+            self._send(403, CHALLENGE_PAGE, "text/html; charset=utf-8")
+            return
+        try:
+            with _direct_opener.open(self.path, timeout=30) as upstream:
+                self._send(upstream.status, upstream.read(),
+                           upstream.headers.get('Content-Type', 'application/octet-stream'))
+        except HTTPError as e:
+            self._send(e.code, e.read(), e.headers.get('Content-Type', 'text/plain'))
+        except (URLError, ValueError) as e:
+            self._send(502, f"bad gateway: {e}", "text/plain")
+
+    def do_CONNECT(self):
+        self._send(405, "CONNECT not supported by the stand-in proxy", "text/plain")
+
+class StandinServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler, faults=None, **attrs):
+        super().__init__(('127.0.0.1', 0), handler)
+        self.faults = faults or FaultProfile()
+        self.lock = threading.Lock()
+        self.counters = {}
+        for name, value in attrs.items():
+            setattr(self, name, value)
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+def start_fake_trpc(faults=None, recordings_dir=TRPC_RECORDINGS_DIR):
+    return StandinServer(FakeTrpcHandler, faults, recordings_dir=recordings_dir).start()
+
+def start_tcgplayer_pages(faults=None, pages_dir=TCGPLAYER_PAGES_DIR):
+    return StandinServer(TcgplayerPageHandler, faults, pages_dir=pages_dir).start()
+
+def start_mock_pullbox(faults=None, api_key=None):
+    return StandinServer(MockPullboxHandler, faults, api_key=api_key, boxes={}).start()
+
+def start_forward_proxy(faults=None, challenge_rate=0.0, seed=None):
+    """Proxy URL for the server is server.base_url, e.g. for SCRAPER_PROXIES"""
+    return StandinServer(ForwardProxyHandler, faults, challenge_rate=challenge_rate,
+                         random=random.Random(seed)).start()
+
+if __name__ == "__main__":
+    servers = {
+        "purple mana tRPC": start_fake_trpc(),
+        "TCGplayer pages": start_tcgplayer_pages(),
+        "Pullbox boxes": start_mock_pullbox(),
+        "proxy exit": start_forward_proxy(),
+    }
+    for name, server in servers.items():
+        print(f"{name}: {server.base_url}")
+    print("Serving until interrupted")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        for server in servers.values():
+            server.stop()
@@ -0,0 +1,188 @@
+"""Push boxes to Pullbox seconds after their prize values change.
+
+    python pricingCli.py migrate --env production     # installs the trigger
+    python pricingCli.py push --env production --listen
+
+Migration 4 puts a trigger on prize that sends a NOTIFY on the
+prize_value_changed channel, with the box id as payload, for every box
+whose prizes changed value, moved or were deleted. The listener holds one
+LISTEN connection to the primary, collects box ids, and once a box has been
+quiet for DEBOUNCE_SECONDS (or has waited MAX_DELAY_SECONDS since its first
+change, so a long scrape still flushes) rebuilds just those boxes from the
+primary and pushes them to every target. Boxes that didn't change cost
+nothing.
+
+Notifications sent while the listener is disconnected are lost, so after a
+reconnect it runs one full push to catch up; that push covers the boxes
+still waiting too, so they are dropped rather than pushed again. Metrics go
+to one rolling run report, rewritten every EXPORT_METRICS_SECONDS.
+"""
+import logging
+import select
+import signal
+import threading
+import time
+
+import pipelineMetrics
+import pushBoxes
+import pushOutbox
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'prize_value_changed'
+DEBOUNCE_SECONDS = 5
+MAX_DELAY_SECONDS = 30
+RECONNECT_SECONDS = 10
+EXPORT_METRICS_SECONDS = 300
+# Longest select() wait, so a stop request is noticed promptly
+POLL_SECONDS = 1.0
+
+class Debouncer:
+    """Box ids waiting to be pushed, released once quiet or once they have waited long enough"""
+
+    def __init__(self, quiet_seconds=DEBOUNCE_SECONDS, max_delay_seconds=MAX_DELAY_SECONDS):
+        self.quiet_seconds = quiet_seconds
+        self.max_delay_seconds = max_delay_seconds
+        # box id -> (first seen, last seen)
+        self.pending = {}
+
+    def add(self, box_id, now):
+        first, _ = self.pending.get(box_id, (now, now))
+        self.pending[box_id] = (first, now)
+
+    def _due_at(self, first, last):
+        return min(last + self.quiet_seconds, first + self.max_delay_seconds)
+
+    def pop_due(self, now):
+        due = [box_id for box_id, (first, last) in self.pending.items() if self._due_at(first, last) <= now]
+        for box_id in due:
+            del self.pending[box_id]
+        return due
+
+    def clear(self):
+        self.pending.clear()
+
+    def seconds_until_due(self, now):
+        if not self.pending:
+            return None
+        return max(0.0, min(self._due_at(first, last) for first, last in self.pending.values()) - now)
+
+class BoxListener:
+    def __init__(self, config, targets, session=None, debouncer=None):
+        self.config = config
+        self.targets = targets
+        self.session = session
+        self.debouncer = debouncer or Debouncer()
+        self.stopping = threading.Event()
+        self.conn = None
+        self.outbox = None
+
+    def stop(self, *_):
+        logger.info("Stopping the box listener")
+        self.stopping.set()
+
+    def connect(self):
+        # Its own connection to the primary; a pooled one would hand the LISTEN to someone else
+        conn = self.config.connect()
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1 FROM pg_trigger WHERE tgname = 'prize_change_notify'")
+            if cur.fetchone() is None:
+                logger.warning("No prize_change_notify trigger, nothing will arrive; "
+                               f"run: python pricingCli.py migrate --env {self.config.env}")
+            cur.execute(f"LISTEN {CHANNEL}")
+        self.conn = conn
+        logger.info(f"Listening on {CHANNEL} for {self.config.env} box changes")
+
+    def disconnect(self):
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except Exception:
+                pass
+            self.conn = None
+
+    def receive(self, timeout):
+        """Wait up to timeout for notifications and queue their box ids"""
+        if select.select([self.conn], [], [], timeout) == ([], [], []):
+            return 0
+        self.conn.poll()
+        now = time.monotonic()
+        received = 0
+        while self.conn.notifies:
+            notify = self.conn.notifies.pop(0)
+            self.debouncer.add(notify.payload, now)
+            received += 1
+        pipelineMetrics.inc('box_notifications_total', received)
+        return received
+
+    def flush(self, box_ids):
+        """Rebuild the boxes from the primary and push them to every target"""
+        started = time.perf_counter()
+        # The primary: a replica may not have the change the NOTIFY is about yet
+        _, payloads = pushBoxes.query_box_payloads(self.config, box_ids=box_ids, readonly=False)
+        if payloads:
+            pushed = pushBoxes.send_to_targets(self.targets, payloads, self.outbox, self.session)
+            logger.info(f"Pushed {len(payloads)} changed boxes in {time.perf_counter() - started:.1f}s "
+                        f"({', '.join(f'{env}: {count}' for env, count in pushed.items())})")
+        # Boxes that aren't live (or are rewards boxes) build no payload and are skipped, like the full push
+        pipelineMetrics.inc('boxes_flushed_total', len(payloads))
+        pipelineMetrics.record_stage('listener_flush', time.perf_counter() - started)
+
+    def catch_up(self):
+        logger.warning("Reconnected; pushing every box to cover notifications missed while disconnected")
+        _, payloads = pushBoxes.query_box_payloads(self.config, readonly=False)
+        pushBoxes.send_to_targets(self.targets, payloads, self.outbox, self.session)
+
+    def run(self):
+        self.outbox = pushOutbox.PushOutbox()
+        connected_before = False
+        next_export = time.monotonic() + EXPORT_METRICS_SECONDS
+        job = f"push-listen-{'-'.join(target.env for target in self.targets)}"
+        try:
+            while not self.stopping.is_set():
+                try:
+                    if self.conn is None:
+                        self.connect()
+                        if connected_before:
+                            # The full push rebuilds every box, so whatever was waiting would only go twice
+                            self.debouncer.clear()
+                            self.catch_up()
+                        connected_before = True
+                    wait = self.debouncer.seconds_until_due(time.monotonic())
+                    self.receive(POLL_SECONDS if wait is None else min(wait, POLL_SECONDS))
+                    due = self.debouncer.pop_due(time.monotonic())
+                    if due:
+                        try:
+                            self.flush(due)
+                        except Exception:
+                            # Kept for the exit flush; after a reconnect the catch-up push covers them
+                            for box_id in due:
+                                self.debouncer.add(box_id, time.monotonic())
+                            raise
+                except Exception as e:
+                    logger.error(f"Box listener error, reconnecting in {RECONNECT_SECONDS}s: {e}")
+                    pipelineMetrics.inc('listener_reconnects_total')
+                    self.disconnect()
+                    self.stopping.wait(RECONNECT_SECONDS)
+                if time.monotonic() >= next_export:
+                    pipelineMetrics.export_run(job, rolling=True)
+                    next_export = time.monotonic() + EXPORT_METRICS_SECONDS
+        finally:
+            # Whatever was still waiting goes out before exit
+            if self.debouncer.pending:
+                try:
+                    self.flush(list(self.debouncer.pending))
+                except Exception as e:
+                    logger.error(f"Could not push {len(self.debouncer.pending)} pending boxes on exit: {e}")
+            self.disconnect()
+            self.outbox.close()
+            pipelineMetrics.export_run(job, rolling=True)
+
+def main(config, targets=None, debounce_seconds=DEBOUNCE_SECONDS):
+    logging.basicConfig(level=logging.INFO)
+    listener = BoxListener(config, targets or [config],
+                           debouncer=Debouncer(debounce_seconds, max(MAX_DELAY_SECONDS, debounce_seconds)))
+    signal.signal(signal.SIGTERM, listener.stop)
+    signal.signal(signal.SIGINT, listener.stop)
+    listener.run()
@@ -0,0 +1,239 @@
+"""Starting the scrapers' Chrome instances quickly.
+
+uc.Chrome downloads and patches chromedriver on every launch unless it is
+handed an already patched binary, and the scrapers used to start browsers
+one at a time with sleeps in between. Here the patched binary is made once
+and cached under BROWSER_CACHE_DIR, and start_fleet() launches every browser
+at once and reports when each one is ready.
+
+Each worker also gets its own persistent Chrome profile under
+<cache dir>/profiles/<namespace>-<n>, so TCGplayer's bundles stay in the
+HTTP cache and its cookies survive between runs. Profiles are pruned back
+under BROWSER_PROFILE_MAX_MB before launch (caches go first, cookies stay)
+and profiles idle for BROWSER_PROFILE_MAX_IDLE_DAYS are removed.
+BROWSER_PROFILES=0 goes back to a throwaway profile per launch.
+"""
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+import undetected_chromedriver as uc
+
+import pipelineMetrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'pullbox-scraper')
+
+# Gap between handing each browser its first URL, so they don't all hit TCGplayer at once
+START_STAGGER_SECONDS = 0.5
+
+# Profile subdirectories Chrome can rebuild; removed oldest file first when a profile is too big
+PRUNABLE_PROFILE_DIRS = (
+    os.path.join('Default', 'Cache'),
+    os.path.join('Default', 'Code Cache'),
+    os.path.join('Default', 'Service Worker', 'CacheStorage'),
+    os.path.join('Default', 'GPUCache'),
+    'GrShaderCache',
+    'ShaderCache',
+    'component_crx_cache',
+)
+
+_patch_lock = threading.Lock()
+_pruned = set()
+
+def cache_dir():
+    path = os.getenv('BROWSER_CACHE_DIR', DEFAULT_CACHE_DIR)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def patched_driver_path(refresh=False):
+    """Path of the cached, already patched chromedriver, creating it on first use"""
+    name = 'chromedriver.exe' if sys.platform.startswith('win') else 'chromedriver'
+    path = os.path.join(cache_dir(), name)
+    with _patch_lock:
+        if refresh and os.path.exists(path):
+            os.remove(path)
+        if not os.path.exists(path):
+            started = time.perf_counter()
+            patcher = uc.Patcher()
+            patcher.auto()
+            shutil.copy2(patcher.executable_path, path + '.tmp')
+            os.replace(path + '.tmp', path)
+            logger.info(f"Patched chromedriver cached at {path} in {time.perf_counter() - started:.1f}s")
+    return path
+
+def profiles_enabled():
+    return os.getenv('BROWSER_PROFILES', '1') != '0'
+
+def dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+def prune_profile(path, max_bytes):
+    """Delete cache files, oldest first, until the profile fits in max_bytes; returns its size"""
+    size = dir_size(path)
+    if size <= max_bytes:
+        return size
+    cache_files = []
+    for subdir in PRUNABLE_PROFILE_DIRS:
+        for root, _, files in os.walk(os.path.join(path, subdir)):
+            for name in files:
+                file_path = os.path.join(root, name)
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    continue
+                cache_files.append((stat.st_mtime, stat.st_size, file_path))
+    for _, file_size, file_path in sorted(cache_files):
+        if size <= max_bytes:
+            break
+        try:
+            os.remove(file_path)
+            size -= file_size
+        except OSError:
+            pass
+    logger.info(f"Pruned browser profile {path} to {size / 1024 / 1024:.0f} MiB")
+    return size
+
+def prune_idle_profiles(max_idle_days):
+    """Remove whole profiles nobody has launched for max_idle_days"""
+    root = os.path.join(cache_dir(), 'profiles')
+    if not os.path.isdir(root):
+        return
+    cutoff = time.time() - max_idle_days * 86400
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if os.path.isdir(path) and os.path.getmtime(path) < cutoff:
+            shutil.rmtree(path, ignore_errors=True)
+            logger.info(f"Removed browser profile {path}, unused for {max_idle_days} days")
+
+def profile_dir(namespace, instance_num):
+    """The worker's persistent profile, pruned to its size cap once per process"""
+    path = os.path.join(cache_dir(), 'profiles', f"{namespace}-{instance_num}")
+    os.makedirs(path, exist_ok=True)
+    if path not in _pruned:
+        _pruned.add(path)
+        max_bytes = int(float(os.getenv('BROWSER_PROFILE_MAX_MB', 500)) * 1024 * 1024)
+        size = prune_profile(path, max_bytes)
+        pipelineMetrics.set_gauge('browser_profile_bytes', size, driver=instance_num)
+    # The directory's mtime is what prune_idle_profiles() goes by
+    os.utime(path)
+    return path
+
+def chrome_options(proxy=None):
+    options = uc.ChromeOptions()
+    options.add_argument('--disable-blink-features=AutomationControlled')
+    options.add_argument("--disable-infobars")
+    options.add_argument("--disable-extensions")
+    # Keep background tabs loading at full speed for the multi-tab scraper
+    options.add_argument("--disable-background-timer-throttling")
+    options.add_argument("--disable-renderer-backgrounding")
+    options.add_argument("--disable-backgrounding-occluded-windows")
+    # Chrome's own cap on the HTTP cache, under the profile cap so pruning rarely has to run
+    disk_cache_mb = float(os.getenv('BROWSER_DISK_CACHE_MB', 300))
+    options.add_argument(f"--disk-cache-size={int(disk_cache_mb * 1024 * 1024)}")
+    if proxy:
+        options.add_argument(f"--proxy-server={proxy}")
+        # Chrome never proxies loopback unless told to, which local stand-in proxies need
+        if urlparse(proxy).hostname in ('127.0.0.1', 'localhost'):
+            options.add_argument("--proxy-bypass-list=<-loopback>")
+    return options
+
+def is_driver_version_error(error):
+    """chromedriver refusing to drive a newer Chrome, the sign the cached binary is stale"""
+    return 'only supports Chrome version' in str(error)
+
+def launch(instance_num, profile_namespace='scraper', proxy=None):
+    """Start one Chrome on the cached driver and the worker's persistent profile.
+
+    A Chrome update invalidates the cached driver, so a version mismatch
+    re-patches it once. Any other failure with a profile is taken to mean the
+    profile is in use or damaged, and the browser starts on a throwaway one.
+    The proxy, if any, is kept on the driver as driver.pullbox_proxy.
+    """
+    driver = _launch(instance_num, profile_namespace, proxy)
+    driver.pullbox_proxy = proxy
+    return driver
+
+def _launch(instance_num, profile_namespace, proxy):
+    user_data_dir = profile_dir(profile_namespace, instance_num) if profiles_enabled() else None
+    try:
+        return uc.Chrome(options=chrome_options(proxy), driver_executable_path=patched_driver_path(),
+                         user_data_dir=user_data_dir)
+    except Exception as e:
+        if is_driver_version_error(e):
+            logger.warning(f"Driver #{instance_num}: cached chromedriver is out of date, re-patching")
+            return uc.Chrome(options=chrome_options(proxy), driver_executable_path=patched_driver_path(refresh=True),
+                             user_data_dir=user_data_dir)
+        if user_data_dir is None:
+            raise
+        logger.warning(f"Driver #{instance_num} failed on profile {user_data_dir} ({e}), using a throwaway profile")
+    return uc.Chrome(options=chrome_options(proxy), driver_executable_path=patched_driver_path())
+
+def wait_ready(driver, timeout=10):
+    """True once the browser answers scripts, i.e. can take a URL"""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if driver.execute_script("return document.readyState") in ('interactive', 'complete'):
+                return True
+        except Exception:
+            if time.monotonic() >= deadline:
+                raise
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.1)
+
+def start_fleet(positions, start_one):
+    """Run start_one(position) for every position concurrently.
+
+    Returns {position: driver} for the browsers that came up; a browser that
+    fails is logged and left out, and only an empty fleet raises.
+    """
+    positions = list(positions)
+    # Patch once up front rather than racing every launch on the first run
+    patched_driver_path()
+    if profiles_enabled():
+        prune_idle_profiles(float(os.getenv('BROWSER_PROFILE_MAX_IDLE_DAYS', 14)))
+    drivers = {}
+    started = time.perf_counter()
+
+    def start(position):
+        launched = time.perf_counter()
+        driver = start_one(position)
+        try:
+            ready = wait_ready(driver)
+        except Exception:
+            ready = False
+        return driver, ready, time.perf_counter() - launched
+
+    with ThreadPoolExecutor(max_workers=max(1, len(positions))) as executor:
+        futures = {executor.submit(start, position): position for position in positions}
+        for future in as_completed(futures):
+            position = futures[future]
+            try:
+                driver, ready, seconds = future.result()
+            except Exception as e:
+                logger.error(f"Driver #{position} failed to start: {e}")
+                pipelineMetrics.inc('drivers_started_total', driver=position, outcome='error')
+                continue
+            pipelineMetrics.record_stage('driver_startup', seconds, driver=position)
+            pipelineMetrics.inc('drivers_started_total', driver=position, outcome='ok' if ready else 'not_ready')
+            logger.info(f"Driver #{position} {'ready' if ready else 'started but not answering'} in {seconds:.1f}s")
+            drivers[position] = driver
+    if not drivers:
+        raise RuntimeError(f"None of the {len(positions)} browsers started")
+    logger.info(f"{len(drivers)}/{len(positions)} browsers up in {time.perf_counter() - started:.1f}s")
+    return drivers
@@ -0,0 +1,218 @@
+"""Browser workers in their own processes, under a supervising parent.
+
+    python pricingCli.py scrape --env staging --drivers 6 --isolate
+
+With threads, a browser that hangs or balloons stalls every other worker in
+the process and page parsing shares one GIL. Here each worker is a separate
+process with its own browser (under a DriverSupervisor), its own two
+database connections and its own metrics files. The parent hands each worker
+one URL at a time over the worker's inbox and collects outcomes on a shared
+event queue:
+
+    inbox          parent -> worker    a URL, or None to stop
+    event queue    workers -> parent   ('done', position, url, results)
+                                       ('requeue', position, url)
+
+Because the parent does the handing out, it always knows which URL a worker
+holds, even when the worker dies without a word. A worker that exits or sits
+on one URL longer than WORKER_HUNG_SECONDS is killed and restarted, and its
+URL goes back on the queue once.
+"""
+import logging
+import multiprocessing
+import queue
+import time
+from collections import deque
+
+import dbAccess
+import pipelineMetrics
+
+logger = logging.getLogger(__name__)
+
+WORKER_HUNG_SECONDS = 180
+MAX_RESTARTS_PER_WORKER = 5
+MAX_REQUEUES = 1
+
+class _OneUrl:
+    """process_url_batch's urls for a single URL, with requeue reported to the parent"""
+
+    def __init__(self, url, position, events):
+        self.url = url
+        self.position = position
+        self.events = events
+        self.requeued = False
+
+    def __iter__(self):
+        yield self.url
+
+    def requeue(self, url):
+        self.requeued = True
+        self.events.put(('requeue', self.position, url))
+        return True
+
+def worker_main(position, env, job, inbox, events, prize_ids_by_url):
+    """Entry point of one worker process"""
+    logging.basicConfig(level=logging.INFO)
+    import driverSupervisor
+    import tcgplayerPage
+    import updateWithScrapingNoVPN as scraper
+    from pricingConfig import load_config
+
+    worker_job = f"{job}-worker{position}"
+    database = dbAccess.database(load_config(env), maxconn=2)
+    scraper.connection_pool = database.pool()
+    # The catalog load is a read; every worker syncing it through the primary adds up
+    scraper.read_pool = database.pool(readonly=True)
+    scraper.page_timing_log = tcgplayerPage.PageTimingLog(worker_job)
+    supervisor = driverSupervisor.DriverSupervisor(position, scraper.start_positioned_driver, scraper.cleanup_driver)
+    try:
+        while True:
+            url = inbox.get()
+            if url is None:
+                break
+            urls = _OneUrl(url, position, events)
+            results = scraper.process_url_batch(None, urls, position, prize_ids_by_url, supervisor)
+            if not urls.requeued:
+                events.put(('done', position, url, results))
+    finally:
+        if supervisor.driver is not None:
+            scraper.cleanup_driver(supervisor.driver)
+        dbAccess.close_all()
+        scraper.page_timing_log.write_summary()
+        pipelineMetrics.export_run(worker_job)
+
+class WorkerSupervisor:
+    """Starts the worker processes, feeds them URLs and replaces the ones that die or hang"""
+
+    def __init__(self, config, num_workers, prize_ids_by_url=None, job='scrape-staging'):
+        # spawn: a forked child would inherit the parent's sockets and threads
+        self.context = multiprocessing.get_context('spawn')
+        self.config = config
+        self.num_workers = num_workers
+        self.prize_ids_by_url = prize_ids_by_url
+        self.job = job
+        self.events = self.context.Queue()
+        self.pending = deque()
+        self.processes = {}
+        self.inboxes = {}
+        # position -> (url, handed out at)
+        self.in_flight = {}
+        self.restarts = {}
+        self.requeues = {}
+        # A worker killed as hung may already have reported its URL; count each URL once
+        self.finished = set()
+        self.results = []
+
+    def start_worker(self, position):
+        # A fresh inbox: a killed worker can leave its queue's lock held
+        inbox = self.context.Queue()
+        process = self.context.Process(
+            target=worker_main, name=f"browser-worker-{position}",
+            args=(position, self.config.env, self.job, inbox, self.events, self.prize_ids_by_url))
+        process.start()
+        self.processes[position] = process
+        self.inboxes[position] = inbox
+        logger.info(f"Started worker #{position} (pid {process.pid})")
+
+    def dispatch(self):
+        """Hand the next pending URL to every idle worker"""
+        for position in self.processes:
+            if position in self.in_flight or not self.pending:
+                continue
+            url = self.pending.popleft()
+            if url in self.finished:
+                continue
+            self.in_flight[position] = (url, time.monotonic())
+            self.inboxes[position].put(url)
+
+    def requeue(self, url):
+        count = self.requeues.get(url, 0)
+        if count >= MAX_REQUEUES:
+            return False
+        self.requeues[url] = count + 1
+        self.pending.append(url)
+        pipelineMetrics.inc('urls_requeued_total')
+        return True
+
+    def finish(self, url, url_results):
+        if url in self.finished:
+            return
+        self.finished.add(url)
+        self.results.extend(url_results)
+
+    def handle(self, event):
+        kind, position, url = event[:3]
+        # Ignore reports for a URL the worker no longer holds, e.g. from before a restart
+        if self.in_flight.get(position, (None,))[0] == url:
+            del self.in_flight[position]
+        if kind == 'done':
+            self.finish(url, event[3])
+        elif kind == 'requeue' and not self.requeue(url):
+            self.finish(url, [(url, None)])
+
+    def check_workers(self):
+        """Restart workers that died or hung, putting their URL back on the queue"""
+        now = time.monotonic()
+        for position, process in list(self.processes.items()):
+            in_flight = self.in_flight.get(position)
+            if process.is_alive():
+                if not in_flight or now - in_flight[1] < WORKER_HUNG_SECONDS:
+                    continue
+                logger.warning(f"Worker #{position} stuck on {in_flight[0]} for {now - in_flight[1]:.0f}s, killing it")
+                process.kill()
+                process.join(5)
+                reason = 'hung'
+            else:
+                reason = f"exit code {process.exitcode}"
+            self.in_flight.pop(position, None)
+            if in_flight and not self.requeue(in_flight[0]):
+                self.finish(in_flight[0], [(in_flight[0], None)])
+            restarts = self.restarts.get(position, 0)
+            pipelineMetrics.inc('worker_restarts_total', worker=position, reason=reason.split(' ')[0])
+            if restarts >= MAX_RESTARTS_PER_WORKER:
+                logger.error(f"Worker #{position} died ({reason}) {restarts + 1} times, not restarting it")
+                del self.processes[position]
+                del self.inboxes[position]
+                continue
+            self.restarts[position] = restarts + 1
+            logger.warning(f"Worker #{position} died ({reason}), restarting")
+            self.start_worker(position)
+
+    def run(self, urls):
+        """Scrape every URL; returns [(url, price or None)] like scrape_urls()"""
+        self.pending.extend(urls)
+        for position in range(1, self.num_workers + 1):
+            self.start_worker(position)
+        try:
+            while len(self.finished) < len(urls):
+                if not self.processes:
+                    logger.error(f"Every worker is gone, {len(urls) - len(self.finished)} URLs left unscraped")
+                    break
+                self.dispatch()
+                try:
+                    self.handle(self.events.get(timeout=1))
+                except queue.Empty:
+                    pass
+                self.check_workers()
+        finally:
+            self.stop()
+        return self.results
+
+    def stop(self, timeout=30):
+        for inbox in self.inboxes.values():
+            inbox.put(None)
+        deadline = time.monotonic() + timeout
+        for position, process in self.processes.items():
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning(f"Worker #{position} did not stop, killing it")
+                process.kill()
+                process.join(5)
+
+def scrape_urls(urls, config, num_workers=2, prize_ids_by_url=None, job='scrape-staging'):
+    """Process-isolated counterpart of updateWithScrapingNoVPN.scrape_urls()"""
+    supervisor = WorkerSupervisor(config, num_workers, prize_ids_by_url, job)
+    results = supervisor.run(list(dict.fromkeys(urls)))
+    priced = len([price for _, price in results if price is not None])
+    logger.info(f"{priced}/{len(results)} URLs priced across {num_workers} worker processes")
+    return results
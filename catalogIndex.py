@@ -0,0 +1,142 @@
+"""The prize/box catalog in memory, loaded once per run, for lookups without per-item SQL.
+
+The prize and box rows (from catalogSnapshot, which only fetches what
+changed since the last run) build slotted records and the maps the
+jobs look things up in:
+
+    canonical TCGplayer URL -> prize ids     scraper result fan-out
+    prize -> box, box -> prizes              failure alerts, push payloads
+    Purple Mana id -> prize ids              one API request per product
+
+URLs are grouped by responseCache.canonical_listing_url(), so two prizes
+whose URLs differ only by slug or tracking parameters share one scrape.
+The index is a snapshot: it does not see writes made after it was loaded,
+which is fine for ids and box membership but means it is no source for
+current prize values once a run has started writing them.
+"""
+import time
+
+import catalogSnapshot
+from responseCache import canonical_listing_url
+
+PRIZE_COLUMNS = ('id', 'box_id', 'name', 'weight', 'value', 'condition', 'set', 'finish', 'mass', 'mass_unit',
+                 'image', 'withdrawable', 'tcgplayer_url', 'purple_mana_new_inv_id', 'is_deleted',
+                 'is_manually_priced')
+BOX_COLUMNS = ('id', 'name', 'image_url', 'slug', 'is_live', 'category', 'tags', 'splash_image', 'edge',
+               'is_hidden')
+
+class PrizeRecord:
+    __slots__ = PRIZE_COLUMNS
+
+    def __init__(self, row):
+        for name, value in zip(PRIZE_COLUMNS, row):
+            setattr(self, name, value)
+
+    @property
+    def auto_priced(self):
+        return not self.is_deleted and not self.is_manually_priced
+
+    def card_row(self):
+        """The row pushBoxes.build_box_payload() expects for a prize"""
+        return (self.name, self.weight, self.value, self.condition, self.set, self.finish, self.mass,
+                self.mass_unit, self.image, self.withdrawable, self.id)
+
+class BoxRecord:
+    __slots__ = BOX_COLUMNS
+
+    def __init__(self, row):
+        for name, value in zip(BOX_COLUMNS, row):
+            setattr(self, name, value)
+
+    @property
+    def pushed(self):
+        """Whether the push sends this box: live and not a rewards box"""
+        return bool(self.is_live) and self.name is not None and 'rewards' not in self.name.lower()
+
+    def row(self):
+        return tuple(getattr(self, name) for name in BOX_COLUMNS)
+
+class CatalogIndex:
+    def __init__(self, prize_rows, box_rows):
+        self.prizes = {}
+        self.boxes = {}
+        self._by_url = {}
+        self._by_box = {}
+        self._by_purple_mana_id = {}
+        for row in box_rows:
+            box = BoxRecord(row)
+            self.boxes[box.id] = box
+        for row in prize_rows:
+            prize = PrizeRecord(row)
+            self.prizes[prize.id] = prize
+            if prize.tcgplayer_url:
+                self._by_url.setdefault(canonical_listing_url(prize.tcgplayer_url), []).append(prize.id)
+            if prize.box_id is not None:
+                self._by_box.setdefault(prize.box_id, []).append(prize.id)
+            if prize.purple_mana_new_inv_id:
+                self._by_purple_mana_id.setdefault(prize.purple_mana_new_inv_id, []).append(prize.id)
+
+    @classmethod
+    def load(cls, conn, allow_stale=False):
+        """The whole catalog, synced into the local snapshot over conn and read from there.
+
+        allow_stale falls back to the last snapshot when the sync fails; see catalogSnapshot.read_tables().
+        """
+        started = time.perf_counter()
+        tables = catalogSnapshot.read_tables(conn, {'prize': PRIZE_COLUMNS, 'box': BOX_COLUMNS}, allow_stale)
+        index = cls(tables['prize'], tables['box'])
+        print(f"Loaded catalog index: {len(index.prizes)} prizes, {len(index.boxes)} boxes, "
+              f"{len(index._by_url)} listings in {time.perf_counter() - started:.1f}s")
+        return index
+
+    @classmethod
+    def from_pool(cls, pool, allow_stale=False):
+        conn = pool.getconn()
+        try:
+            return cls.load(conn, allow_stale)
+        finally:
+            conn.rollback()
+            pool.putconn(conn)
+
+    def prize_ids_for_url(self, url):
+        """Automatically priced, non-deleted prizes on the listing; what a scraped price is written to"""
+        return [prize_id for prize_id in self._by_url.get(canonical_listing_url(url), ())
+                if self.prizes[prize_id].auto_priced]
+
+    def prizes_for_url(self, url):
+        """Every prize on the listing with its box (or None), for alerts"""
+        return [(self.prizes[prize_id], self.boxes.get(self.prizes[prize_id].box_id))
+                for prize_id in self._by_url.get(canonical_listing_url(url), ())]
+
+    def box_of(self, prize_id):
+        prize = self.prizes.get(prize_id)
+        return self.boxes.get(prize.box_id) if prize else None
+
+    def prizes_in_box(self, box_id):
+        """The box's non-deleted prizes, as the push sends them"""
+        return [self.prizes[prize_id] for prize_id in self._by_box.get(box_id, ())
+                if not self.prizes[prize_id].is_deleted]
+
+    def auto_priced_prizes(self):
+        return [prize for prize in self.prizes.values() if prize.auto_priced]
+
+    def purple_mana_ids(self):
+        """Purple Mana ids with an automatically priced prize, each once"""
+        return [purple_mana_id for purple_mana_id, prize_ids in self._by_purple_mana_id.items()
+                if any(self.prizes[prize_id].auto_priced for prize_id in prize_ids)]
+
+    def prize_ids_for_purple_mana_id(self, purple_mana_id, auto_priced_only=True):
+        return [prize_id for prize_id in self._by_purple_mana_id.get(purple_mana_id, ())
+                if not auto_priced_only or self.prizes[prize_id].auto_priced]
+
+    def scrape_urls(self):
+        """One URL per listing that has an automatically priced prize on it"""
+        urls = []
+        for prize_ids in self._by_url.values():
+            auto = [prize_id for prize_id in prize_ids if self.prizes[prize_id].auto_priced]
+            if auto:
+                urls.append(self.prizes[auto[0]].tcgplayer_url)
+        return urls
+
+    def pushed_boxes(self):
+        return [box for box in self.boxes.values() if box.pushed]
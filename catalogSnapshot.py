@@ -0,0 +1,187 @@
+"""An on-disk copy of the catalog tables, brought up to date incrementally.
+
+catalogIndex reads prize and box through read_tables(). With a snapshot
+(the default) the rows come from a local sqlite file, one per database
+under CATALOG_SNAPSHOT_DIR, and only rows that changed since the last sync
+are fetched:
+
+    SELECT ... FROM prize WHERE xmin::text::bigint >= <marker>
+
+Every INSERT and UPDATE gives a row a new xmin, so rows written by
+transactions that started after the previous sync come back; the marker is
+the oldest transaction still running at that sync, so rows committed late
+by it are not missed. Hard DELETEs leave nothing to select, so when the
+row counts disagree the ids are compared and the missing rows dropped.
+
+Values are stored as JSON, with Decimal and UUID tagged so they read back
+as the same types a direct read returns. The sync starts over with a full
+read when there is no snapshot, when the columns asked for or the encoding
+changed, or when the transaction id epoch moved on (xmin is 32 bits and
+wraps around). Set CATALOG_SNAPSHOT_DIR to an empty string to read the
+tables directly every time.
+"""
+import decimal
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+import uuid
+
+import psycopg2
+
+import pipelineMetrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SNAPSHOT_DIR = 'catalog_snapshots'
+
+def snapshot_dir():
+    return os.getenv('CATALOG_SNAPSHOT_DIR', DEFAULT_SNAPSHOT_DIR)
+
+def snapshot_path(conn, directory):
+    """One file per server and database, so the replica and the primary keep separate snapshots"""
+    params = conn.get_dsn_parameters()
+    name = f"{params.get('host', 'local')}_{params.get('port', '5432')}_{params.get('dbname', '')}"
+    return os.path.join(directory, re.sub(r'[^A-Za-z0-9_.-]', '_', name) + '.sqlite3')
+
+# Bumped when the row encoding changes, so older snapshots are read again in full
+SNAPSHOT_FORMAT = 2
+
+def _encode_value(value):
+    # Numerics come back as Decimal; kept as their digits so a snapshot row reads back as the database's
+    if isinstance(value, decimal.Decimal):
+        return {'$decimal': str(value)}
+    if isinstance(value, uuid.UUID):
+        return {'$uuid': str(value)}
+    raise TypeError(f"Catalog snapshot can't store a {type(value).__name__}")
+
+def _decode_value(obj):
+    if '$decimal' in obj:
+        return decimal.Decimal(obj['$decimal'])
+    if '$uuid' in obj:
+        return uuid.UUID(obj['$uuid'])
+    return obj
+
+def _encode(row):
+    return json.dumps(list(row), default=_encode_value)
+
+def _decode(text):
+    return tuple(json.loads(text, object_hook=_decode_value))
+
+class CatalogSnapshot:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=60)
+        with self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def _meta(self, key):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def synced_at(self):
+        """When the snapshot was last brought up to date (epoch seconds), or None if it never was"""
+        value = self._meta('synced_at')
+        return float(value) if value is not None else None
+
+    def _ensure_table(self, table):
+        self._conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (id TEXT PRIMARY KEY, row TEXT NOT NULL)")
+
+    def sync(self, conn, tables):
+        """Bring the snapshot up to date from conn; tables is {table: columns}, id first.
+
+        Returns 'full' or 'incremental'.
+        """
+        layout = json.dumps({'format': SNAPSHOT_FORMAT, 'tables': tables}, sort_keys=True)
+        with conn.cursor() as cur:
+            cur.execute("SELECT txid_snapshot_xmin(txid_current_snapshot())")
+            next_marker = int(cur.fetchone()[0])
+        marker = self._meta('marker')
+        full = (marker is None or self._meta('layout') != layout
+                or int(marker) >> 32 != next_marker >> 32)
+        # BEGIN IMMEDIATE: another job syncing the same file waits instead of interleaving
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            for table, columns in tables.items():
+                self._sync_table(conn, table, columns, None if full else int(marker) & 0xFFFFFFFF)
+            self._conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                                   [('marker', str(next_marker)), ('layout', layout),
+                                    ('synced_at', str(time.time()))])
+            self._conn.commit()
+        except BaseException:
+            self._conn.rollback()
+            raise
+        return 'full' if full else 'incremental'
+
+    def _sync_table(self, conn, table, columns, marker):
+        self._ensure_table(table)
+        with conn.cursor() as cur, pipelineMetrics.timed('db_read', query=f'snapshot_{table}'):
+            if marker is None:
+                cur.execute(f"SELECT {', '.join(columns)} FROM {table}")
+            else:
+                cur.execute(f"SELECT {', '.join(columns)} FROM {table} WHERE xmin::text::bigint >= %s", (marker,))
+            rows = cur.fetchall()
+        if marker is None:
+            self._conn.execute(f"DELETE FROM {table}")
+        self._conn.executemany(f"INSERT OR REPLACE INTO {table} (id, row) VALUES (?, ?)",
+                               [(str(row[0]), _encode(row)) for row in rows])
+        removed = 0
+        if marker is not None:
+            removed = self._drop_deleted(conn, table)
+        logger.info(f"Catalog snapshot {table}: {len(rows)} rows {'loaded' if marker is None else 'changed'}"
+                    + (f", {removed} deleted" if removed else ""))
+
+    def _drop_deleted(self, conn, table):
+        """Remove rows DELETEd upstream; only lists ids when the counts say something is gone"""
+        local = self._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT COUNT(*) FROM {table}")
+            if cur.fetchone()[0] == local:
+                return 0
+            cur.execute(f"SELECT id FROM {table}")
+            remote = {str(row[0]) for row in cur.fetchall()}
+        gone = [(row_id,) for (row_id,) in self._conn.execute(f"SELECT id FROM {table}") if row_id not in remote]
+        self._conn.executemany(f"DELETE FROM {table} WHERE id = ?", gone)
+        return len(gone)
+
+    def rows(self, table):
+        self._ensure_table(table)
+        return [_decode(row) for (row,) in self._conn.execute(f"SELECT row FROM {table}")]
+
+    def close(self):
+        self._conn.close()
+
+def read_tables(conn, tables, allow_stale=False):
+    """{table: rows} for the catalog tables, through the snapshot unless CATALOG_SNAPSHOT_DIR is empty.
+
+    When the sync fails the error is raised, unless allow_stale: then callers
+    that only need ids and listings (the scrape queue, failure alerts) get the
+    last snapshot. The push never does, so it can't send old prices as current.
+    """
+    directory = snapshot_dir()
+    if not directory:
+        with conn.cursor() as cur, pipelineMetrics.timed('db_read', query='catalog'):
+            result = {}
+            for table, columns in tables.items():
+                cur.execute(f"SELECT {', '.join(columns)} FROM {table}")
+                result[table] = cur.fetchall()
+            return result
+
+    snapshot = CatalogSnapshot(snapshot_path(conn, directory))
+    try:
+        try:
+            mode = snapshot.sync(conn, tables)
+            pipelineMetrics.inc('catalog_syncs_total', mode=mode)
+        except psycopg2.Error as e:
+            synced_at = snapshot.synced_at()
+            if not allow_stale or synced_at is None:
+                raise
+            # A stale catalog beats no run; the next sync catches up
+            logger.warning(f"Catalog sync failed, using the snapshot from {time.ctime(synced_at)}: {e}")
+            pipelineMetrics.inc('catalog_syncs_total', mode='stale')
+        return {table: snapshot.rows(table) for table in tables}
+    finally:
+        snapshot.close()
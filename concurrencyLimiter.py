@@ -0,0 +1,115 @@
+"""How many Purple Mana requests to have in flight, adjusted as the API responds.
+
+AIMD, as TCP does it: every healthy response adds 1/limit to the limit
+(about one more slot per round of requests), and a 429, a 5xx, a failed
+connection or latency rising past LATENCY_TOLERANCE times the healthy
+baseline halves it. Responses to requests sent before the last cut don't
+cut again, so one burst of 429s halves the limit once rather than once per
+request.
+
+    limiter = AimdLimiter()
+    with limiter.slot() as labels:
+        response = session.get(url)
+        labels['status'] = response.status_code
+
+The thread pool is sized for MAX_LIMIT; slot() blocks until the limiter has
+room. report() gives the limit over time for the run report.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import pipelineMetrics
+
+logger = logging.getLogger(__name__)
+
+INITIAL_LIMIT = 8
+MIN_LIMIT = 1
+MAX_LIMIT = 64
+DECREASE_FACTOR = 0.5
+# Latency this many times the baseline counts as congestion
+LATENCY_TOLERANCE = 2.0
+EWMA_ALPHA = 0.2
+# The baseline creeps up this much per response, so a slower but steady API isn't punished forever
+BASELINE_DRIFT = 1.001
+
+class AimdLimiter:
+    def __init__(self, initial=INITIAL_LIMIT, min_limit=MIN_LIMIT, max_limit=MAX_LIMIT):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.in_flight = 0
+        self.ewma_seconds = None
+        self.baseline_seconds = None
+        self.last_decrease = 0.0
+        self.started = time.monotonic()
+        self.decreases = 0
+        # (seconds since start, limit), one entry per whole-number change
+        self.history = [(0.0, int(self.limit))]
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+            pipelineMetrics.set_gauge('api_in_flight', self.in_flight)
+
+    def release(self, sent_at, seconds, congested):
+        with self._cond:
+            self.in_flight -= 1
+            before = int(self.limit)
+            if not congested:
+                self._observe(seconds)
+                congested = self.ewma_seconds > self.baseline_seconds * LATENCY_TOLERANCE
+            if congested:
+                if sent_at >= self.last_decrease:
+                    self.limit = max(self.min_limit, self.limit * DECREASE_FACTOR)
+                    self.last_decrease = time.monotonic()
+                    self.decreases += 1
+                    # Judge the smaller limit on its own latency
+                    self.ewma_seconds = self.baseline_seconds
+            elif self.in_flight + 1 >= int(self.limit):
+                # Only grow while the limit is what's holding us back
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            if int(self.limit) != before:
+                self.history.append((round(time.monotonic() - self.started, 1), int(self.limit)))
+                pipelineMetrics.set_gauge('api_concurrency_limit', int(self.limit))
+                if int(self.limit) < before:
+                    logger.info(f"Purple Mana concurrency cut to {int(self.limit)} "
+                                f"(latency {self.ewma_seconds or 0:.2f}s, baseline {self.baseline_seconds or 0:.2f}s)")
+            self._cond.notify_all()
+
+    def _observe(self, seconds):
+        self.ewma_seconds = seconds if self.ewma_seconds is None else (
+            EWMA_ALPHA * seconds + (1 - EWMA_ALPHA) * self.ewma_seconds)
+        if self.baseline_seconds is None:
+            self.baseline_seconds = seconds
+        else:
+            self.baseline_seconds = min(self.baseline_seconds * BASELINE_DRIFT, self.ewma_seconds)
+
+    @contextmanager
+    def slot(self):
+        """Hold one in-flight slot; set labels['status'] so 429s and 5xx count as congestion"""
+        self.acquire()
+        labels = {}
+        sent_at = time.monotonic()
+        try:
+            yield labels
+        finally:
+            status = labels.get('status')
+            # No status means no answer (connection error, timeout), which is congestion too
+            congested = status is None or status == 429 or status >= 500
+            self.release(sent_at, time.monotonic() - sent_at, congested)
+
+    def report(self):
+        with self._cond:
+            limits = [limit for _, limit in self.history]
+            return {
+                "final_limit": int(self.limit),
+                "max_limit_reached": max(limits),
+                "decreases": self.decreases,
+                "baseline_seconds": round(self.baseline_seconds, 3) if self.baseline_seconds else None,
+                "history": [{"at_seconds": at, "limit": limit} for at, limit in self.history],
+            }
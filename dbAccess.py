@@ -0,0 +1,153 @@
+"""Database access for every job: one pool per process, primary and read replica.
+
+Each process keeps one Database per environment (database(config)), which
+lazily opens a ThreadedConnectionPool on the primary and, when
+<ENV>_DATABASE_REPLICA_URL is set, one on the replica. Every connection has
+TCP keepalives, so a dropped connection is noticed instead of hanging, and a
+statement_timeout (DATABASE_STATEMENT_TIMEOUT_MS) so one runaway query can't
+hold a job forever.
+
+Heavy read-only queries (the prize catalog, box payloads for the push) ask
+for connection(readonly=True) and go to the replica; writes and anything
+that must see its own writes stay on the primary. Without a replica both
+are the primary. Replica connections are read-only sessions, so a write
+routed there by mistake fails loudly.
+
+Pools block: with every connection handed out, getconn() waits for one to
+come back (up to DATABASE_POOL_WAIT_SECONDS) instead of raising PoolError,
+so more threads than connections just queue.
+
+Processes started with spawn (browserWorkers) build their own Database on
+first use.
+"""
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2.pool import PoolError, ThreadedConnectionPool
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STATEMENT_TIMEOUT_MS = 60000
+DEFAULT_POOL_MAX = 10
+# How long getconn() waits for a free connection before giving up with PoolError
+DEFAULT_POOL_WAIT_SECONDS = 60
+
+KEEPALIVE_PARAMS = {
+    'keepalives': 1,
+    'keepalives_idle': 30,
+    'keepalives_interval': 10,
+    'keepalives_count': 5,
+}
+
+def connect_params(db_params, readonly=False):
+    """psycopg2 connect kwargs with keepalives and the session settings every job wants"""
+    timeout_ms = int(os.getenv('DATABASE_STATEMENT_TIMEOUT_MS', DEFAULT_STATEMENT_TIMEOUT_MS))
+    options = f"-c statement_timeout={timeout_ms}"
+    if readonly:
+        options += " -c default_transaction_read_only=on"
+    return dict(db_params, **KEEPALIVE_PARAMS, application_name='pullbox-pricing', options=options)
+
+class BlockingConnectionPool(ThreadedConnectionPool):
+    """A ThreadedConnectionPool whose getconn() waits for a free connection instead of raising"""
+
+    def __init__(self, minconn, maxconn, *args, wait_seconds=None, **kwargs):
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self.wait_seconds = wait_seconds
+        super().__init__(minconn, maxconn, *args, **kwargs)
+
+    def getconn(self, key=None):
+        if not self._slots.acquire(timeout=self.wait_seconds):
+            raise PoolError(f"no database connection free after {self.wait_seconds}s")
+        try:
+            return super().getconn(key)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn=None, key=None, close=False):
+        super().putconn(conn, key, close)
+        self._slots.release()
+
+class Database:
+    def __init__(self, config, minconn=1, maxconn=None):
+        if not config.db_params:
+            raise RuntimeError(f"No database URL configured for {config.env}")
+        self.config = config
+        self.minconn = minconn
+        self.maxconn = maxconn or int(os.getenv('DATABASE_POOL_MAX', DEFAULT_POOL_MAX))
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    @property
+    def has_replica(self):
+        return self.config.replica_db_params is not None
+
+    def pool(self, readonly=False):
+        """The primary pool, or the replica's for readonly when there is a replica"""
+        role = 'replica' if readonly and self.has_replica else 'primary'
+        with self._lock:
+            if role not in self._pools:
+                db_params = self.config.replica_db_params if role == 'replica' else self.config.db_params
+                wait_seconds = float(os.getenv('DATABASE_POOL_WAIT_SECONDS', DEFAULT_POOL_WAIT_SECONDS))
+                self._pools[role] = BlockingConnectionPool(self.minconn, self.maxconn, wait_seconds=wait_seconds,
+                                                           **connect_params(db_params, readonly=role == 'replica'))
+                logger.info(f"Opened {role} database pool ({db_params['host']}, up to {self.maxconn} connections)")
+            return self._pools[role]
+
+    @contextmanager
+    def connection(self, readonly=False):
+        """A pooled connection, rolled back and returned afterwards; broken ones are discarded"""
+        pool = self.pool(readonly)
+        conn = pool.getconn()
+        try:
+            yield conn
+        finally:
+            if not conn.closed:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    pass
+            pool.putconn(conn, close=bool(conn.closed))
+
+    def connect(self, readonly=False):
+        """An unpooled connection, e.g. for sessions that change settings; the caller closes it"""
+        db_params = self.config.replica_db_params if readonly and self.has_replica else self.config.db_params
+        return psycopg2.connect(**connect_params(db_params, readonly=readonly and self.has_replica))
+
+    def ping(self):
+        """SELECT 1 on every open pool; raises if one fails"""
+        with self._lock:
+            roles = list(self._pools)
+        for role in roles:
+            with self.connection(readonly=role == 'replica') as conn, conn.cursor() as cur:
+                cur.execute("SELECT 1")
+
+    def close(self):
+        with self._lock:
+            pools, self._pools = self._pools, {}
+        for role, pool in pools.items():
+            try:
+                pool.closeall()
+            except psycopg2.Error as e:
+                logger.error(f"Error closing {role} database pool: {e}")
+
+_databases = {}
+_databases_lock = threading.Lock()
+
+def database(config, minconn=1, maxconn=None):
+    """This process's Database for the config's environment; sizes only apply on first use"""
+    with _databases_lock:
+        db = _databases.get(config.env)
+        if db is None:
+            db = _databases[config.env] = Database(config, minconn, maxconn)
+        return db
+
+def close_all():
+    with _databases_lock:
+        databases = list(_databases.values())
+        _databases.clear()
+    for db in databases:
+        db.close()
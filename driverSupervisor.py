@@ -0,0 +1,165 @@
+"""Keeping long scrape sessions fast by replacing browsers before they degrade.
+
+Chrome's memory grows over thousands of pages and a wedged renderer turns
+every later URL into a full selector timeout. Each scraper worker gets a
+DriverSupervisor that owns its browser and replaces it
+
+    - after SCRAPER_RECYCLE_PAGES pages,
+    - when the browser's process tree goes over SCRAPER_MAX_RSS_MB,
+    - after SCRAPER_MAX_CONSECUTIVE_TIMEOUTS timeouts in a row,
+    - when the browser is gone (crashed, closed, session lost), or
+    - when the scraper asks, e.g. to move off a throttled proxy.
+
+Workers pull URLs from one shared queue. When a browser is lost or wedged
+mid-URL, the scraper raises BrowserLost and the URL goes back on the queue
+(once) instead of being reported as a failed product.
+"""
+import logging
+import os
+import queue
+import threading
+
+import psutil
+from selenium.common.exceptions import TimeoutException
+
+import pipelineMetrics
+
+logger = logging.getLogger(__name__)
+
+RSS_CHECK_EVERY_PAGES = 10
+MAX_REQUEUES = 1
+
+# WebDriverException messages that mean the browser itself is gone
+BROWSER_LOST_MARKERS = ('invalid session id', 'chrome not reachable', 'no such window',
+                        'disconnected', 'target window already closed', 'session deleted')
+
+class BrowserLost(Exception):
+    """The browser died or wedged while a URL was in flight"""
+
+def is_browser_lost(error):
+    return isinstance(error, BrowserLost) or any(marker in str(error).lower() for marker in BROWSER_LOST_MARKERS)
+
+def check_error(supervisor, error):
+    """Hand a scrape error to the supervisor; raises BrowserLost when the browser is to blame"""
+    if supervisor is None:
+        return
+    if isinstance(error, TimeoutException):
+        supervisor.timed_out()
+    elif is_browser_lost(error):
+        raise BrowserLost(str(error)) from error
+
+def browser_rss_bytes(driver):
+    """Resident memory of the browser and all of its renderer/GPU processes"""
+    pid = getattr(driver, 'browser_pid', None)
+    if not pid:
+        return None
+    try:
+        browser = psutil.Process(pid)
+        processes = [browser] + browser.children(recursive=True)
+    except psutil.Error:
+        return None
+    total = 0
+    for process in processes:
+        try:
+            total += process.memory_info().rss
+        except psutil.Error:
+            pass
+    return total
+
+class UrlQueue:
+    """URLs shared by every worker; a URL can be put back a limited number of times"""
+
+    def __init__(self, urls):
+        self._queue = queue.Queue()
+        self._requeues = {}
+        self._lock = threading.Lock()
+        for url in urls:
+            self._queue.put(url)
+
+    def __iter__(self):
+        while True:
+            try:
+                yield self._queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def requeue(self, url):
+        """Put the URL back; False once it has used up its requeues"""
+        with self._lock:
+            count = self._requeues.get(url, 0)
+            if count >= MAX_REQUEUES:
+                return False
+            self._requeues[url] = count + 1
+        self._queue.put(url)
+        pipelineMetrics.inc('urls_requeued_total')
+        return True
+
+class DriverSupervisor:
+    """Owns one worker's browser and decides when to replace it"""
+
+    def __init__(self, position, start_driver, cleanup_driver, driver=None):
+        self.position = position
+        self.start_driver = start_driver
+        self.cleanup_driver = cleanup_driver
+        self.max_pages = int(os.getenv('SCRAPER_RECYCLE_PAGES', 500))
+        self.max_rss_bytes = float(os.getenv('SCRAPER_MAX_RSS_MB', 1500)) * 1024 * 1024
+        self.max_consecutive_timeouts = int(os.getenv('SCRAPER_MAX_CONSECUTIVE_TIMEOUTS', 3))
+        self.driver = driver
+        self.pages = 0
+        self.consecutive_timeouts = 0
+        self.recycles = 0
+        self._recycle_reason = None
+
+    def driver_for_next_page(self):
+        """The browser to load the next URL in, replacing the current one first if it is due"""
+        reason = self._recycle_reason or self._due_reason()
+        if self.driver is None:
+            self.driver = self.start_driver(self.position)
+        elif reason:
+            self.recycle(reason)
+        return self.driver
+
+    def _due_reason(self):
+        if self.pages >= self.max_pages:
+            return 'pages'
+        if self.pages and self.pages % RSS_CHECK_EVERY_PAGES == 0:
+            rss = browser_rss_bytes(self.driver)
+            if rss is not None:
+                pipelineMetrics.observe('browser_rss_bytes', rss, driver=self.position)
+                if rss > self.max_rss_bytes:
+                    return 'rss'
+        return None
+
+    def page_done(self):
+        self.pages += 1
+
+    def timed_out(self):
+        """Count a timeout; raises BrowserLost once there have been too many in a row"""
+        self.consecutive_timeouts += 1
+        if self.consecutive_timeouts >= self.max_consecutive_timeouts:
+            self._recycle_reason = 'timeouts'
+            raise BrowserLost(f"{self.consecutive_timeouts} consecutive timeouts")
+
+    def succeeded(self):
+        self.consecutive_timeouts = 0
+
+    def request_recycle(self, reason):
+        """Replace the browser before its next page, e.g. to move it to another proxy"""
+        self._recycle_reason = self._recycle_reason or reason
+
+    def lost(self, error):
+        """The browser died under a URL; replace it before the next one"""
+        self._recycle_reason = self._recycle_reason or 'lost'
+        logger.warning(f"Driver #{self.position} lost: {error}")
+
+    def recycle(self, reason):
+        logger.info(f"Recycling driver #{self.position} after {self.pages} pages ({reason})")
+        pipelineMetrics.inc('driver_recycles_total', driver=self.position, reason=reason)
+        with pipelineMetrics.timed('driver_recycle', driver=self.position):
+            self.cleanup_driver(self.driver)
+            self.driver = None
+            self.driver = self.start_driver(self.position)
+        self.pages = 0
+        self.consecutive_timeouts = 0
+        self.recycles += 1
+        self._recycle_reason = None
@@ -0,0 +1,207 @@
+"""Retries, backoff and per-host circuit breakers for every outbound HTTP call.
+
+    response = httpPolicy.get(url, session=session)
+    response = httpPolicy.post(webhook_url, json=message)
+
+A request that gets no answer (connection error, timeout) or a 429/5xx is
+retried up to `retries` times, sleeping backoff_delay() between attempts:
+exponential with jitter, or the server's Retry-After when it sends one.
+What comes back after the last attempt is returned as is, so callers keep
+their own raise_for_status() / response.ok handling.
+
+Each host has a CircuitBreaker. FAILURE_THRESHOLD failed attempts in a row
+open it, and for OPEN_SECONDS every call to that host fails at once with
+CircuitOpenError (a requests ConnectionError, so existing
+`except requests.RequestException` handlers cover it) instead of piling
+onto an upstream that is down. After that one trial request is let through;
+its outcome closes or reopens the breaker. Batch callers, whose items would
+otherwise fail for the rest of the run over a short blip, pass
+wait_for_circuit=True to sit the open window out (up to
+MAX_CIRCUIT_WAIT_SECONDS) and then try again.
+
+POSTs are retried too: Pullbox pushes replace the box by id, and a Discord
+message sent twice beats one never sent.
+"""
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+
+import pipelineMetrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RETRIES = 3
+BASE_DELAY_SECONDS = 0.5
+MAX_DELAY_SECONDS = 30
+# A Retry-After longer than this isn't waited out; the response is returned instead
+MAX_RETRY_AFTER_SECONDS = 60
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# (connect, read) for calls that don't pass their own
+DEFAULT_TIMEOUT = (10, 30)
+
+FAILURE_THRESHOLD = 5
+OPEN_SECONDS = 30
+# Longest a wait_for_circuit caller sits out open circuits before giving up with CircuitOpenError
+MAX_CIRCUIT_WAIT_SECONDS = 120
+# How often a caller waiting behind a half-open trial checks again
+TRIAL_POLL_SECONDS = 1.0
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    pass
+
+def backoff_delay(attempt, base=BASE_DELAY_SECONDS, cap=MAX_DELAY_SECONDS):
+    """Seconds to wait before retry number attempt (1-based): half the exponential step fixed, half jitter"""
+    delay = min(cap, base * 2 ** max(0, attempt - 1))
+    return random.uniform(delay / 2, delay)
+
+def retry_after_seconds(response):
+    """The response's Retry-After in seconds (delta or HTTP date), or None"""
+    value = response.headers.get('Retry-After') if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class CircuitBreaker:
+    def __init__(self, host, failure_threshold=FAILURE_THRESHOLD, open_seconds=OPEN_SECONDS):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at < self.open_seconds:
+            return 'open'
+        return 'half_open'
+
+    def allow(self):
+        """Whether a request may go out now; in half-open only one trial at a time"""
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def seconds_until_trial(self):
+        """How long until a request might be let through again"""
+        with self._lock:
+            if self.opened_at is None:
+                return 0.0
+            remaining = self.open_seconds - (time.monotonic() - self.opened_at)
+            return remaining if remaining > 0 else TRIAL_POLL_SECONDS
+
+    def record(self, ok):
+        with self._lock:
+            self.trial_in_flight = False
+            if ok:
+                if self.opened_at is not None:
+                    logger.info(f"Circuit for {self.host} closed")
+                self.failures = 0
+                self.opened_at = None
+                return
+            self.failures += 1
+            # Open on reaching the threshold, or again when the half-open trial fails; failures of
+            # requests already in flight when it opened don't extend it
+            if (self.opened_at is None and self.failures >= self.failure_threshold) or self.state == 'half_open':
+                logger.warning(f"Circuit for {self.host} opened after {self.failures} failures; "
+                               f"failing fast for {self.open_seconds}s")
+                pipelineMetrics.inc('http_circuit_opened_total', host=self.host)
+                self.opened_at = time.monotonic()
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def breaker_for(url):
+    host = urlsplit(url).netloc
+    with _breakers_lock:
+        breaker = _breakers.get(host)
+        if breaker is None:
+            breaker = _breakers[host] = CircuitBreaker(host)
+        return breaker
+
+def wait_for_breaker(breaker, deadline):
+    """Block until the breaker lets a request through; raises CircuitOpenError once past deadline"""
+    while not breaker.allow():
+        wait = breaker.seconds_until_trial()
+        if time.monotonic() + wait > deadline:
+            pipelineMetrics.inc('http_requests_total', host=breaker.host, outcome='circuit_open')
+            raise CircuitOpenError(f"Circuit for {breaker.host} is open")
+        logger.info(f"Circuit for {breaker.host} is open, waiting {wait:.1f}s")
+        time.sleep(wait)
+
+def request(method, url, session=None, retries=DEFAULT_RETRIES, limiter=None, wait_for_circuit=False, **kwargs):
+    """Send the request under the retry policy and the host's breaker; returns the last response.
+
+    Raises CircuitOpenError when the host's circuit is open (with
+    wait_for_circuit, only once it has stayed open for
+    MAX_CIRCUIT_WAIT_SECONDS), or the last RequestException when no attempt
+    got a response. With a limiter (concurrencyLimiter.AimdLimiter) each
+    attempt holds one of its slots; the backoff sleeps don't.
+    """
+    kwargs.setdefault('timeout', DEFAULT_TIMEOUT)
+    breaker = breaker_for(url)
+    # Without wait_for_circuit an open circuit fails the call at once
+    deadline = time.monotonic() + (MAX_CIRCUIT_WAIT_SECONDS if wait_for_circuit else 0)
+    attempt = 0
+    while True:
+        attempt += 1
+        wait_for_breaker(breaker, deadline)
+        response = error = None
+        ok = False
+        try:
+            try:
+                if limiter is not None:
+                    with limiter.slot() as slot:
+                        response = (session or requests).request(method, url, **kwargs)
+                        slot['status'] = response.status_code
+                else:
+                    response = (session or requests).request(method, url, **kwargs)
+            except requests.exceptions.RequestException as e:
+                error = e
+            failed = error is not None or response.status_code in RETRY_STATUSES
+            # A 429 is the host pacing us, not the host being down
+            ok = not failed or (response is not None and response.status_code == 429)
+        finally:
+            # Always recorded, so a half-open trial that raised something else still frees the breaker
+            breaker.record(ok)
+
+        if not failed:
+            pipelineMetrics.inc('http_requests_total', host=breaker.host, outcome='ok')
+            return response
+        wait = retry_after_seconds(response)
+        if attempt > retries or (wait is not None and wait > MAX_RETRY_AFTER_SECONDS):
+            pipelineMetrics.inc('http_requests_total', host=breaker.host, outcome='error')
+            if error is not None:
+                raise error
+            return response
+        wait = wait if wait is not None else backoff_delay(attempt)
+        reason = type(error).__name__ if error is not None else response.status_code
+        logger.info(f"{method} {breaker.host} failed ({reason}), retry {attempt}/{retries} in {wait:.1f}s")
+        pipelineMetrics.inc('http_retries_total', host=breaker.host)
+        time.sleep(wait)
+
+def get(url, session=None, **kwargs):
+    return request('GET', url, session=session, **kwargs)
+
+def post(url, session=None, **kwargs):
+    return request('POST', url, session=session, **kwargs)
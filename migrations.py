@@ -0,0 +1,228 @@
+"""Schema changes the pricing jobs depend on, applied in order and recorded.
+
+    python pricingCli.py migrate --env staging            # apply what's pending
+    python pricingCli.py migrate --env staging --status   # list applied/pending
+    python pricingCli.py migrate --env production --check # EXPLAIN the hot queries
+
+Each migration runs once and is recorded in schema_migrations. Indexes on
+the live prize and box tables are built with CREATE INDEX CONCURRENTLY so
+the jobs keep writing while they build; those migrations run outside a
+transaction, one statement at a time, and every statement is safe to re-run
+if a build is interrupted.
+
+The scrape queue, failure alerts and full push read from catalogIndex, so
+the only indexes here are for the writes and the per-box reads.
+
+--check EXPLAINs every query in HOT_QUERIES and flags sequential scans of
+tables larger than SEQ_SCAN_MIN_ROWS. Tiny tables are always seq-scanned and
+are not flagged.
+"""
+import json
+import logging
+from contextlib import closing
+
+import psycopg2
+
+logger = logging.getLogger(__name__)
+
+SEQ_SCAN_MIN_ROWS = 1000
+
+# (version, name, transactional, statements)
+MIGRATIONS = [
+    (1, 'prize_tcgplayer_url_index', False, [
+        # UPDATE prize ... WHERE tcgplayer_url = %s in every scraper
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS prize_tcgplayer_url_idx ON prize (tcgplayer_url)",
+    ]),
+    (2, 'prize_box_id_index', False, [
+        # Every box's prizes on push, with and without the is_deleted filter
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS prize_box_id_idx ON prize (box_id)",
+    ]),
+    (3, 'price_scrape_failures', True, [
+        # The table testScripts/newScrapingAlgorythm.py has always created; scrapeFailures writes it.
+        # Databases that already have it (or an older cut of it) get the missing columns.
+        """CREATE TABLE IF NOT EXISTS price_scrape_failures (
+               tcgplayer_url TEXT PRIMARY KEY,
+               failure_count INTEGER DEFAULT 0,
+               last_failure_date DATE,
+               consecutive_days INTEGER DEFAULT 0,
+               last_success_date DATE
+           )""",
+        "ALTER TABLE price_scrape_failures ADD COLUMN IF NOT EXISTS failure_count INTEGER DEFAULT 0",
+        "ALTER TABLE price_scrape_failures ADD COLUMN IF NOT EXISTS last_failure_date DATE",
+        "ALTER TABLE price_scrape_failures ADD COLUMN IF NOT EXISTS consecutive_days INTEGER DEFAULT 0",
+        "ALTER TABLE price_scrape_failures ADD COLUMN IF NOT EXISTS last_success_date DATE",
+    ]),
+    (4, 'prize_change_notify', True, [
+        # One NOTIFY per box whose prizes changed value, moved or were deleted, for boxListener.
+        # Statement-level with transition tables, so a bulk price UPDATE costs one pass, not a call per row;
+        # NOTIFY is delivered on commit and repeats of a box within a transaction collapse into one.
+        """CREATE OR REPLACE FUNCTION notify_prize_change() RETURNS trigger AS $$
+           BEGIN
+               PERFORM pg_notify('prize_value_changed', changed.box_id::text)
+               FROM (
+                   SELECT n.box_id FROM new_rows n JOIN old_rows o ON o.id = n.id
+                   WHERE n.value IS DISTINCT FROM o.value
+                      OR n.is_deleted IS DISTINCT FROM o.is_deleted
+                      OR n.box_id IS DISTINCT FROM o.box_id
+                   UNION
+                   SELECT o.box_id FROM new_rows n JOIN old_rows o ON o.id = n.id
+                   WHERE n.box_id IS DISTINCT FROM o.box_id
+               ) changed
+               WHERE changed.box_id IS NOT NULL;
+               RETURN NULL;
+           END
+           $$ LANGUAGE plpgsql""",
+        "DROP TRIGGER IF EXISTS prize_change_notify ON prize",
+        """CREATE TRIGGER prize_change_notify AFTER UPDATE ON prize
+           REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+           FOR EACH STATEMENT EXECUTE PROCEDURE notify_prize_change()""",
+    ]),
+]
+
+# name -> (query, sample parameters or None); EXPLAIN without ANALYZE, so the UPDATEs don't run.
+# The scrape queue, failure alerts and full push read from catalogIndex, whose loads are whole-table
+# or xmin reads no index helps, so only the writes and the listener's per-box reads are here.
+HOT_QUERIES = {
+    'scraper_update_by_url': (
+        "UPDATE prize SET value = %s WHERE tcgplayer_url = %s",
+        (0, 'https://www.tcgplayer.com/product/0'),
+    ),
+    'scraper_update_by_ids': (
+        "UPDATE prize SET value = %s WHERE id = ANY(%s::uuid[])",
+        (0, ['00000000-0000-0000-0000-000000000000']),
+    ),
+    'push_changed_boxes': (
+        "SELECT id, name, image_url, slug, is_live, category, tags, splash_image, edge, is_hidden "
+        "from box where id = ANY(%s::uuid[])",
+        (['00000000-0000-0000-0000-000000000000'],),
+    ),
+    'push_box_prizes': (
+        "select name, weight, value, condition, set, finish, mass, mass_unit, image, withdrawable, id "
+        "from prize where box_id = %s and is_deleted = False",
+        ('00000000-0000-0000-0000-000000000000',),
+    ),
+}
+
+def ensure_migrations_table(conn):
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version integer PRIMARY KEY,
+                name text NOT NULL,
+                applied_at timestamptz NOT NULL DEFAULT now()
+            )
+        """)
+    conn.commit()
+
+def applied_versions(conn, create=True):
+    if create:
+        ensure_migrations_table(conn)
+    else:
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regclass('schema_migrations')")
+            if cur.fetchone()[0] is None:
+                conn.commit()
+                return set()
+    with conn.cursor() as cur:
+        cur.execute("SELECT version FROM schema_migrations")
+        versions = {row[0] for row in cur.fetchall()}
+    conn.commit()
+    return versions
+
+def pending_migrations(conn, create=True):
+    applied = applied_versions(conn, create)
+    return [migration for migration in MIGRATIONS if migration[0] not in applied]
+
+def apply_migration(conn, version, name, transactional, statements):
+    logger.info(f"Applying migration {version} ({name})")
+    if transactional:
+        with conn.cursor() as cur:
+            for statement in statements:
+                cur.execute(statement)
+            cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+        conn.commit()
+        return
+    # CREATE INDEX CONCURRENTLY refuses to run inside a transaction block
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            for statement in statements:
+                cur.execute(statement)
+            cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+    finally:
+        conn.autocommit = False
+
+def migrate(config):
+    """Apply every pending migration; returns the versions applied"""
+    applied = []
+    # Its own session: index builds outlast the jobs' statement_timeout
+    with closing(config.connect()) as conn:
+        with conn.cursor() as cur:
+            cur.execute("SET statement_timeout = 0")
+        conn.commit()
+        for migration in pending_migrations(conn):
+            try:
+                apply_migration(conn, *migration)
+            except psycopg2.Error as e:
+                conn.rollback()
+                # An interrupted CONCURRENTLY build leaves an INVALID index that IF NOT EXISTS skips
+                logger.error(f"Migration {migration[0]} ({migration[1]}) failed: {e}. If it built an index, "
+                             f"drop any INVALID index it left behind before re-running.")
+                raise
+            applied.append(migration[0])
+    print(f"Applied {len(applied)} migrations" + (f": {', '.join(map(str, applied))}" if applied else ""))
+    return applied
+
+def status(config):
+    with config.connection() as conn:
+        applied = applied_versions(conn)
+    for version, name, _, _ in MIGRATIONS:
+        print(f"{version:>4}  {'applied' if version in applied else 'pending':<8} {name}")
+    return [version for version, _, _, _ in MIGRATIONS if version not in applied]
+
+def verify(config):
+    """Warn about pending migrations; for job startup, so it never raises or writes"""
+    try:
+        with config.connection() as conn:
+            pending = pending_migrations(conn, create=False)
+    except Exception as e:
+        logger.warning(f"Could not check schema migrations: {e}")
+        return None
+    if pending:
+        logger.warning(f"{len(pending)} schema migrations pending "
+                       f"({', '.join(name for _, name, _, _ in pending)}); "
+                       f"run: python pricingCli.py migrate --env {config.env}")
+    return pending
+
+def seq_scans(plan):
+    """Every relation the plan reads with a sequential scan"""
+    found = []
+    if plan.get('Node Type') == 'Seq Scan':
+        found.append(plan.get('Relation Name'))
+    for child in plan.get('Plans', []):
+        found.extend(seq_scans(child))
+    return found
+
+def check_queries(config):
+    """EXPLAIN the hot queries; returns {name: [tables seq-scanned]} for the ones that need attention"""
+    flagged = {}
+    with config.connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT relname, reltuples FROM pg_class
+            WHERE relkind = 'r' AND relnamespace = 'public'::regnamespace
+        """)
+        table_rows = dict(cur.fetchall())
+        for name, (query, params) in HOT_QUERIES.items():
+            cur.execute("EXPLAIN (FORMAT JSON) " + query, params)
+            plan = cur.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            scanned = [table for table in seq_scans(plan[0]['Plan'])
+                       if table_rows.get(table, 0) >= SEQ_SCAN_MIN_ROWS]
+            if scanned:
+                flagged[name] = scanned
+                print(f"SEQ SCAN  {name}: {', '.join(f'{t} (~{int(table_rows[t])} rows)' for t in scanned)}")
+            else:
+                print(f"ok        {name}")
+        conn.rollback()
+    return flagged
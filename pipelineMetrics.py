@@ -0,0 +1,217 @@
+"""Per-stage counters and latency histograms for the pricing and push jobs.
+
+Every job records into the module-level registry and calls export_run() at
+the end, which writes a Prometheus textfile (<job>.prom, for node_exporter's
+textfile collector) and a JSON run report into METRICS_DIR.
+"""
+import json
+import math
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+METRIC_PREFIX = "pullbox_"
+
+# Seconds; wide enough for a 45s Pullbox POST and a 20s selector wait
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+# Raw samples kept per series for the report's percentiles
+MAX_SAMPLES = 10000
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+def _escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.samples = []
+        self._random = random.Random(0)
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+        # Reservoir sampling keeps percentiles honest on long runs
+        if len(self.samples) < MAX_SAMPLES:
+            self.samples.append(value)
+        else:
+            slot = self._random.randrange(self.count)
+            if slot < MAX_SAMPLES:
+                self.samples[slot] = value
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.started_at = datetime.now()
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self.gauges.clear()
+            self.started_at = datetime.now()
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self.gauges[(name, _label_key(labels))] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timed(self, stage, **labels):
+        """Time a stage; the body may add labels (e.g. status) to the yielded dict"""
+        labels = dict(labels)
+        start = time.perf_counter()
+        try:
+            yield labels
+        except BaseException as e:
+            labels.setdefault('error_class', type(e).__name__)
+            raise
+        finally:
+            self.record_stage(stage, time.perf_counter() - start, **labels)
+
+    def record_stage(self, stage, seconds, **labels):
+        """Record a stage timed by the caller, for blocks too long to wrap in timed()"""
+        outcome = 'error' if 'error_class' in labels else 'ok'
+        self.observe('stage_seconds', seconds, stage=stage, **labels)
+        self.inc('stage_total', stage=stage, outcome=outcome, **labels)
+
+    def to_prometheus(self, job=None):
+        """Render every series; job is added as a label so per-job files can share a collector"""
+        job_label = [('job', job)] if job else []
+        with self._lock:
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+            histograms = {key: (h.buckets, list(h.bucket_counts), h.count, h.sum)
+                          for key, h in self.histograms.items()}
+
+        def fmt(labels, extra=()):
+            pairs = job_label + list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{k}="{_escape_label(v)}"' for k, v in pairs) + "}"
+
+        lines = []
+        for kind, series in (('counter', counters), ('gauge', gauges)):
+            for name in sorted({name for name, _ in series}):
+                lines.append(f"# TYPE {METRIC_PREFIX}{name} {kind}")
+                for (series_name, labels), value in sorted(series.items()):
+                    if series_name == name:
+                        lines.append(f"{METRIC_PREFIX}{name}{fmt(labels)} {value}")
+        for name in sorted({name for name, _ in histograms}):
+            lines.append(f"# TYPE {METRIC_PREFIX}{name} histogram")
+            for (series_name, labels), (buckets, bucket_counts, count, total) in sorted(histograms.items()):
+                if series_name != name:
+                    continue
+                for bound, bucket_count in zip(buckets, bucket_counts):
+                    lines.append(f"{METRIC_PREFIX}{name}_bucket{fmt(labels, [('le', str(bound))])} {bucket_count}")
+                lines.append(f"{METRIC_PREFIX}{name}_bucket{fmt(labels, [('le', '+Inf')])} {count}")
+                lines.append(f"{METRIC_PREFIX}{name}_sum{fmt(labels)} {total}")
+                lines.append(f"{METRIC_PREFIX}{name}_count{fmt(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def to_report(self, job, extra=None):
+        finished_at = datetime.now()
+        with self._lock:
+            counters = [{"name": name, "labels": dict(labels), "value": value}
+                        for (name, labels), value in sorted(self.counters.items())]
+            gauges = [{"name": name, "labels": dict(labels), "value": value}
+                      for (name, labels), value in sorted(self.gauges.items())]
+            histograms = []
+            for (name, labels), h in sorted(self.histograms.items()):
+                histograms.append({
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": h.count,
+                    "total_seconds": round(h.sum, 4),
+                    "mean_ms": round(h.sum / h.count * 1000, 2) if h.count else None,
+                    "p50_ms": round(percentile(h.samples, 50) * 1000, 2) if h.samples else None,
+                    "p90_ms": round(percentile(h.samples, 90) * 1000, 2) if h.samples else None,
+                    "p99_ms": round(percentile(h.samples, 99) * 1000, 2) if h.samples else None,
+                    "max_ms": round(max(h.samples) * 1000, 2) if h.samples else None,
+                })
+        # Where the run spent its time, biggest stage first
+        stage_totals = {}
+        for h in histograms:
+            if h["name"] == "stage_seconds":
+                stage = h["labels"].get("stage")
+                stage_totals[stage] = stage_totals.get(stage, 0) + h["total_seconds"]
+        report = {
+            "job": job,
+            "started_at": self.started_at.isoformat(timespec='seconds'),
+            "finished_at": finished_at.isoformat(timespec='seconds'),
+            "wall_seconds": round((finished_at - self.started_at).total_seconds(), 3),
+            "stage_seconds": dict(sorted(stage_totals.items(), key=lambda item: -item[1])),
+            "counters": counters,
+            "gauges": gauges,
+            "histograms": histograms,
+        }
+        if extra:
+            report.update(extra)
+        return report
+
+registry = MetricsRegistry()
+
+inc = registry.inc
+set_gauge = registry.set_gauge
+observe = registry.observe
+timed = registry.timed
+record_stage = registry.record_stage
+
+def export_run(job, output_dir=None, extra=None, rolling=False):
+    """Write <job>.prom and a timestamped JSON run report; returns their paths.
+
+    Long-running jobs that export periodically pass rolling=True to overwrite
+    one <job>_run.json instead of leaving a report per export.
+    """
+    output_dir = output_dir or os.getenv('METRICS_DIR', 'metrics')
+    os.makedirs(output_dir, exist_ok=True)
+    prom_path = os.path.join(output_dir, f"{job}.prom")
+    # Write then rename so the textfile collector never reads a partial file
+    with open(prom_path + ".tmp", 'w') as f:
+        f.write(registry.to_prometheus(job))
+    os.replace(prom_path + ".tmp", prom_path)
+
+    if rolling:
+        report_path = os.path.join(output_dir, f"{job}_run.json")
+    else:
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        report_path = os.path.join(output_dir, f"{job}_run_{timestamp}.json")
+    with open(report_path + ".tmp", 'w') as f:
+        json.dump(registry.to_report(job, extra), f, indent=2)
+    os.replace(report_path + ".tmp", report_path)
+    print(f"Metrics written to {prom_path} and {report_path}")
+    return prom_path, report_path
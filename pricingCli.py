@@ -0,0 +1,169 @@
+"""Single entry point for the pricing and push jobs.
+
+    python pricingCli.py price-api --env production
+    python pricingCli.py scrape --env staging --drivers 2
+    python pricingCli.py push --env production
+    python pricingCli.py push --env production --drain-outbox
+    python pricingCli.py push --targets staging production --source production
+    python pricingCli.py push --env production --listen
+    python pricingCli.py resolve --env staging --profile cpu
+    python pricingCli.py daemon --env production --scrape-interval 360
+    python pricingCli.py price-api --env staging --cache-ttl 60
+    python pricingCli.py migrate --env production --check
+
+Each subcommand imports its job module only when it runs, so API-only and
+push jobs never load selenium, undetected_chromedriver or pyautogui and
+start fine on machines without a display.
+"""
+import argparse
+
+import profilingHooks
+import responseCache
+from pricingConfig import ENVIRONMENTS, load_config
+
+def run_price_api(config, args):
+    import updatePrizePricing
+    updatePrizePricing.main(config)
+
+def default_scraper(config):
+    """Production has always run the single-pass scraper, staging the retrying one"""
+    return 'single-pass' if config.env == 'production' else 'retry'
+
+def run_scrape(config, args):
+    engine = args.scraper or default_scraper(config)
+    if (args.isolate or args.tabs > 1) and engine != 'retry':
+        raise SystemExit("--isolate and --tabs are only supported with --scraper retry")
+    if args.isolate and args.tabs > 1:
+        raise SystemExit("--isolate and --tabs cannot be combined")
+    if engine == 'retry':
+        import updateWithScrapingNoVPN as scraper
+        scraper.main(config, num_drivers=args.drivers or 2, isolate=args.isolate, tabs=args.tabs)
+    else:
+        import updatePrizePricingWithScraping as scraper
+        scraper.main(config, num_drivers=args.drivers or 4)
+
+def run_push(config, args):
+    targets = [load_config(env) for env in args.targets] if args.targets else [config]
+    if args.drain_outbox:
+        import pushOutbox
+        with profilingHooks.stage('push'):
+            for target in targets:
+                pushOutbox.drain(target, force=args.force)
+        return
+    if args.listen:
+        import boxListener
+        source = load_config(args.source) if args.source and args.source != config.env else config
+        boxListener.main(source, targets, debounce_seconds=args.debounce)
+        return
+    import pushBoxes
+    # Targets reading the same database share one build of the payloads
+    by_source = {}
+    for target in targets:
+        by_source.setdefault(args.source or target.env, []).append(target)
+    with profilingHooks.stage('push'):
+        for source_env, source_targets in by_source.items():
+            source = config if source_env == config.env else load_config(source_env)
+            pushBoxes.push_targets(source, source_targets)
+
+def run_resolve(config, args):
+    import resolvePrizePricing
+    resolvePrizePricing.main(config)
+
+def run_daemon(config, args):
+    import pricingDaemon
+    pricingDaemon.main(config, api_interval=args.api_interval, scrape_interval=args.scrape_interval,
+                       push_interval=args.push_interval, num_drivers=args.drivers)
+
+def run_migrate(config, args):
+    import migrations
+    if args.status:
+        migrations.status(config)
+    elif args.check:
+        if migrations.check_queries(config):
+            raise SystemExit(1)
+    else:
+        migrations.migrate(config)
+
+def build_parser():
+    # --env is accepted before or after the subcommand; profiling flags go after it
+    env_parent = argparse.ArgumentParser(add_help=False)
+    env_parent.add_argument('--env', choices=sorted(ENVIRONMENTS), default=argparse.SUPPRESS,
+                            help="which database and Pullbox API to use (default: staging)")
+    common = argparse.ArgumentParser(add_help=False, parents=[env_parent])
+    profilingHooks.add_arguments(common)
+    # Only for the jobs that fetch prices; pushes always send what's in the database
+    fetching = argparse.ArgumentParser(add_help=False)
+    responseCache.add_arguments(fetching)
+
+    parser = argparse.ArgumentParser(description="Pullbox pricing jobs", parents=[env_parent])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    price_api = subparsers.add_parser('price-api', parents=[common, fetching],
+                                      help="refresh prize values from the Purple Mana API")
+    price_api.set_defaults(handler=run_price_api)
+
+    scrape = subparsers.add_parser('scrape', parents=[common, fetching],
+                                   help="refresh prize values by scraping TCGplayer")
+    scrape.add_argument('--drivers', type=int, help="number of browsers")
+    scrape.add_argument('--scraper', choices=['retry', 'single-pass'],
+                        help="retry: two attempts per URL, failures left untouched; "
+                             "single-pass: one attempt, failures written as 0")
+    scrape.add_argument('--isolate', action='store_true',
+                        help="run each browser in its own worker process, restarted if it dies or hangs")
+    scrape.add_argument('--tabs', type=int, default=1,
+                        help="pages loading at once per browser, each in its own tab")
+    scrape.set_defaults(handler=run_scrape)
+
+    push = subparsers.add_parser('push', parents=[common], help="push every live box to Pullbox")
+    push.add_argument('--targets', nargs='+', choices=sorted(ENVIRONMENTS),
+                      help="Pullbox environments to push to (default: --env)")
+    push.add_argument('--source', choices=sorted(ENVIRONMENTS),
+                      help="database to build every target's boxes from (default: each target's own)")
+    push.add_argument('--drain-outbox', action='store_true',
+                      help="only retry boxes whose last push failed, without reading the database")
+    push.add_argument('--force', action='store_true', help="with --drain-outbox, ignore the retry backoff")
+    push.add_argument('--listen', action='store_true',
+                      help="stay running and push each box seconds after its prices change")
+    push.add_argument('--debounce', type=float, default=5,
+                      help="with --listen, seconds a box must go without changes before it is pushed")
+    push.set_defaults(handler=run_push)
+
+    resolve = subparsers.add_parser('resolve', parents=[common, fetching],
+                                    help="API first, browser scrape only for what the API misses")
+    resolve.set_defaults(handler=run_resolve)
+
+    daemon = subparsers.add_parser('daemon', parents=[common],
+                                   help="keep pools and browsers warm and run the jobs on intervals")
+    daemon.add_argument('--api-interval', type=float, default=60, help="minutes between API refreshes (0 disables)")
+    daemon.add_argument('--scrape-interval', type=float, default=360, help="minutes between scrapes (0 disables)")
+    daemon.add_argument('--push-interval', type=float, default=60, help="minutes between pushes (0 disables)")
+    daemon.add_argument('--drivers', type=int, default=2, help="browsers kept open for scraping")
+    daemon.set_defaults(handler=run_daemon)
+
+    migrate = subparsers.add_parser('migrate', parents=[common], help="apply pending schema migrations")
+    mode = migrate.add_mutually_exclusive_group()
+    mode.add_argument('--status', action='store_true', help="list applied and pending migrations")
+    mode.add_argument('--check', action='store_true',
+                      help="EXPLAIN the hot queries and exit 1 if any seq-scans a large table")
+    migrate.set_defaults(handler=run_migrate)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if not hasattr(args, 'env'):
+        args.env = 'staging'
+    profilingHooks.configure(f"{args.command}-{args.env}", args=args)
+    responseCache.configure(args)
+    config = load_config(args.env)
+    # Draining the outbox has to work while the database is down
+    if args.command != 'migrate' and not getattr(args, 'drain_outbox', False):
+        import migrations
+        migrations.verify(config)
+    try:
+        args.handler(config, args)
+    finally:
+        import dbAccess
+        dbAccess.close_all()
+
+if __name__ == "__main__":
+    main()
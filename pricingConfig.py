@@ -0,0 +1,93 @@
+"""One place that knows which env vars each environment uses.
+
+Every job takes a PricingConfig instead of reading STAGING_*/PRODUCTION_*
+variables itself, so the staging and production copies of a job only differ
+in the config they are handed. Connections come from dbAccess through
+config.connection().
+"""
+import os
+from urllib.parse import urlparse
+
+from dotenv import load_dotenv
+
+ENVIRONMENTS = {
+    'staging': {
+        'database_url': 'STAGING_DATABASE_URL',
+        'database_replica_url': 'STAGING_DATABASE_REPLICA_URL',
+        'pullbox_api_key': 'PULLBOX_API_KEY',
+        'pullbox_api_url': 'PULLBOX_API_URL',
+    },
+    'production': {
+        'database_url': 'PRODUCTION_DATABASE_URL',
+        'database_replica_url': 'PRODUCTION_DATABASE_REPLICA_URL',
+        'pullbox_api_key': 'PRODUCTION_PULLBOX_API_KEY',
+        'pullbox_api_url': 'PRODUCTION_PULLBOX_API_URL',
+    },
+}
+
+DEFAULT_PURPLE_MANA_API_URL = "https://www.purplemana.com/api/trpc/catalogProducts.getOne,catalogProducts.getSalesHistory"
+
+def parse_database_url(database_url, sslmode='require'):
+    """psycopg2 connect kwargs for a postgres:// URL"""
+    parsed_url = urlparse(database_url)
+    return {
+        'dbname': parsed_url.path[1:],
+        'user': parsed_url.username,
+        'password': parsed_url.password,
+        'host': parsed_url.hostname,
+        'port': parsed_url.port or 5432,
+        'sslmode': sslmode,
+    }
+
+class PricingConfig:
+    def __init__(self, env, database_url, pullbox_api_url=None, pullbox_api_key=None,
+                 discord_webhook_url=None, failed_webhook_url=None,
+                 purple_mana_api_url=DEFAULT_PURPLE_MANA_API_URL, sslmode='require', database_replica_url=None):
+        self.env = env
+        self.database_url = database_url
+        self.database_replica_url = database_replica_url
+        self.pullbox_api_url = pullbox_api_url
+        self.pullbox_api_key = pullbox_api_key
+        self.discord_webhook_url = discord_webhook_url
+        self.failed_webhook_url = failed_webhook_url
+        self.purple_mana_api_url = purple_mana_api_url
+        self.sslmode = sslmode
+        self.db_params = parse_database_url(database_url, sslmode) if database_url else None
+        self.replica_db_params = parse_database_url(database_replica_url, sslmode) if database_replica_url else None
+
+    def __repr__(self):
+        host = self.db_params['host'] if self.db_params else None
+        return f"PricingConfig(env={self.env!r}, db_host={host!r}, pullbox_api_url={self.pullbox_api_url!r})"
+
+    def database(self):
+        """This process's dbAccess.Database for the environment"""
+        import dbAccess
+        if not self.db_params:
+            raise RuntimeError(f"{ENVIRONMENTS[self.env]['database_url']} not found in .env file")
+        return dbAccess.database(self)
+
+    def connect(self, readonly=False):
+        """An unpooled connection the caller closes"""
+        return self.database().connect(readonly)
+
+    def connection(self, readonly=False):
+        """A pooled connection for a with block; readonly ones go to the replica if there is one"""
+        return self.database().connection(readonly)
+
+def load_config(env='staging'):
+    """Read the .env file once and build the config for one environment"""
+    if env not in ENVIRONMENTS:
+        raise ValueError(f"Unknown environment {env!r}, expected one of {', '.join(ENVIRONMENTS)}")
+    load_dotenv()
+    names = ENVIRONMENTS[env]
+    return PricingConfig(
+        env=env,
+        database_url=os.getenv(names['database_url']),
+        database_replica_url=os.getenv(names['database_replica_url']),
+        pullbox_api_url=os.getenv(names['pullbox_api_url']),
+        pullbox_api_key=os.getenv(names['pullbox_api_key']),
+        discord_webhook_url=os.getenv('DISCORD_WEBHOOK_URL'),
+        failed_webhook_url=os.getenv('FAILED_WEBHOOK'),
+        purple_mana_api_url=os.getenv('PURPLE_MANA_API_URL', DEFAULT_PURPLE_MANA_API_URL),
+        sslmode=os.getenv('DATABASE_SSLMODE', 'require'),
+    )
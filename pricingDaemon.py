@@ -0,0 +1,251 @@
+"""Long-running pricing daemon with warm resources and an internal scheduler.
+
+    python pricingCli.py daemon --env production --api-interval 60 --scrape-interval 360 --push-interval 60
+
+Instead of cron starting a fresh process per job, one process keeps the
+database pool, an HTTP session and the browsers open and runs the API
+refresh, scrape and push jobs on their own intervals. Jobs run one at a
+time so the API refresh and the scrape never write prize values at the
+same time. A health check between jobs replaces a dead pool, a stale
+session or a browser that stopped answering; replacements start on next use.
+"""
+import logging
+import signal
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import pipelineMetrics
+import profilingHooks
+
+logger = logging.getLogger(__name__)
+
+HEALTH_CHECK_SECONDS = 60
+# Keep-alive connections and cached DNS go stale; a fresh session is cheap
+SESSION_MAX_AGE_SECONDS = 3600
+# Chrome grows without bound over thousands of pages
+DRIVER_MAX_AGE_SECONDS = 6 * 3600
+
+class WarmResources:
+    """Database pool, HTTP session and browsers kept open between job runs"""
+
+    def __init__(self, config, num_drivers=2, http_pool_size=64):
+        self.config = config
+        self.num_drivers = num_drivers
+        self.http_pool_size = http_pool_size
+        self.database = None
+        self.pool = None
+        self.session = None
+        self.session_started = None
+        # position -> (driver, started)
+        self.drivers = {}
+
+    def open_pool(self):
+        import dbAccess
+        # The same Database config.connection() uses, so every job shares these pools
+        self.database = dbAccess.database(self.config, minconn=2)
+        self.pool = self.database.pool()
+        logger.info("Database pool opened")
+
+    def open_session(self):
+        session = requests.Session()
+        # Enough pooled connections for the API job's worker threads
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.http_pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        self.session = session
+        self.session_started = time.monotonic()
+
+    def start(self):
+        self.open_pool()
+        self.open_session()
+
+    def scraper(self):
+        """The environment's scrape module (as pricingCli picks it); the warm browsers are its kind"""
+        from pricingCli import default_scraper
+        if default_scraper(self.config) == 'single-pass':
+            import updatePrizePricingWithScraping as scraper
+            # Its proxy/direct split is by position within the fleet
+            scraper.fleet_size = self.num_drivers
+        else:
+            import updateWithScrapingNoVPN as scraper
+        return scraper
+
+    def browsers(self):
+        """The browser pool, starting any missing browsers; API and push jobs never call this"""
+        import browserFleet
+        scraper = self.scraper()
+        missing = [position for position in range(1, self.num_drivers + 1) if position not in self.drivers]
+        if missing:
+            started = browserFleet.start_fleet(missing, scraper.start_positioned_driver)
+            for position, driver in started.items():
+                self.drivers[position] = (driver, time.monotonic())
+        return [self.drivers[position][0] for position in sorted(self.drivers)]
+
+    def adopt_browsers(self, drivers):
+        """Take back the browser list after a scrape replaced some of its browsers"""
+        previous = {id(driver): started for driver, started in self.drivers.values()}
+        self.drivers = {position: (driver, previous.get(id(driver), time.monotonic()))
+                        for position, driver in enumerate(drivers, start=1)}
+
+    def check_pool(self):
+        try:
+            # ping() only sees the pools still open; a job that closed ours leaves it closed
+            if self.pool is None or self.pool.closed:
+                raise RuntimeError("the pool was closed")
+            self.database.ping()
+            return True
+        except Exception as e:
+            logger.warning(f"Database pool failed its health check, reopening: {e}")
+            self.close_pool()
+            self.open_pool()
+            return False
+
+    def check_session(self):
+        if time.monotonic() - self.session_started < SESSION_MAX_AGE_SECONDS:
+            return True
+        self.session.close()
+        self.open_session()
+        return False
+
+    def check_browsers(self):
+        scraper = self.scraper()
+        healthy = True
+        for position, (driver, started) in list(self.drivers.items()):
+            reason = None
+            if time.monotonic() - started > DRIVER_MAX_AGE_SECONDS:
+                reason = "reached its maximum age"
+            else:
+                try:
+                    driver.execute_script("return 1")
+                except Exception as e:
+                    reason = f"stopped answering ({type(e).__name__})"
+            if reason:
+                logger.warning(f"Browser #{position} {reason}, recycling it")
+                scraper.cleanup_driver(driver)
+                del self.drivers[position]
+                pipelineMetrics.inc('daemon_recycled_total', component='browser')
+                healthy = False
+        return healthy
+
+    def health_check(self):
+        if not self.check_pool():
+            pipelineMetrics.inc('daemon_recycled_total', component='db_pool')
+        if not self.check_session():
+            pipelineMetrics.inc('daemon_recycled_total', component='http_session')
+        self.check_browsers()
+
+    def close_pool(self):
+        if self.database is not None:
+            self.database.close()
+            self.pool = None
+
+    def close(self):
+        scraper = self.scraper()
+        for driver, _ in self.drivers.values():
+            scraper.cleanup_driver(driver)
+        self.drivers.clear()
+        if self.session is not None:
+            self.session.close()
+        self.close_pool()
+
+def run_price_api(resources):
+    import updatePrizePricing
+    updatePrizePricing.main(resources.config, session=resources.session)
+
+def run_scrape(resources):
+    scraper = resources.scraper()
+    job = f"scrape-{resources.config.env}"
+    scraper.connection_pool = resources.pool
+    try:
+        urls = scraper.get_test_urls(resources.database.pool(readonly=True))
+        print(f"Retrieved {len(urls)} URLs to process")
+        drivers = resources.browsers()
+        try:
+            scraper.scrape_urls(urls, job=job, drivers=drivers)
+        finally:
+            # The scrape may have recycled some of them
+            resources.adopt_browsers(drivers)
+    finally:
+        if hasattr(scraper, 'export_metrics'):
+            scraper.export_metrics(job)
+        else:
+            pipelineMetrics.export_run(job)
+
+def run_push(resources):
+    import pushBoxes
+    pushBoxes.query_box_table(resources.config, session=resources.session)
+
+class ScheduledJob:
+    def __init__(self, name, interval_seconds, run):
+        self.name = name
+        self.interval_seconds = interval_seconds
+        self.run = run
+        # Everything runs once at startup, then on its interval
+        self.next_run = time.monotonic()
+        self.runs = 0
+        self.failures = 0
+
+class PricingDaemon:
+    def __init__(self, resources, jobs):
+        self.resources = resources
+        self.jobs = jobs
+        self.stopping = threading.Event()
+        self.next_health_check = time.monotonic() + HEALTH_CHECK_SECONDS
+
+    def stop(self, *_):
+        logger.info("Stopping after the current job")
+        self.stopping.set()
+
+    def run_job(self, job):
+        # Each run gets its own metrics so <job>.prom and the run report describe one run
+        pipelineMetrics.registry.reset()
+        started = time.monotonic()
+        logger.info(f"Running {job.name}")
+        try:
+            with profilingHooks.stage(job.name):
+                job.run(self.resources)
+        except Exception:
+            job.failures += 1
+            logger.exception(f"{job.name} failed ({job.failures} failures in {job.runs + 1} runs)")
+        job.runs += 1
+        elapsed = time.monotonic() - started
+        logger.info(f"{job.name} finished in {elapsed:.1f}s")
+        # A run longer than its interval starts the next one right away rather than piling up
+        job.next_run = max(started + job.interval_seconds, time.monotonic())
+
+    def run(self):
+        self.resources.start()
+        try:
+            while not self.stopping.is_set():
+                now = time.monotonic()
+                due = sorted((job for job in self.jobs if job.next_run <= now), key=lambda job: job.next_run)
+                for job in due:
+                    if self.stopping.is_set():
+                        break
+                    self.run_job(job)
+                if time.monotonic() >= self.next_health_check:
+                    self.resources.health_check()
+                    self.next_health_check = time.monotonic() + HEALTH_CHECK_SECONDS
+                wake_at = min([job.next_run for job in self.jobs] + [self.next_health_check])
+                self.stopping.wait(max(0, wake_at - time.monotonic()))
+        finally:
+            self.resources.close()
+            logger.info("Daemon stopped")
+
+def main(config, api_interval=60, scrape_interval=360, push_interval=60, num_drivers=2):
+    """Intervals are in minutes; 0 leaves that job out"""
+    logging.basicConfig(level=logging.INFO)
+    jobs = [ScheduledJob(name, minutes * 60, run)
+            for name, minutes, run in (('price-api', api_interval, run_price_api),
+                                       ('scrape', scrape_interval, run_scrape),
+                                       ('push', push_interval, run_push))
+            if minutes]
+    if not jobs:
+        raise SystemExit("Every job interval is 0, nothing to schedule")
+    daemon = PricingDaemon(WarmResources(config, num_drivers=num_drivers), jobs)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    signal.signal(signal.SIGINT, daemon.stop)
+    daemon.run()
@@ -0,0 +1,226 @@
+"""Opt-in CPU and memory profiling for the entry points.
+
+Enabled per run without code changes, either on the command line
+
+    python updatePrizePricing.py --profile cpu,mem
+    python updateWithScrapingNoVPN.py --profile sample --profile-dir /tmp/prof
+
+or through the environment (PULLBOX_PROFILE=cpu,mem, PULLBOX_PROFILE_DIR=...).
+
+Modes:
+    cpu     cProfile per stage (main thread), dumped as <stage>.pstats + .txt
+    sample  wall-clock stack sampler over all threads, <stage>.collapsed
+            (flamegraph.pl / speedscope input), so browser and API worker
+            threads show up too
+    mem     tracemalloc: top allocation sites and peak memory per stage
+
+Output goes to <profile-dir>/<job>_<timestamp>/, profile-dir defaulting to
+./artifacts. Stages are marked with `with profilingHooks.stage("name"):`
+and are free when profiling is off.
+"""
+import argparse
+import atexit
+import io
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+MODES = ('cpu', 'sample', 'mem')
+DEFAULT_SAMPLE_INTERVAL = 0.01
+TOP_ALLOCATIONS = 25
+
+_state = {
+    "modes": set(),
+    "run_dir": None,
+    "current_stage": "startup",
+    "stage_profiles": {},
+    "stage_memory": {},
+    "peak_bytes": 0,
+    "depth": 0,
+    "sampler": None,
+    "finished": False,
+}
+
+def add_arguments(parser):
+    """Add --profile/--profile-dir to an existing argparse parser"""
+    parser.add_argument('--profile', default=os.getenv('PULLBOX_PROFILE', ''),
+                        help=f"comma separated profiling modes: {', '.join(MODES)}")
+    parser.add_argument('--profile-dir', default=os.getenv('PULLBOX_PROFILE_DIR', 'artifacts'),
+                        help="where run-scoped profiling artifacts are written")
+    parser.add_argument('--profile-interval', type=float,
+                        default=float(os.getenv('PULLBOX_PROFILE_INTERVAL', DEFAULT_SAMPLE_INTERVAL)),
+                        help="seconds between stack samples in sample mode")
+    return parser
+
+def configure(job, argv=None, args=None):
+    """Turn profiling on from parsed args, or from argv/env for scripts without a parser.
+
+    Unknown arguments are left alone so the scripts' own arguments keep working.
+    Returns the run directory, or None when profiling is off.
+    """
+    if args is None:
+        args, _ = add_arguments(argparse.ArgumentParser(add_help=False)).parse_known_args(
+            sys.argv[1:] if argv is None else argv)
+    modes = {mode.strip() for mode in (args.profile or '').split(',') if mode.strip()}
+    unknown = modes - set(MODES)
+    if unknown:
+        raise SystemExit(f"Unknown profiling mode(s): {', '.join(sorted(unknown))}")
+    if not modes:
+        return None
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    run_dir = os.path.join(args.profile_dir, f"{job}_{timestamp}")
+    os.makedirs(run_dir, exist_ok=True)
+    _state.update(modes=modes, run_dir=run_dir, finished=False)
+
+    if 'mem' in modes:
+        tracemalloc.start(25)
+    if 'sample' in modes:
+        _state["sampler"] = StackSampler(args.profile_interval).start()
+    atexit.register(finish)
+    print(f"Profiling ({', '.join(sorted(modes))}) enabled, artifacts in {run_dir}")
+    return run_dir
+
+def enabled():
+    return bool(_state["modes"]) and not _state["finished"]
+
+@contextmanager
+def stage(name):
+    """Attribute the enclosed work to a named stage"""
+    if not enabled():
+        yield
+        return
+
+    previous_stage = _state["current_stage"]
+    _state["current_stage"] = name
+    # Only one cProfile can be active and reset_peak is global, so nested stages
+    # are timed by the sampler but profiled as part of their outermost stage
+    outermost = _state["depth"] == 0
+    _state["depth"] += 1
+    profiler = None
+    # cProfile only sees the thread that enables it; worker threads are covered by 'sample'
+    if outermost and 'cpu' in _state["modes"] and threading.current_thread() is threading.main_thread():
+        import cProfile
+        profiler = _state["stage_profiles"].get(name) or cProfile.Profile()
+        _state["stage_profiles"][name] = profiler
+        profiler.enable()
+    if 'mem' in _state["modes"]:
+        if outermost:
+            tracemalloc.reset_peak()
+        mem_before = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        if 'mem' in _state["modes"]:
+            current, peak = tracemalloc.get_traced_memory()
+            record = _state["stage_memory"].setdefault(name, {"peak_bytes": 0, "retained_bytes": 0, "seconds": 0})
+            if outermost:
+                record["peak_bytes"] = max(record["peak_bytes"], peak)
+                _state["peak_bytes"] = max(_state["peak_bytes"], peak)
+            record["retained_bytes"] += current - mem_before
+            record["seconds"] += time.perf_counter() - started
+        _state["depth"] -= 1
+        _state["current_stage"] = previous_stage
+
+class StackSampler:
+    """Samples every thread's stack at a fixed interval, tagged with the current stage"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.counts = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiling-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=5)
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            stage_name = _state["current_stage"]
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                key = (stage_name, ";".join(reversed(stack)))
+                self.counts[key] = self.counts.get(key, 0) + 1
+
+    def write(self, run_dir):
+        by_stage = {}
+        for (stage_name, stack), count in self.counts.items():
+            by_stage.setdefault(stage_name, []).append(f"{stack} {count}")
+        for stage_name, lines in by_stage.items():
+            with open(os.path.join(run_dir, f"{stage_name}.collapsed"), 'w') as f:
+                f.write("\n".join(sorted(lines)) + "\n")
+        return {stage_name: sum(int(line.rsplit(' ', 1)[1]) for line in lines)
+                for stage_name, lines in by_stage.items()}
+
+def finish():
+    """Write every artifact; safe to call more than once"""
+    if not _state["modes"] or _state["finished"]:
+        return
+    _state["finished"] = True
+    run_dir = _state["run_dir"]
+    summary = [f"Profile modes: {', '.join(sorted(_state['modes']))}"]
+
+    if _state["stage_profiles"]:
+        import pstats
+    for stage_name, profiler in _state["stage_profiles"].items():
+        profiler.dump_stats(os.path.join(run_dir, f"{stage_name}.pstats"))
+        text = io.StringIO()
+        pstats.Stats(profiler, stream=text).sort_stats('cumulative').print_stats(40)
+        with open(os.path.join(run_dir, f"{stage_name}.txt"), 'w') as f:
+            f.write(text.getvalue())
+        summary.append(f"cpu: {stage_name}.pstats")
+
+    sampler = _state["sampler"]
+    if sampler is not None:
+        sampler.stop()
+        for stage_name, samples in sampler.write(run_dir).items():
+            summary.append(f"sample: {stage_name}.collapsed ({samples} samples)")
+
+    if 'mem' in _state["modes"] and tracemalloc.is_tracing():
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        current, peak = tracemalloc.get_traced_memory()
+        peak = max(peak, _state["peak_bytes"])
+        lines = [f"Current traced: {current / 1024 / 1024:.1f} MiB",
+                 f"Peak traced: {peak / 1024 / 1024:.1f} MiB", "",
+                 "Per stage:"]
+        for stage_name, record in _state["stage_memory"].items():
+            peak_text = f"peak {record['peak_bytes'] / 1024 / 1024:.1f} MiB" if record['peak_bytes'] else "nested"
+            lines.append(f"  {stage_name}: {peak_text}, "
+                         f"retained {record['retained_bytes'] / 1024 / 1024:+.1f} MiB, "
+                         f"{record['seconds']:.1f}s")
+        lines += ["", f"Top {TOP_ALLOCATIONS} allocation sites:"]
+        for stat in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]:
+            frame = stat.traceback[0]
+            lines.append(f"  {stat.size / 1024:.1f} KiB in {stat.count} blocks at {frame.filename}:{frame.lineno}")
+        with open(os.path.join(run_dir, "memory.txt"), 'w') as f:
+            f.write("\n".join(lines) + "\n")
+        tracemalloc.stop()
+        summary.append("mem: memory.txt")
+
+    with open(os.path.join(run_dir, "summary.txt"), 'w') as f:
+        f.write("\n".join(summary) + "\n")
+    print(f"Profiling artifacts written to {run_dir}")
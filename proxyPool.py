@@ -0,0 +1,149 @@
+"""Proxy exits for the scraper's VPN drivers, scored by how well they are doing.
+
+    SCRAPER_PROXIES=http://10.0.0.2:3128,http://10.0.0.3:3128,socks5://127.0.0.1:1080
+
+Chrome takes its proxy at launch (--proxy-server, which has no room for
+credentials, so use IP-allowlisted exits or a local forwarder), so a driver
+keeps its proxy until it is recycled. Every page is recorded against the
+driver's proxy: success rate and an EWMA of page latency make up its score.
+A new driver gets the best-scoring proxy that isn't cooling down, spreading
+drivers across exits. When a proxy draws CHALLENGE_COOLDOWN_AFTER challenges
+in a row, or falls well behind the others, should_rotate() tells the
+supervisor to recycle the driver onto a different one.
+"""
+import logging
+import os
+import threading
+import time
+
+import pipelineMetrics
+
+logger = logging.getLogger(__name__)
+
+EWMA_ALPHA = 0.2
+# A page this slow halves a proxy's score
+LATENCY_SCALE_SECONDS = 10.0
+CHALLENGE_COOLDOWN_AFTER = 3
+COOLDOWN_SECONDS = 600
+# Pages before a proxy's own numbers are trusted over the prior
+MIN_SAMPLES = 10
+MIN_SUCCESS_RATE = 0.5
+SLOW_FACTOR = 2.0
+
+class ProxyStats:
+    def __init__(self, proxy):
+        self.proxy = proxy
+        self.attempts = 0
+        self.successes = 0
+        self.ewma_seconds = None
+        self.consecutive_challenges = 0
+        self.cooldown_until = 0.0
+        self.assigned = 0
+
+    @property
+    def success_rate(self):
+        # One success and one failure as a prior, so a fresh proxy starts at 0.5
+        return (self.successes + 1) / (self.attempts + 2)
+
+    def score(self):
+        latency = self.ewma_seconds if self.ewma_seconds is not None else LATENCY_SCALE_SECONDS / 2
+        return self.success_rate / (1 + latency / LATENCY_SCALE_SECONDS)
+
+    def cooling_down(self, now=None):
+        return (now or time.monotonic()) < self.cooldown_until
+
+    def as_dict(self):
+        return {
+            "proxy": self.proxy,
+            "attempts": self.attempts,
+            "success_rate": round(self.success_rate, 3),
+            "ewma_seconds": round(self.ewma_seconds, 2) if self.ewma_seconds is not None else None,
+            "score": round(self.score(), 4),
+            "cooling_down": self.cooling_down(),
+            "assigned": self.assigned,
+        }
+
+class ProxyPool:
+    def __init__(self, proxies):
+        self.stats = {proxy: ProxyStats(proxy) for proxy in proxies}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.stats)
+
+    def acquire(self, exclude=()):
+        """The best proxy for a new driver; cooling-down proxies only if nothing else is left"""
+        with self._lock:
+            now = time.monotonic()
+            candidates = [s for s in self.stats.values() if s.proxy not in exclude] or list(self.stats.values())
+            ready = [s for s in candidates if not s.cooling_down(now)] or candidates
+            # Share drivers out, so one good exit isn't the only one carrying traffic
+            best = max(ready, key=lambda s: s.score() / (1 + s.assigned))
+            best.assigned += 1
+            return best.proxy
+
+    def release(self, proxy):
+        with self._lock:
+            if proxy in self.stats and self.stats[proxy].assigned > 0:
+                self.stats[proxy].assigned -= 1
+
+    def record(self, proxy, ok, seconds, challenged=False):
+        stats = self.stats.get(proxy)
+        if stats is None:
+            return
+        with self._lock:
+            stats.attempts += 1
+            if ok:
+                stats.successes += 1
+            stats.ewma_seconds = seconds if stats.ewma_seconds is None else (
+                EWMA_ALPHA * seconds + (1 - EWMA_ALPHA) * stats.ewma_seconds)
+            if challenged:
+                stats.consecutive_challenges += 1
+                if stats.consecutive_challenges >= CHALLENGE_COOLDOWN_AFTER:
+                    stats.cooldown_until = time.monotonic() + COOLDOWN_SECONDS
+                    logger.warning(f"Proxy {proxy} challenged {stats.consecutive_challenges} times in a row, "
+                                   f"cooling down for {COOLDOWN_SECONDS}s")
+            elif ok:
+                stats.consecutive_challenges = 0
+        pipelineMetrics.inc('proxy_pages_total', proxy=proxy,
+                            outcome='challenge' if challenged else ('ok' if ok else 'error'))
+
+    def should_rotate(self, proxy):
+        """Whether a driver on this proxy should move to another one"""
+        stats = self.stats.get(proxy)
+        if stats is None or len(self.stats) < 2:
+            return False
+        with self._lock:
+            if stats.cooling_down():
+                return True
+            if stats.attempts < MIN_SAMPLES:
+                return False
+            if stats.success_rate < MIN_SUCCESS_RATE:
+                return True
+            others = [s.ewma_seconds for s in self.stats.values()
+                      if s is not stats and s.ewma_seconds is not None and not s.cooling_down()]
+            return bool(others) and stats.ewma_seconds > SLOW_FACTOR * sorted(others)[len(others) // 2]
+
+    def report(self):
+        with self._lock:
+            return [s.as_dict() for s in sorted(self.stats.values(), key=lambda s: -s.score())]
+
+    def export_gauges(self):
+        for entry in self.report():
+            pipelineMetrics.set_gauge('proxy_success_ratio', entry["success_rate"], proxy=entry["proxy"])
+            if entry["ewma_seconds"] is not None:
+                pipelineMetrics.set_gauge('proxy_page_seconds_ewma', entry["ewma_seconds"], proxy=entry["proxy"])
+
+_default_pool = None
+_default_lock = threading.Lock()
+
+def default_pool():
+    """The pool from SCRAPER_PROXIES, or None when no proxies are configured"""
+    global _default_pool
+    with _default_lock:
+        if _default_pool is None:
+            proxies = [p.strip() for p in os.getenv('SCRAPER_PROXIES', '').split(',') if p.strip()]
+            if not proxies:
+                return None
+            _default_pool = ProxyPool(proxies)
+        return _default_pool
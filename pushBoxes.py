@@ -0,0 +1,266 @@
+"""Rebuild every live box from the prize table and push it to the Pullbox API.
+
+productionPushAllLiveBoxesLive.py and stagingPushAllLiveBoxesLive.py call
+query_box_table() with their environment's config. Boxes whose POST fails
+go into the push outbox (pushOutbox) to be retried on their own.
+
+push_targets() builds the payloads once from one source database and sends
+them to several Pullbox environments at once, one thread per target:
+
+    python pricingCli.py push --targets staging production --source production
+
+A full build loads the catalog (catalogIndex) with two bulk reads and builds
+every box from it. boxListener pushes single boxes as their prices change,
+through query_box_payloads(box_ids=...) and send_to_targets().
+"""
+import psycopg2
+import requests
+import json
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import catalogIndex
+import httpPolicy
+import pipelineMetrics
+import pushOutbox
+
+def get_color_for_coin_value(coin_value):
+    if coin_value >= 100:
+        return '#F7CA0F'  # Orange
+    if coin_value >= 50:
+        return '#B723F2'  # Purple
+    if coin_value >= 20:
+        return '#18B9FF'  # Blue
+    if coin_value >= 5:
+        return '#2DC257'  # Green
+    return '#6b7280'      # Gray
+
+def build_box_payload(box_row, card_rows):
+    """The Pullbox JSON for one box row and its prize rows"""
+    build_started = time.perf_counter()
+    # Debug prints
+    print("\nCalculating box value:")
+
+    # Calculate total weighted value (value * 146 * weight)
+    total_weighted_value = sum((float(card[2]) * 146 * int(float(card[1]))) if card[2] and card[1] else 0 for card in card_rows)
+    print(f"Total weighted value: {total_weighted_value}")
+
+    # Calculate total weight
+    total_weight = sum(int(float(card[1])) if card[1] else 0 for card in card_rows)
+    print(f"Total weight: {total_weight}")
+
+    if total_weight > 0:
+        edge = float(box_row[8]) if box_row[8] else 12
+        print(f"Edge: {edge}")
+
+        # Calculate total box value using your formula
+        total_box_value = math.floor(
+            round(total_weighted_value) / total_weight / (100 - edge) * 100
+        ) / 100
+        print(f"Total box value: {total_box_value}")
+    else:
+        total_box_value = 0
+        print("Total box value defaulted to 0 due to zero weight")
+
+    box_color = get_color_for_coin_value(float(total_box_value))
+    print(f"Calculated color: {box_color}")
+
+    # Construct box JSON with its cards
+    box_data = {
+        "id": str(box_row[0]),
+        "name": box_row[1],
+        "slug": box_row[3],
+        "image": box_row[2],
+        "splash_image": box_row[7],
+        "categories": [box_row[5]] if box_row[5] else [],
+        "tags": box_row[6] if box_row[6] else [],
+        "is_live": bool(box_row[4]),
+        "edge": int(box_row[8]) if box_row[8] else 12,
+        "is_hidden": bool(box_row[9]),
+        "color": box_color,
+        "items": []
+    }
+
+    # Add each card to the items array
+    for card in card_rows:
+        # Convert value: multiply by 100, then by 1.46, then round to integer
+        raw_value = float(card[2]) if card[2] else 0
+        adjusted_value = round(raw_value * 100 * 1.46)
+
+        item = {
+            "external_id": card[10],
+            "name": card[0],
+            "image": card[8],
+            "value": adjusted_value,  # Using the adjusted value
+            "withdrawable": bool(card[9]),
+            "mass": int(float(card[6])) if card[6] else 10,  # Ensure it's a number
+            "mass_unit": card[7] or "g",
+            "weight": int(float(card[1])) if card[1] else 100,  # Ensure it's a number
+            "display_properties": [
+                {
+                    "name": "Set",
+                    "value": card[4] or "",
+                    "detail_level": "BASIC"
+                },
+                {
+                    "name": "Condition",
+                    "value": card[3] or "",
+                    "detail_level": "BASIC"
+                },
+                {
+                    "name": "Finish",
+                    "value": card[5] or "",
+                    "detail_level": "BASIC"
+                }
+            ]
+        }
+        box_data["items"].append(item)
+    pipelineMetrics.record_stage('payload_build', time.perf_counter() - build_started)
+    return box_data
+
+def query_box_payloads(config, box_ids=None, readonly=True):
+    """(box rows, payloads) for every live box in the config's database, or only those in box_ids.
+
+    Only reads, so by default it can go to the replica; a caller that must
+    see a write it was just told about passes readonly=False.
+    """
+    with config.connection(readonly=readonly) as conn:
+        print("Connected to the database successfully!")
+
+        if box_ids is None:
+            # Every box: two bulk reads into the catalog index instead of a prize query per box
+            index = catalogIndex.CatalogIndex.load(conn)
+            boxes = index.pushed_boxes()
+            rows = [box.row() for box in boxes]
+            payloads = [build_box_payload(box.row(), [prize.card_row() for prize in index.prizes_in_box(box.id)])
+                        for box in boxes]
+        else:
+            rows, payloads = _query_boxes(conn, box_ids)
+
+    if payloads:
+        # Keep the last payload around for debugging, as the push always has
+        with open('debug_last_request.json', 'w') as f:
+            json.dump(payloads[-1], f, indent=2)
+    return rows, payloads
+
+def _query_boxes(conn, box_ids):
+    """(box rows, payloads) for a few boxes, read directly; cheaper than loading the catalog for them"""
+    with conn.cursor() as cur:
+        with pipelineMetrics.timed('db_read', query='live_boxes'):
+            cur.execute(f"SELECT {', '.join(catalogIndex.BOX_COLUMNS)} from box where id = ANY(%s::uuid[])", (list(box_ids),))
+            # Which boxes get pushed is BoxRecord.pushed's call, as for a full push
+            rows = [row for row in cur.fetchall() if catalogIndex.BoxRecord(row).pushed]
+
+        payloads = []
+        for box_row in rows:
+            # Get all cards for this box
+            with pipelineMetrics.timed('db_read', query='box_prizes'):
+                cur.execute("select name, weight, value, condition, set, finish, mass, mass_unit, image, withdrawable, id from prize where box_id = %s and is_deleted = False", (box_row[0],))
+                card_rows = cur.fetchall()
+            payloads.append(build_box_payload(box_row, card_rows))
+    return rows, payloads
+
+def push_box(target, box_data, outbox, session=None):
+    """POST one box to the target's Pullbox API; failures go to the outbox. Returns True on success"""
+    headers = {
+        "Authorization": target.pullbox_api_key,
+        "Content-Type": "application/json"
+    }
+    try:
+        with pipelineMetrics.timed('pullbox_post', target=target.env) as labels:
+            response = httpPolicy.post(
+                target.pullbox_api_url,
+                session=session,
+                wait_for_circuit=True,
+                headers=headers,
+                json=box_data,
+                timeout=(25, 45)  # (connect_timeout, read_timeout) in seconds
+            )
+            labels['status'] = response.status_code
+        print(f"[{target.env}] Response Status Code: {response.status_code}")
+        print(f"[{target.env}] Response Content: {response.text}")
+
+        pipelineMetrics.inc('boxes_total', target=target.env, outcome='ok' if response.ok else 'error')
+        if response.ok:
+            print(f"[{target.env}] Request successful for box {box_data['name']}!")
+            # This build supersedes any earlier failed one
+            outbox.remove(target.env, box_data["id"])
+            return True
+        print(f"[{target.env}] Request failed with status code {response.status_code}")
+        print(f"[{target.env}] Error message: {response.text}")
+        outbox.record_failure(target.env, box_data, *pushOutbox.describe_failure(response=response))
+    except requests.exceptions.RequestException as e:
+        pipelineMetrics.inc('boxes_total', target=target.env, outcome='error')
+        print(f"[{target.env}] Error sending POST request:")
+        print(e)
+        outbox.record_failure(target.env, box_data, *pushOutbox.describe_failure(error=e))
+    return False
+
+def push_to_target(target, payloads, outbox, session=None):
+    """Push every payload to one target in order; returns how many got through.
+
+    Without a session one is opened for the target's pushes and closed after.
+    """
+    if not target.pullbox_api_url:
+        print(f"[{target.env}] No Pullbox API URL configured, skipping {len(payloads)} boxes")
+        return 0
+    own_session = session is None
+    session = session or requests.Session()
+    try:
+        return sum(1 for box_data in payloads if push_box(target, box_data, outbox, session))
+    finally:
+        if own_session:
+            session.close()
+
+def send_to_targets(targets, payloads, outbox, session=None):
+    """Push the payloads to every target at once; returns {env: boxes pushed}"""
+    # A Session isn't safe to share between threads, so the caller's is only used with a single
+    # target; otherwise each target's thread opens its own
+    target_session = session if len(targets) == 1 else None
+    # One thread per target: targets proceed side by side, each one's boxes in order
+    with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+        futures = {target.env: executor.submit(push_to_target, target, payloads, outbox, target_session)
+                   for target in targets}
+    pushed = {}
+    for env, future in futures.items():
+        try:
+            pushed[env] = future.result()
+        except Exception as e:
+            print(f"[{env}] Push failed: {e}")
+            pushed[env] = 0
+        pipelineMetrics.set_gauge('push_outbox_boxes', outbox.count(env), target=env)
+    return pushed
+
+def push_targets(source, targets, session=None):
+    """Build every live box once from source's database and push it to each target concurrently.
+
+    Returns the box rows, as query_box_table() always has, or [] when the
+    source database can't be read.
+    """
+    if not source.database_url:
+        print("DATABASE_URL not found in .env file")
+        return
+
+    outbox = pushOutbox.PushOutbox()
+    try:
+        try:
+            rows, payloads = query_box_payloads(source)
+        except psycopg2.Error as e:
+            print("Error connecting to the database or querying data:")
+            print(e)
+            return []
+        finally:
+            print("Database connection closed.")
+
+        for env, pushed in send_to_targets(targets, payloads, outbox, session).items():
+            print(f"[{env}] Pushed {pushed}/{len(payloads)} boxes built from the {source.env} database")
+
+        return [tuple(row[:10]) for row in rows]
+    finally:
+        outbox.close()
+        pipelineMetrics.export_run(f"push-{'-'.join(target.env for target in targets)}")
+
+def query_box_table(config, session=None):
+    """Rebuild every live box from the environment's database and push it to its Pullbox API"""
+    return push_targets(config, [config], session)
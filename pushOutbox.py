@@ -0,0 +1,139 @@
+"""Box payloads that failed to reach Pullbox, kept on disk until they get through.
+
+    python pricingCli.py push --env production --drain-outbox
+
+When a push POST fails or comes back non-2xx, query_box_table() stores the
+box's payload here (PUSH_OUTBOX_PATH, a small sqlite file) with an attempt
+count and the time of its next retry, backing off exponentially up to
+MAX_BACKOFF_SECONDS. A later successful push of the same box, from a full
+run or a drain, removes it. Draining retries only the boxes that are due and
+never touches the database, so recovering from a Pullbox outage costs one
+request per stale box instead of a full rebuild.
+
+Only the latest payload per (environment, box) is kept: a newer build of the
+box supersedes the one that failed.
+"""
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+
+import requests
+
+import httpPolicy
+import pipelineMetrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OUTBOX_PATH = 'push_outbox.sqlite3'
+BASE_BACKOFF_SECONDS = 60
+MAX_BACKOFF_SECONDS = 3600
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS outbox (
+    env TEXT NOT NULL,
+    box_id TEXT NOT NULL,
+    box_name TEXT,
+    payload TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_status INTEGER,
+    last_error TEXT,
+    first_failed_at REAL NOT NULL,
+    last_failed_at REAL NOT NULL,
+    next_attempt_at REAL NOT NULL,
+    PRIMARY KEY (env, box_id)
+)
+"""
+
+def backoff_seconds(attempts):
+    """Exponential backoff with +-20% jitter, so boxes that failed together don't retry together"""
+    delay = min(MAX_BACKOFF_SECONDS, BASE_BACKOFF_SECONDS * 2 ** max(0, attempts - 1))
+    return delay * random.uniform(0.8, 1.2)
+
+def describe_failure(response=None, error=None):
+    """(status, error text) for a failed POST, to store with the box"""
+    if response is not None:
+        return response.status_code, response.text[:500]
+    return None, str(error)[:500]
+
+class PushOutbox:
+    def __init__(self, path=None):
+        self.path = path or os.getenv('PUSH_OUTBOX_PATH', DEFAULT_OUTBOX_PATH)
+        # One connection shared by the push's threads, serialised by the lock
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute(SCHEMA_SQL)
+
+    def record_failure(self, env, box_data, status=None, error=None):
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT attempts, first_failed_at FROM outbox WHERE env = ? AND box_id = ?",
+                                     (env, box_data["id"])).fetchone()
+            attempts = (row[0] if row else 0) + 1
+            self._conn.execute("""
+                INSERT OR REPLACE INTO outbox (env, box_id, box_name, payload, attempts, last_status, last_error,
+                                               first_failed_at, last_failed_at, next_attempt_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (env, box_data["id"], box_data.get("name"), json.dumps(box_data), attempts, status, error,
+                  row[1] if row else now, now, now + backoff_seconds(attempts)))
+        detail = ' '.join(str(part) for part in (status, error) if part)
+        logger.warning(f"Box {box_data.get('name')} queued in the push outbox (attempt {attempts}): {detail}")
+
+    def remove(self, env, box_id):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM outbox WHERE env = ? AND box_id = ?", (env, str(box_id)))
+
+    def due(self, env, now=None):
+        """[(box_id, payload, attempts)] ready for another try, oldest failure first"""
+        with self._lock:
+            rows = self._conn.execute("""
+                SELECT box_id, payload, attempts FROM outbox
+                WHERE env = ? AND next_attempt_at <= ? ORDER BY first_failed_at
+            """, (env, now if now is not None else time.time())).fetchall()
+        return [(box_id, json.loads(payload), attempts) for box_id, payload, attempts in rows]
+
+    def count(self, env):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM outbox WHERE env = ?", (env,)).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def drain(config, session=None, force=False):
+    """Retry every due box in the outbox, or every box with force; returns (pushed, still queued)"""
+    outbox = PushOutbox()
+    headers = {"Authorization": config.pullbox_api_key, "Content-Type": "application/json"}
+    pushed = 0
+    try:
+        pending = outbox.due(config.env, now=float('inf') if force else None)
+        print(f"{len(pending)} boxes due in the push outbox ({outbox.count(config.env)} queued)")
+        for box_id, box_data, attempts in pending:
+            try:
+                with pipelineMetrics.timed('pullbox_post', source='outbox') as labels:
+                    response = httpPolicy.post(config.pullbox_api_url, session=session, headers=headers,
+                                               json=box_data, timeout=(25, 45))
+                    labels['status'] = response.status_code
+            except requests.exceptions.RequestException as e:
+                outbox.record_failure(config.env, box_data, *describe_failure(error=e))
+                pipelineMetrics.inc('outbox_pushes_total', outcome='error')
+                continue
+            if response.ok:
+                outbox.remove(config.env, box_id)
+                pushed += 1
+                pipelineMetrics.inc('outbox_pushes_total', outcome='ok')
+                print(f"Pushed box {box_data.get('name')} from the outbox after {attempts} failed attempts")
+            else:
+                outbox.record_failure(config.env, box_data, *describe_failure(response=response))
+                pipelineMetrics.inc('outbox_pushes_total', outcome='error')
+        remaining = outbox.count(config.env)
+        pipelineMetrics.set_gauge('push_outbox_boxes', remaining)
+        print(f"Pushed {pushed} boxes from the outbox, {remaining} still queued")
+        return pushed, remaining
+    finally:
+        outbox.close()
+        pipelineMetrics.export_run(f"push-outbox-{config.env}")
@@ -0,0 +1,164 @@
+import os
+import psycopg2
+from psycopg2.extras import execute_batch
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+import json
+
+import catalogIndex
+import concurrencyLimiter
+import pipelineMetrics
+import profilingHooks
+from pricingConfig import load_config
+from responseCache import canonical_listing_url
+from updatePrizePricing import make_api_request, condition_from_purple_mana_id, PRICE_TIMESTAMP_KEYS
+
+# API prices older than this are treated as a miss and sent to the browser
+DEFAULT_MAX_PRICE_AGE_HOURS = 72
+
+def api_price_for(data, max_age):
+    """Return (price, None) for a usable API price, or (None, reason) for a miss"""
+    if "error" in data:
+        return None, data["error"]
+    condition = condition_from_purple_mana_id(data['purple_mana_id'])
+    price = data['tcglow'].get(condition)
+    if price is None:
+        return None, f"no tcglow price for condition '{condition}'"
+    try:
+        price = float(price)
+    except (TypeError, ValueError):
+        return None, f"unparseable tcglow price {price!r}"
+    if price <= 0:
+        return None, f"non-positive tcglow price {price}"
+    # Which field the API dates its prices with isn't confirmed, so an undated price is used and
+    # counted rather than sent to the browser; only a dated, old price is a miss
+    priced_at = data.get('priced_at')
+    if priced_at is None:
+        return price, None
+    if priced_at.tzinfo is None:
+        priced_at = priced_at.replace(tzinfo=timezone.utc)
+    if datetime.now(timezone.utc) - priced_at > max_age:
+        return None, f"stale tcglow price from {priced_at.isoformat()}"
+    return price, None
+
+def resolve_api_tier(index, max_age, base_url=None, limiter=None):
+    """Price what the Purple Mana API can; return (priced, misses).
+
+    One request per Purple Mana id, its price written to every prize that shares it.
+    """
+    priced = []
+    undated = 0
+    misses = [(prize.id, prize.tcgplayer_url, "no purple mana id")
+              for prize in index.auto_priced_prizes() if not prize.purple_mana_new_inv_id]
+    limiter = limiter or concurrencyLimiter.AimdLimiter()
+    with ThreadPoolExecutor(max_workers=limiter.max_limit) as executor:
+        future_to_prizes = {}
+        for purple_mana_id in index.purple_mana_ids():
+            prize_ids = index.prize_ids_for_purple_mana_id(purple_mana_id)
+            future = executor.submit(make_api_request, purple_mana_id, prize_ids[0], base_url, limiter=limiter)
+            future_to_prizes[future] = prize_ids
+
+        for future in as_completed(future_to_prizes):
+            prize_ids = future_to_prizes[future]
+            try:
+                _, data = future.result()
+                price, reason = api_price_for(data, max_age)
+                if price is not None and data.get('priced_at') is None:
+                    undated += 1
+            except Exception as e:
+                price, reason = None, str(e)
+            for prize_id in prize_ids:
+                if price is not None:
+                    priced.append((price, prize_id))
+                else:
+                    misses.append((prize_id, index.prizes[prize_id].tcgplayer_url, reason))
+    if undated:
+        pipelineMetrics.inc('api_prices_undated_total', undated)
+        print(f"{undated} API prices had no timestamp under any of {', '.join(PRICE_TIMESTAMP_KEYS)}; "
+              f"used them without an age check")
+    return priced, misses
+
+def write_api_prices(config, priced):
+    with config.connection() as conn, conn.cursor() as cur:
+        with pipelineMetrics.timed('db_write'):
+            execute_batch(cur, "UPDATE prize SET value = %s WHERE id = %s", priced)
+            conn.commit()
+    return len(priced)
+
+def build_scrape_queue(misses):
+    """Group API misses by listing so each page is scraped once, under the first URL seen for it"""
+    urls = {}
+    prize_ids_by_url = {}
+    unresolvable = []
+    for prize_id, tcgplayer_url, reason in misses:
+        if tcgplayer_url:
+            url = urls.setdefault(canonical_listing_url(tcgplayer_url), tcgplayer_url)
+            prize_ids_by_url.setdefault(url, []).append(prize_id)
+        else:
+            unresolvable.append({"prize_id": str(prize_id), "reason": reason})
+    return prize_ids_by_url, unresolvable
+
+def main(config=None):
+    config = config or load_config('staging')
+    max_age = timedelta(hours=float(os.getenv('MAX_PRICE_AGE_HOURS', DEFAULT_MAX_PRICE_AGE_HOURS)))
+
+    try:
+        pool = config.database().pool()
+        read_pool = config.database().pool(readonly=True)
+    except (psycopg2.Error, RuntimeError) as e:
+        print(f"Error creating connection pool: {e}")
+        return
+
+    limiter = concurrencyLimiter.AimdLimiter()
+    try:
+        with profilingHooks.stage('db_read'):
+            index = catalogIndex.CatalogIndex.from_pool(read_pool)
+        prizes = index.auto_priced_prizes()
+        print(f"Resolving prices for {len(prizes)} prizes")
+
+        # Tier 1: Purple Mana API
+        with profilingHooks.stage('api_tier'):
+            priced, misses = resolve_api_tier(index, max_age, config.purple_mana_api_url, limiter)
+        with profilingHooks.stage('db_write'):
+            updated_rows = write_api_prices(config, priced) if priced else 0
+        print(f"API tier priced {updated_rows} prizes, {len(misses)} misses")
+
+        # Tier 2: browser scrape, only for the misses
+        prize_ids_by_url, unresolvable = build_scrape_queue(misses)
+        scraped = []
+        if prize_ids_by_url:
+            print(f"Queueing {len(prize_ids_by_url)} URLs for browser scrape")
+            # Selenium and friends are only imported when there is work for them
+            import updateWithScrapingNoVPN as scraper
+            scraper.connection_pool = pool
+            # Failure alerts look prizes and boxes up here instead of loading the catalog again
+            scraper.catalog_index = index
+            with profilingHooks.stage('browser_tier'):
+                scraped = scraper.scrape_urls(list(prize_ids_by_url), prize_ids_by_url=prize_ids_by_url, job='resolve')
+
+        scrape_failures = [url for url, price in scraped if price is None]
+
+        if unresolvable:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            filename = f"unresolved_log_{timestamp}.json"
+            with open(filename, 'w') as f:
+                json.dump(unresolvable, f, indent=2)
+            print(f"{len(unresolvable)} prizes have neither an API price nor a TCGplayer URL, saved to {filename}")
+
+        print(f"Processed {len(prizes)} prizes:")
+        print(f"  API priced: {updated_rows}")
+        print(f"  Browser scraped URLs: {len(scraped) - len(scrape_failures)}")
+        print(f"  Browser failures: {len(scrape_failures)}")
+        print(f"  Unresolvable: {len(unresolvable)}")
+
+        pipelineMetrics.inc('items_total', updated_rows, tier='api', outcome='ok')
+        pipelineMetrics.inc('items_total', len(prize_ids_by_url), tier='browser', outcome='queued')
+        pipelineMetrics.inc('items_total', len(unresolvable), tier='none', outcome='error')
+    finally:
+        config.database().close()
+        print("Database pools closed")
+        pipelineMetrics.export_run('resolve', extra={"concurrency": limiter.report()})
+
+if __name__ == "__main__":
+    profilingHooks.configure('resolve')
+    main()
@@ -0,0 +1,181 @@
+"""On-disk cache of Purple Mana tcglow responses and TCGplayer listing data.
+
+    python pricingCli.py price-api --env staging --cache-ttl 60
+    RESPONSE_CACHE_TTL_MINUTES=60 python pricingCli.py scrape --env staging
+
+Re-running a job inside the TTL (after a crash, or while debugging) reads
+what the last run fetched instead of going back to the network. Entries are
+keyed by canonical product: the Purple Mana product id for tcglow, the
+canonical listing URL for TCGplayer, where every prize row of one product
+shares an entry. Each entry is a gzipped JSON file named by the SHA-256 of
+its key under RESPONSE_CACHE_DIR/<kind>/, holding the key, the fetch time
+and the raw payload, so the directory doubles as a replayable corpus
+(see entries()).
+
+The cache is off unless the TTL is set. It is capped at
+RESPONSE_CACHE_MAX_MB; past the cap the least recently used entries go.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+import pipelineMetrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'pullbox-scraper', 'responses')
+DEFAULT_MAX_MB = 200
+# Evict down to this share of the cap, so eviction doesn't run on every write
+EVICT_TO = 0.9
+
+def canonical_listing_url(url):
+    """One URL per TCGplayer listing: lowercase host, no product slug, sorted query, no tracking params"""
+    parsed = urlparse(url.strip())
+    parts = [part for part in parsed.path.split('/') if part]
+    # /product/<id>/<slug> -> /product/<id>; the slug is cosmetic
+    if len(parts) >= 2 and parts[0] == 'product':
+        parts = parts[:2]
+    query = sorted((k, v) for k, v in parse_qsl(parsed.query) if not k.lower().startswith('utm_'))
+    return urlunparse((parsed.scheme.lower() or 'https', parsed.netloc.lower(), '/' + '/'.join(parts), '',
+                       urlencode(query), ''))
+
+def ttl_seconds():
+    return float(os.getenv('RESPONSE_CACHE_TTL_MINUTES', 0)) * 60
+
+class ResponseCache:
+    def __init__(self, root, ttl_seconds, max_bytes):
+        self.root = root
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = None
+
+    def path(self, kind, key):
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.root, kind, digest[:2], digest + '.json.gz')
+
+    def get(self, kind, key):
+        """The cached payload for key, or None when missing, expired or unreadable"""
+        path = self.path(kind, key)
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            pipelineMetrics.inc('response_cache_total', kind=kind, outcome='miss')
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Dropping unreadable cache entry {path}: {e}")
+            self._remove(path)
+            pipelineMetrics.inc('response_cache_total', kind=kind, outcome='miss')
+            return None
+        if entry.get("key") != key or time.time() - entry.get("fetched_at", 0) > self.ttl_seconds:
+            pipelineMetrics.inc('response_cache_total', kind=kind, outcome='expired')
+            return None
+        try:
+            # mtime is the entry's last use, which eviction goes by
+            os.utime(path)
+        except OSError:
+            pass
+        pipelineMetrics.inc('response_cache_total', kind=kind, outcome='hit')
+        return entry["payload"]
+
+    def put(self, kind, key, payload):
+        path = self.path(kind, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+                json.dump({"key": key, "fetched_at": time.time(), "payload": payload}, f)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"Could not cache {kind} {key}: {e}")
+            self._remove(tmp_path)
+            return
+        with self._lock:
+            if self._size is None:
+                self._size = self._disk_size()
+            else:
+                self._size += size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _disk_size(self):
+        return sum(size for _, size, _ in self._files())
+
+    def _files(self):
+        for root, _, files in os.walk(self.root):
+            for name in files:
+                if not name.endswith('.json.gz'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+    def _evict(self):
+        files = sorted(self._files())
+        size = sum(file_size for _, file_size, _ in files)
+        target = self.max_bytes * EVICT_TO
+        evicted = 0
+        for _, file_size, path in files:
+            if size <= target:
+                break
+            if self._remove(path):
+                size -= file_size
+                evicted += 1
+        self._size = size
+        pipelineMetrics.inc('response_cache_evictions_total', evicted)
+        logger.info(f"Evicted {evicted} response cache entries, {size / 1024 / 1024:.0f} MiB left")
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+    def entries(self, kind):
+        """Every (key, fetched_at, payload) of one kind, expired or not, e.g. to replay a run"""
+        for _, _, path in self._files():
+            if os.path.relpath(path, self.root).split(os.sep)[0] != kind:
+                continue
+            try:
+                with gzip.open(path, 'rt', encoding='utf-8') as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                continue
+            yield entry["key"], entry["fetched_at"], entry["payload"]
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+def default_cache():
+    """The cache from RESPONSE_CACHE_* settings, or None when RESPONSE_CACHE_TTL_MINUTES is unset or 0"""
+    global _default_cache
+    ttl = ttl_seconds()
+    if ttl <= 0:
+        return None
+    with _default_lock:
+        if _default_cache is None or _default_cache.ttl_seconds != ttl:
+            root = os.getenv('RESPONSE_CACHE_DIR', DEFAULT_CACHE_DIR)
+            max_bytes = float(os.getenv('RESPONSE_CACHE_MAX_MB', DEFAULT_MAX_MB)) * 1024 * 1024
+            _default_cache = ResponseCache(root, ttl, max_bytes)
+        return _default_cache
+
+def add_arguments(parser):
+    parser.add_argument('--cache-ttl', type=float, default=None, metavar='MINUTES',
+                        help="reuse Purple Mana and TCGplayer responses fetched in the last MINUTES "
+                             "(default: RESPONSE_CACHE_TTL_MINUTES, off)")
+
+def configure(args):
+    # Through the environment, so spawned scraper workers see it too
+    if getattr(args, 'cache_ttl', None) is not None:
+        os.environ['RESPONSE_CACHE_TTL_MINUTES'] = str(args.cache_ttl)
@@ -0,0 +1,53 @@
+"""Per-listing scrape failure tracking in price_scrape_failures (migration 3).
+
+    scrapeFailures.record(conn, url, ok=False)   # the URL's last attempt failed
+    scrapeFailures.record(conn, url, ok=True)    # its price was written
+
+A failure bumps failure_count and, when the previous failure was yesterday,
+consecutive_days, so a listing that fails every day stands out from one that
+failed once. A success resets both. Only listings that have failed get a
+row, so the common case of a URL that scrapes fine costs one UPDATE that
+matches nothing.
+
+Tracking never gets in the way of the scrape: a database error here (the
+table not migrated yet, a dropped connection) is logged and rolled back.
+"""
+import logging
+
+import psycopg2
+
+logger = logging.getLogger(__name__)
+
+def record(conn, url, ok):
+    """Record the outcome of scraping url; commits on conn"""
+    if conn is None or conn.closed:
+        return
+    try:
+        with conn.cursor() as cur:
+            if ok:
+                cur.execute("""
+                    UPDATE price_scrape_failures
+                    SET failure_count = 0, consecutive_days = 0, last_success_date = CURRENT_DATE
+                    WHERE tcgplayer_url = %s AND (failure_count > 0 OR consecutive_days > 0)
+                """, (url,))
+            else:
+                cur.execute("""
+                    INSERT INTO price_scrape_failures AS f
+                        (tcgplayer_url, failure_count, last_failure_date, consecutive_days)
+                    VALUES (%s, 1, CURRENT_DATE, 1)
+                    ON CONFLICT (tcgplayer_url) DO UPDATE SET
+                        failure_count = COALESCE(f.failure_count, 0) + 1,
+                        last_failure_date = CURRENT_DATE,
+                        consecutive_days = CASE
+                            WHEN f.last_failure_date = CURRENT_DATE THEN GREATEST(COALESCE(f.consecutive_days, 0), 1)
+                            WHEN f.last_failure_date = CURRENT_DATE - 1 THEN COALESCE(f.consecutive_days, 0) + 1
+                            ELSE 1
+                        END
+                """, (url,))
+        conn.commit()
+    except psycopg2.Error as e:
+        logger.warning(f"Could not record scrape {'success' if ok else 'failure'} for {url}: {e}")
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            pass
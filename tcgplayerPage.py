@@ -0,0 +1,498 @@
+"""Loading a TCGplayer listing page and reading its prices, with per-URL timing.
+
+Both scrapers drive the page through load_listing_page() and
+extract_listing_prices(); TabLoader instead keeps several pages loading at
+once in the tabs of one browser. A PageTimer rides along for each URL and records
+how long each of our waits and sleeps took; finish_page() adds the
+browser's Navigation/Resource Timing for the page and writes one record per
+URL to the run's PageTimingLog. Wait timeouts come from WaitHistory: the
+p99 of how long each wait took on earlier pages, so a dead page gives up
+quickly while a healthy one still gets the time it usually needs. With the response cache on, a URL whose
+listing prices were read within the TTL is answered from the cache and the
+browser never loads it (see cached_listing_prices()).
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+
+import driverSupervisor
+import pipelineMetrics
+import responseCache
+
+BUTTON_SELECTOR = '.tcg-standard-button__content'
+LISTING_SELECTOR = '.listing-item__listing-data'
+PRICE_SELECTOR = '.listing-item__listing-data__info__price:not(:empty)'
+
+# Resource entries that are the listings XHR rather than bundles or images
+LISTINGS_API_MARKERS = ('mp-search-api', '/listings', 'mpapi.tcgplayer.com')
+
+BROWSER_TIMING_SCRIPT = """
+const nav = performance.getEntriesByType('navigation')[0];
+const markers = arguments[0];
+const resources = performance.getEntriesByType('resource');
+const listings = resources.filter(r =>
+    (r.initiatorType === 'fetch' || r.initiatorType === 'xmlhttprequest') &&
+    markers.some(m => r.name.indexOf(m) !== -1));
+return {
+    navigation: nav ? nav.toJSON() : null,
+    listings_api: listings.map(r => ({name: r.name, start: r.startTime, duration: r.duration,
+                                      transfer_size: r.transferSize})),
+    resource_count: resources.length,
+    transfer_bytes: resources.reduce((total, r) => total + (r.transferSize || 0), 0)
+};
+"""
+
+# One round trip per tab per poll: are the listings and prices there yet.
+# The stale flag is set on the old document before navigating, so a tab that
+# hasn't swapped documents yet isn't mistaken for the new page.
+TAB_STATE_SCRIPT = """
+const root = document.documentElement;
+return {
+    stale: !!(root && root.dataset.pullboxStale),
+    listings: document.querySelectorAll(arguments[0]).length,
+    prices: Array.from(document.querySelectorAll(arguments[1])).map(el => el.textContent)
+};
+"""
+TAB_NAVIGATE_SCRIPT = """
+if (document.documentElement) { document.documentElement.dataset.pullboxStale = '1'; }
+window.location.href = arguments[0];
+"""
+# Text on the bot-check and block pages put in front of TCGplayer
+CHALLENGE_MARKERS = ('access denied', 'just a moment', 'verify you are human', 'unusual traffic',
+                     'captcha', 'request blocked')
+CHALLENGE_SCRIPT = """
+const body = document.body ? document.body.innerText.slice(0, 2000) : '';
+return (document.title + ' ' + body).toLowerCase();
+"""
+
+TAB_POLL_SECONDS = 0.2
+# Prices keep rendering for a moment after the first one shows up
+TAB_SETTLE_SECONDS = 1.0
+
+# Waits time out at p99 of recent successful waits times the factor, within these bounds;
+# until a wait has MIN_SAMPLES the caller's fixed timeout is used
+TIMEOUT_FACTOR = 3
+MIN_TIMEOUT_SECONDS = 2
+MAX_TIMEOUT_SECONDS = 30
+MIN_SAMPLES = 20
+HISTORY_SAMPLES = 500
+# Every WIDEN_AFTER_TIMEOUTS timeouts in a row double a wait's learned timeout, up to
+# MAX_WIDEN_STEPS times and never past the caller's fixed timeout; only successes are recorded,
+# so otherwise a history learned on faster pages could never grow back. A dead page still
+# fails no slower than it did before there was any history.
+WIDEN_AFTER_TIMEOUTS = 3
+MAX_WIDEN_STEPS = 3
+
+class WaitHistory:
+    """How long each wait took when it succeeded, kept across runs, and the timeouts that follow from it"""
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv('WAIT_HISTORY_PATH') or os.path.join(
+            os.getenv('METRICS_DIR', 'metrics'), 'wait_history.json')
+        self._lock = threading.Lock()
+        self.samples = self._read()
+        self.new_samples = {}
+        self.timeout_streaks = {}
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def timeout(self, name, fallback):
+        with self._lock:
+            samples = self.samples.get(name, [])
+            if len(samples) < MIN_SAMPLES:
+                return fallback
+            p99 = pipelineMetrics.percentile(samples, 99)
+            steps = min(self.timeout_streaks.get(name, 0) // WIDEN_AFTER_TIMEOUTS, MAX_WIDEN_STEPS)
+        learned = min(MAX_TIMEOUT_SECONDS, max(MIN_TIMEOUT_SECONDS, p99 * TIMEOUT_FACTOR))
+        if not steps:
+            return learned
+        return min(max(learned, fallback), learned * 2 ** steps)
+
+    def record(self, name, seconds):
+        with self._lock:
+            self.timeout_streaks[name] = 0
+            self.samples.setdefault(name, []).append(round(seconds, 3))
+            del self.samples[name][:-HISTORY_SAMPLES]
+            self.new_samples.setdefault(name, []).append(round(seconds, 3))
+
+    def timed_out(self, name):
+        with self._lock:
+            streak = self.timeout_streaks[name] = self.timeout_streaks.get(name, 0) + 1
+        if streak % WIDEN_AFTER_TIMEOUTS == 0 and streak // WIDEN_AFTER_TIMEOUTS <= MAX_WIDEN_STEPS:
+            print(f"{streak} '{name}' waits in a row timed out, widening its timeout until one succeeds")
+
+    def save(self):
+        """Add this process's samples to the file; other runs may have written it meanwhile"""
+        with self._lock:
+            new_samples, self.new_samples = self.new_samples, {}
+        if not new_samples:
+            return
+        samples = self._read()
+        for name, values in new_samples.items():
+            samples[name] = (samples.get(name, []) + values)[-HISTORY_SAMPLES:]
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(samples, f)
+        os.replace(tmp_path, self.path)
+        with self._lock:
+            self.samples = samples
+
+_wait_history = None
+_wait_history_lock = threading.Lock()
+
+def wait_history():
+    global _wait_history
+    with _wait_history_lock:
+        if _wait_history is None:
+            _wait_history = WaitHistory()
+        return _wait_history
+
+class PageTimer:
+    """Time spent in our own waits and sleeps for one URL"""
+
+    def __init__(self, url, driver_label, proxy=None):
+        self.url = url
+        self.driver_label = str(driver_label)
+        self.proxy = proxy
+        self.started = time.perf_counter()
+        self.waits = {}
+        self.sleeps = 0.0
+        self.attempts = 0
+        self.error = None
+        self.challenged = False
+        self.cached = False
+
+    def attempt(self):
+        self.attempts += 1
+
+    def wait(self, driver, timeout, name, condition):
+        """Wait for condition, with timeout only as the fallback until the wait has history"""
+        history = wait_history()
+        start = time.perf_counter()
+        try:
+            result = WebDriverWait(driver, history.timeout(name, timeout)).until(condition)
+            history.record(name, time.perf_counter() - start)
+            return result
+        except TimeoutException:
+            history.timed_out(name)
+            raise
+        finally:
+            self.waits[name] = self.waits.get(name, 0) + time.perf_counter() - start
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+        self.sleeps += seconds
+
+def load_listing_page(driver, url, timer, timeout):
+    """Navigate to a listing page and wait until the listings are in the DOM"""
+    timer.attempt()
+    with pipelineMetrics.timed('page_load', driver=timer.driver_label):
+        start = time.perf_counter()
+        driver.get(url)
+        timer.waits['navigation'] = timer.waits.get('navigation', 0) + time.perf_counter() - start
+        timer.sleep(1)
+
+        timer.wait(driver, timeout, 'button', EC.presence_of_all_elements_located((By.CSS_SELECTOR, BUTTON_SELECTOR)))
+    timer.sleep(0.1)
+
+    with pipelineMetrics.timed('extract', driver=timer.driver_label, step='listings'):
+        listing_elements = timer.wait(driver, timeout, 'listings',
+                                      EC.presence_of_all_elements_located((By.CSS_SELECTOR, LISTING_SELECTOR)))
+    timer.sleep(1)
+    return listing_elements
+
+def extract_listing_prices(driver, timer, timeout=10):
+    """Read every listing price on the loaded page; unparseable prices are skipped"""
+    prices = []
+    with pipelineMetrics.timed('extract', driver=timer.driver_label, step='prices'):
+        price_elements = timer.wait(driver, timeout, 'prices',
+                                    EC.presence_of_all_elements_located((By.CSS_SELECTOR, PRICE_SELECTOR)))
+        print("found elements")
+
+        price_texts = timer.wait(driver, timeout, 'price_text',
+                                 lambda x: [el.get_attribute('textContent') for el in price_elements])
+
+        prices = parse_prices(price_texts)
+    if prices:
+        cache_listing(timer.url, price_texts)
+    return prices
+
+def parse_prices(price_texts):
+    prices = []
+    for price_text in price_texts:
+        try:
+            price = float(price_text.replace('$', '').replace(',', ''))
+            prices.append(price)
+        except ValueError:
+            print("no price")
+    return prices
+
+def cached_listing_prices(url, timer=None):
+    """Prices from the response cache for a listing read within the TTL, or None"""
+    cache = responseCache.default_cache()
+    if cache is None:
+        return None
+    price_texts = cache.get('listing', responseCache.canonical_listing_url(url))
+    if not price_texts:
+        return None
+    if timer is not None:
+        timer.cached = True
+    return parse_prices(price_texts)
+
+def cache_listing(url, price_texts):
+    cache = responseCache.default_cache()
+    if cache is not None:
+        cache.put('listing', responseCache.canonical_listing_url(url), list(price_texts))
+
+class TabLoader:
+    """Several listing pages loading at once in one browser, one per tab.
+
+    Navigation is started with JavaScript so it doesn't block, then the tabs
+    are polled round-robin; a tab whose page is done takes the next URL.
+    The tabs share the browser's cache and cookies.
+    """
+
+    def __init__(self, driver, tabs, driver_label, timeout=10, max_attempts=2):
+        self.driver = driver
+        self.driver_label = driver_label
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        # (url, timer) for every page in flight when the browser was lost
+        self.in_flight = []
+        while len(driver.window_handles) < tabs:
+            driver.switch_to.new_window('tab')
+        self.handles = driver.window_handles[:tabs]
+
+    def _start(self, handle, url, timer):
+        self.driver.switch_to.window(handle)
+        timer.attempt()
+        self.driver.execute_script(TAB_NAVIGATE_SCRIPT, url)
+        return {"url": url, "timer": timer, "started": time.perf_counter(), "prices_seen": None,
+                "timeout": wait_history().timeout('tab', self.timeout)}
+
+    def _poll(self, page):
+        """True once the page is finished, with timer.error set if it failed"""
+        timer = page["timer"]
+        now = time.perf_counter()
+        try:
+            state = self.driver.execute_script(TAB_STATE_SCRIPT, LISTING_SELECTOR, PRICE_SELECTOR)
+        except Exception as e:
+            # Scripts can fail while the tab is between documents; only the deadline ends the page
+            state = {"stale": True, "listings": 0, "prices": []}
+            page["script_error"] = type(e).__name__
+        if not state["stale"] and state["prices"]:
+            if page["prices_seen"] is None:
+                page["prices_seen"] = now
+                wait_history().record('tab', now - page["started"])
+            elif now - page["prices_seen"] >= TAB_SETTLE_SECONDS:
+                page["prices"] = parse_prices(state["prices"])
+                timer.error = None if page["prices"] else "no prices"
+                if page["prices"]:
+                    cache_listing(page["url"], state["prices"])
+                return True
+            return False
+        if now - page["started"] >= page["timeout"]:
+            if not page["prices_seen"]:
+                wait_history().timed_out('tab')
+            if not state["stale"] and state["listings"]:
+                timer.error = "no prices"
+            else:
+                timer.error = page.get("script_error") or "TimeoutException"
+            return True
+        return False
+
+    def run(self, urls, on_page):
+        """Load every URL, calling on_page(url, prices, timer) once per URL; prices is None on failure.
+
+        When the browser is lost, raises driverSupervisor.BrowserLost with the
+        URLs that were loading or waiting for a retry left in in_flight, for
+        the caller to requeue or report; on_page is not called for them.
+        """
+        urls = iter(urls)
+        retries = deque()
+        active = {}
+        # A URL taken from urls or retries whose tab hasn't started yet
+        starting = None
+
+        def next_url():
+            if retries:
+                return retries.popleft()
+            for url in urls:
+                timer = PageTimer(url, self.driver_label)
+                prices = cached_listing_prices(url, timer)
+                if prices:
+                    on_page(url, prices, timer)
+                    continue
+                return url, timer
+            return None
+
+        try:
+            while True:
+                for handle in self.handles:
+                    if handle not in active:
+                        starting = next_url()
+                        if starting is not None:
+                            active[handle] = self._start(handle, *starting)
+                            starting = None
+                if not active:
+                    return
+                for handle, page in list(active.items()):
+                    self.driver.switch_to.window(handle)
+                    if not self._poll(page):
+                        continue
+                    del active[handle]
+                    timer = page["timer"]
+                    timer.waits['tab'] = timer.waits.get('tab', 0) + time.perf_counter() - page["started"]
+                    pipelineMetrics.record_stage('page_load', time.perf_counter() - page["started"],
+                                                 driver=timer.driver_label, mode='tab')
+                    if timer.error and timer.attempts < self.max_attempts:
+                        retries.append((page["url"], timer))
+                        continue
+                    on_page(page["url"], None if timer.error else page["prices"], timer)
+                time.sleep(TAB_POLL_SECONDS)
+        except Exception as e:
+            if not driverSupervisor.is_browser_lost(e):
+                raise
+            self.in_flight = ([starting] if starting else []) + [(page["url"], page["timer"])
+                                                                 for page in active.values()] + list(retries)
+            raise driverSupervisor.BrowserLost(str(e)) from e
+
+def detect_challenge(driver):
+    """True when the page in the browser is a bot check or block page rather than a listing"""
+    try:
+        text = driver.execute_script(CHALLENGE_SCRIPT) or ''
+    except Exception:
+        return False
+    return any(marker in text for marker in CHALLENGE_MARKERS)
+
+def collect_browser_timing(driver):
+    """Navigation and listings-API Resource Timing for the current page, or None"""
+    try:
+        return driver.execute_script(BROWSER_TIMING_SCRIPT, list(LISTINGS_API_MARKERS))
+    except Exception:
+        return None
+
+def browser_phases(timing):
+    """Split Navigation Timing into the phases we act on, in milliseconds"""
+    if not timing or not timing.get('navigation'):
+        return {}
+    nav = timing['navigation']
+
+    def span(start_key, end_key):
+        start, end = nav.get(start_key) or 0, nav.get(end_key) or 0
+        return round(end - start, 1) if end >= start and end else None
+
+    phases = {
+        "dns_ms": span('domainLookupStart', 'domainLookupEnd'),
+        "connect_tls_ms": span('connectStart', 'connectEnd'),
+        "ttfb_ms": span('requestStart', 'responseStart'),
+        "html_ms": span('responseStart', 'responseEnd'),
+        "hydration_ms": span('responseEnd', 'domContentLoadedEventEnd'),
+        "load_event_ms": span('domContentLoadedEventEnd', 'loadEventEnd'),
+        "resource_count": timing.get('resource_count'),
+        "transfer_bytes": timing.get('transfer_bytes'),
+    }
+    listings = timing.get('listings_api') or []
+    if listings:
+        phases["listings_api_ms"] = round(max(r['duration'] for r in listings), 1)
+        phases["listings_api_end_ms"] = round(max(r['start'] + r['duration'] for r in listings), 1)
+    return phases
+
+class PageTimingLog:
+    """One JSON line per URL plus per-driver, per-proxy and per-run aggregates"""
+
+    PHASES = ('dns_ms', 'connect_tls_ms', 'ttfb_ms', 'html_ms', 'hydration_ms',
+              'listings_api_ms', 'wait_ms', 'sleep_ms', 'total_ms')
+
+    def __init__(self, job, output_dir=None):
+        output_dir = output_dir or os.getenv('METRICS_DIR', 'metrics')
+        os.makedirs(output_dir, exist_ok=True)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.path = os.path.join(output_dir, f"page_timings_{job}_{timestamp}.jsonl")
+        self.summary_path = os.path.join(output_dir, f"page_timings_{job}_{timestamp}_summary.json")
+        self.records = []
+        self._lock = threading.Lock()
+
+    def add(self, record):
+        with self._lock:
+            self.records.append(record)
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(record) + "\n")
+
+    def _aggregate(self, records):
+        summary = {"urls": len(records), "ok": len([r for r in records if r['outcome'] == 'ok'])}
+        for phase in self.PHASES:
+            values = [r[phase] for r in records if r.get(phase) is not None]
+            if values:
+                summary[phase] = {
+                    "p50": round(pipelineMetrics.percentile(values, 50), 1),
+                    "p90": round(pipelineMetrics.percentile(values, 90), 1),
+                    "p99": round(pipelineMetrics.percentile(values, 99), 1),
+                    "sum": round(sum(values), 1),
+                }
+        return summary
+
+    def summary(self):
+        with self._lock:
+            records = list(self.records)
+        by_driver = {}
+        by_proxy = {}
+        for record in records:
+            by_driver.setdefault(record['driver'], []).append(record)
+            by_proxy.setdefault(record.get('proxy') or 'direct', []).append(record)
+        run = self._aggregate(records)
+        # Which phase ate the most wall time across the run
+        run["phase_share"] = {
+            phase: round(run[phase]["sum"] / run["total_ms"]["sum"], 3)
+            for phase in self.PHASES
+            if phase in run and phase != 'total_ms' and run.get("total_ms", {}).get("sum")
+        }
+        return {
+            "run": run,
+            "by_driver": {name: self._aggregate(rs) for name, rs in sorted(by_driver.items())},
+            "by_proxy": {name: self._aggregate(rs) for name, rs in sorted(by_proxy.items())},
+        }
+
+    def write_summary(self):
+        wait_history().save()
+        with open(self.summary_path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+        print(f"Page timings written to {self.path} and {self.summary_path}")
+        return self.summary_path
+
+def finish_page(timing_log, driver, timer, outcome):
+    """Build the URL's record from our timer and the browser's timing, and log it"""
+    record = {
+        "url": timer.url,
+        "driver": timer.driver_label,
+        "proxy": timer.proxy,
+        "outcome": outcome,
+        "error": timer.error,
+        "challenged": timer.challenged,
+        "cached": timer.cached,
+        "attempts": timer.attempts,
+        "waits_ms": {name: round(seconds * 1000, 1) for name, seconds in timer.waits.items()},
+        "wait_ms": round(sum(timer.waits.values()) * 1000, 1),
+        "sleep_ms": round(timer.sleeps * 1000, 1),
+        "total_ms": round((time.perf_counter() - timer.started) * 1000, 1),
+        "at": datetime.now().isoformat(timespec='seconds'),
+    }
+    if not timer.cached:
+        record.update(browser_phases(collect_browser_timing(driver)))
+    if timing_log is not None:
+        timing_log.add(record)
+    return record
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The scripts are flat top-level modules, imported the way the jobs import each other
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
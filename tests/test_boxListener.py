@@ -0,0 +1,41 @@
+from boxListener import Debouncer
+
+def test_box_is_due_once_quiet():
+    debouncer = Debouncer(quiet_seconds=5, max_delay_seconds=60)
+    debouncer.add('a', now=0)
+    assert debouncer.pop_due(now=4) == []
+    assert debouncer.pop_due(now=5) == ['a']
+    assert debouncer.pop_due(now=6) == []
+
+def test_new_change_restarts_the_quiet_period():
+    debouncer = Debouncer(quiet_seconds=5, max_delay_seconds=60)
+    debouncer.add('a', now=0)
+    debouncer.add('a', now=4)
+    assert debouncer.pop_due(now=5) == []
+    assert debouncer.pop_due(now=9) == ['a']
+
+def test_busy_box_is_due_after_max_delay():
+    debouncer = Debouncer(quiet_seconds=5, max_delay_seconds=12)
+    for now in range(0, 12, 2):
+        debouncer.add('a', now=now)
+        assert debouncer.pop_due(now=now) == []
+    debouncer.add('a', now=12)
+    assert debouncer.pop_due(now=12) == ['a']
+
+def test_seconds_until_due_is_the_earliest_box():
+    debouncer = Debouncer(quiet_seconds=5, max_delay_seconds=8)
+    assert debouncer.seconds_until_due(now=0) is None
+    debouncer.add('a', now=0)
+    debouncer.add('b', now=2)
+    assert debouncer.seconds_until_due(now=1) == 4
+    debouncer.add('a', now=4)
+    # a is now held to its max delay at 8, b is due at 7
+    assert debouncer.seconds_until_due(now=4) == 3
+    assert debouncer.seconds_until_due(now=20) == 0
+
+def test_clear_drops_pending_boxes():
+    debouncer = Debouncer(quiet_seconds=5, max_delay_seconds=60)
+    debouncer.add('a', now=0)
+    debouncer.clear()
+    assert debouncer.pop_due(now=100) == []
+    assert debouncer.seconds_until_due(now=100) is None
@@ -0,0 +1,60 @@
+import queue
+
+import browserWorkers
+from browserWorkers import WorkerSupervisor
+
+def supervisor_holding(urls):
+    """A supervisor whose workers 1..n each hold one URL, without starting any processes"""
+    supervisor = WorkerSupervisor(None, len(urls))
+    for position, url in enumerate(urls, start=1):
+        supervisor.in_flight[position] = (url, 0)
+    return supervisor
+
+def test_done_frees_the_worker_and_keeps_its_results():
+    supervisor = supervisor_holding(['a'])
+    supervisor.handle(('done', 1, 'a', [('a', 4.5)]))
+    assert supervisor.in_flight == {}
+    assert supervisor.results == [('a', 4.5)]
+    assert supervisor.finished == {'a'}
+
+def test_url_reported_twice_counts_once():
+    supervisor = supervisor_holding(['a'])
+    supervisor.handle(('done', 1, 'a', [('a', 4.5)]))
+    # e.g. from a worker killed as hung after it had reported
+    supervisor.handle(('done', 1, 'a', [('a', 4.5)]))
+    assert supervisor.results == [('a', 4.5)]
+
+def test_report_for_a_url_the_worker_no_longer_holds_keeps_its_current_one():
+    supervisor = supervisor_holding(['b'])
+    supervisor.handle(('done', 1, 'a', [('a', 4.5)]))
+    assert supervisor.in_flight == {1: ('b', 0)}
+
+def test_requeued_url_goes_back_once_then_fails():
+    supervisor = supervisor_holding(['a'])
+    supervisor.handle(('requeue', 1, 'a'))
+    assert list(supervisor.pending) == ['a']
+    assert supervisor.in_flight == {}
+    supervisor.pending.clear()
+    supervisor.in_flight[1] = ('a', 0)
+    supervisor.handle(('requeue', 1, 'a'))
+    assert list(supervisor.pending) == []
+    assert supervisor.results == [('a', None)]
+
+def test_requeue_is_limited_per_url():
+    supervisor = WorkerSupervisor(None, 1)
+    for _ in range(browserWorkers.MAX_REQUEUES):
+        assert supervisor.requeue('a')
+    assert not supervisor.requeue('a')
+    assert supervisor.requeue('b')
+    assert list(supervisor.pending) == ['a'] * browserWorkers.MAX_REQUEUES + ['b']
+
+def test_dispatch_skips_finished_urls():
+    supervisor = WorkerSupervisor(None, 1)
+    supervisor.processes[1] = object()
+    supervisor.inboxes[1] = queue.Queue()
+    supervisor.finished.add('a')
+    supervisor.pending.extend(['a', 'b'])
+    supervisor.dispatch()
+    supervisor.dispatch()
+    assert supervisor.inboxes[1].get_nowait() == 'b'
+    assert supervisor.in_flight[1][0] == 'b'
@@ -0,0 +1,70 @@
+import time
+
+import pytest
+
+from concurrencyLimiter import AimdLimiter
+
+def respond(limiter, seconds=0.1, congested=False, sent_at=None):
+    limiter.acquire()
+    limiter.release(time.monotonic() if sent_at is None else sent_at, seconds, congested)
+
+def test_healthy_responses_grow_the_limit_additively():
+    limiter = AimdLimiter(initial=1, max_limit=64)
+    respond(limiter)
+    assert limiter.limit == 2
+    # Each response while the limit is full adds 1/limit
+    for _ in range(2):
+        limiter.acquire()
+        limiter.acquire()
+        limiter.release(time.monotonic(), 0.1, False)
+        limiter.release(time.monotonic(), 0.1, False)
+    assert limiter.limit == pytest.approx(2 + 1 / 2 + 1 / 2.5)
+
+def test_limit_grows_only_while_it_is_the_bottleneck():
+    limiter = AimdLimiter(initial=8)
+    respond(limiter)
+    assert limiter.limit == 8
+
+def test_congestion_halves_the_limit():
+    limiter = AimdLimiter(initial=8)
+    respond(limiter, congested=True)
+    assert limiter.limit == 4
+    assert limiter.report()["decreases"] == 1
+
+def test_one_burst_cuts_once():
+    limiter = AimdLimiter(initial=8)
+    sent_at = time.monotonic()
+    for _ in range(3):
+        respond(limiter, congested=True, sent_at=sent_at)
+    assert limiter.limit == 4
+    # A request sent after the cut can cut again
+    respond(limiter, congested=True)
+    assert limiter.limit == 2
+
+def test_rising_latency_counts_as_congestion():
+    limiter = AimdLimiter(initial=8)
+    respond(limiter, seconds=0.1)
+    respond(limiter, seconds=2.0)
+    assert limiter.limit == 4
+
+def test_limit_stays_within_bounds():
+    limiter = AimdLimiter(initial=2, min_limit=1, max_limit=2)
+    for _ in range(3):
+        respond(limiter, congested=True)
+    assert limiter.limit == 1
+    for _ in range(10):
+        respond(limiter)
+    assert limiter.limit == 2
+
+def test_slot_treats_429_and_no_answer_as_congestion():
+    limiter = AimdLimiter(initial=8)
+    with limiter.slot() as labels:
+        labels['status'] = 429
+    assert limiter.limit == 4
+    try:
+        with limiter.slot():
+            raise ConnectionError
+    except ConnectionError:
+        pass
+    assert limiter.limit == 2
+    assert limiter.in_flight == 0
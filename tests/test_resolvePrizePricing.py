@@ -0,0 +1,59 @@
+from datetime import datetime, timedelta, timezone
+
+from resolvePrizePricing import api_price_for, build_scrape_queue
+
+MAX_AGE = timedelta(hours=72)
+
+def api_data(price='4.50', priced_at=None, purple_mana_id='12345-near-mint'):
+    return {"purple_mana_id": purple_mana_id, "tcglow": {"Near Mint": price}, "priced_at": priced_at}
+
+def test_fresh_price_is_used():
+    priced_at = datetime.now(timezone.utc) - timedelta(hours=1)
+    assert api_price_for(api_data(priced_at=priced_at), MAX_AGE) == (4.5, None)
+
+def test_naive_timestamp_is_read_as_utc():
+    priced_at = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(hours=1)
+    assert api_price_for(api_data(priced_at=priced_at), MAX_AGE) == (4.5, None)
+
+def test_undated_price_is_used():
+    assert api_price_for(api_data(priced_at=None), MAX_AGE) == (4.5, None)
+
+def test_stale_price_is_a_miss():
+    priced_at = datetime.now(timezone.utc) - timedelta(hours=73)
+    price, reason = api_price_for(api_data(priced_at=priced_at), MAX_AGE)
+    assert price is None
+    assert reason.startswith("stale tcglow price")
+
+def test_api_error_is_a_miss():
+    assert api_price_for({"error": "HTTP 404"}, MAX_AGE) == (None, "HTTP 404")
+
+def test_missing_condition_is_a_miss():
+    price, reason = api_price_for(api_data(purple_mana_id='12345-damaged'), MAX_AGE)
+    assert price is None
+    assert reason == "no tcglow price for condition 'Damaged'"
+
+def test_unparseable_price_is_a_miss():
+    price, reason = api_price_for(api_data(price='n/a'), MAX_AGE)
+    assert price is None
+    assert reason.startswith("unparseable")
+
+def test_non_positive_price_is_a_miss():
+    for value in ('0', -1):
+        price, reason = api_price_for(api_data(price=value), MAX_AGE)
+        assert price is None
+        assert reason.startswith("non-positive")
+
+def test_scrape_queue_groups_prizes_by_listing():
+    first = 'https://www.tcgplayer.com/product/5/slug-a?Condition=Near+Mint&Language=English'
+    same_listing = 'https://WWW.tcgplayer.com/product/5/slug-b?Language=English&utm_source=x&Condition=Near+Mint'
+    other_condition = 'https://www.tcgplayer.com/product/5/slug-a?Condition=Damaged&Language=English'
+    misses = [(1, first, "stale"), (2, same_listing, "stale"), (3, other_condition, "HTTP 404")]
+    prize_ids_by_url, unresolvable = build_scrape_queue(misses)
+    assert prize_ids_by_url == {first: [1, 2], other_condition: [3]}
+    assert unresolvable == []
+
+def test_scrape_queue_reports_prizes_without_a_url():
+    prize_ids_by_url, unresolvable = build_scrape_queue([(1, None, "no purple mana id"), (2, '', "HTTP 404")])
+    assert prize_ids_by_url == {}
+    assert unresolvable == [{"prize_id": "1", "reason": "no purple mana id"},
+                            {"prize_id": "2", "reason": "HTTP 404"}]
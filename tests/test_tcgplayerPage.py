@@ -0,0 +1,55 @@
+import tcgplayerPage
+from tcgplayerPage import WaitHistory
+
+def history_with(tmp_path, seconds):
+    history = WaitHistory(str(tmp_path / 'wait_history.json'))
+    history.samples['listings'] = [seconds] * tcgplayerPage.MIN_SAMPLES
+    return history
+
+def test_fallback_until_enough_samples(tmp_path):
+    history = WaitHistory(str(tmp_path / 'wait_history.json'))
+    history.samples['listings'] = [0.5] * (tcgplayerPage.MIN_SAMPLES - 1)
+    assert history.timeout('listings', 10) == 10
+
+def test_learned_timeout_is_clamped(tmp_path):
+    assert history_with(tmp_path, 0.1).timeout('listings', 10) == tcgplayerPage.MIN_TIMEOUT_SECONDS
+    assert history_with(tmp_path, 60).timeout('listings', 10) == tcgplayerPage.MAX_TIMEOUT_SECONDS
+    assert history_with(tmp_path, 1).timeout('listings', 10) == 1 * tcgplayerPage.TIMEOUT_FACTOR
+
+def test_timeouts_widen_in_steps_up_to_the_fallback(tmp_path):
+    history = history_with(tmp_path, 0.5)
+    timeouts = []
+    for _ in range(12):
+        history.timed_out('listings')
+        timeouts.append(history.timeout('listings', 10))
+    assert timeouts == [2, 2, 4, 4, 4, 8, 8, 8, 10, 10, 10, 10]
+
+def test_widening_stops_after_max_steps(tmp_path):
+    history = history_with(tmp_path, 0.5)
+    for _ in range(tcgplayerPage.WIDEN_AFTER_TIMEOUTS * (tcgplayerPage.MAX_WIDEN_STEPS + 3)):
+        history.timed_out('listings')
+    assert history.timeout('listings', 100) == 2 * 2 ** tcgplayerPage.MAX_WIDEN_STEPS
+
+def test_widening_never_narrows_a_learned_timeout_above_the_fallback(tmp_path):
+    history = history_with(tmp_path, 5)
+    for _ in range(tcgplayerPage.WIDEN_AFTER_TIMEOUTS):
+        history.timed_out('listings')
+    assert history.timeout('listings', 10) == 15
+
+def test_success_resets_the_widening(tmp_path):
+    history = history_with(tmp_path, 0.5)
+    for _ in range(tcgplayerPage.WIDEN_AFTER_TIMEOUTS):
+        history.timed_out('listings')
+    assert history.timeout('listings', 10) == 4
+    history.record('listings', 0.5)
+    assert history.timeout('listings', 10) == 2
+
+def test_save_merges_with_the_file(tmp_path):
+    path = str(tmp_path / 'wait_history.json')
+    first = WaitHistory(path)
+    second = WaitHistory(path)
+    first.record('listings', 1.0)
+    second.record('listings', 2.0)
+    first.save()
+    second.save()
+    assert WaitHistory(path).samples == {'listings': [1.0, 2.0]}
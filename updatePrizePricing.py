@@ -1,44 +1,53 @@
 import psycopg2
 from psycopg2.extras import execute_batch
 import os
-from dotenv import load_dotenv
-from urllib.parse import urlparse
 import requests
 import json
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
-def query_prize_table():
-    load_dotenv()
-    database_url = os.getenv('STAGING_DATABASE_URL')
-    if not database_url:
+import concurrencyLimiter
+import httpPolicy
+import pipelineMetrics
+import profilingHooks
+import responseCache
+from pricingConfig import DEFAULT_PURPLE_MANA_API_URL, load_config
+
+# Keys the catalog payload has used for the time its tcglow prices were refreshed
+PRICE_TIMESTAMP_KEYS = ('tcglow_updated_at', 'updatedAt', 'updated_at')
+
+def condition_from_purple_mana_id(purple_mana_id):
+    """Turn an id like '12345-near-mint' into the tcglow key 'Near Mint'"""
+    return ' '.join(word.capitalize() for word in str(purple_mana_id).split('-')[1:])
+
+def extract_price_timestamp(json_data):
+    """Return the timestamp the API reports for its tcglow prices, if any"""
+    for key in PRICE_TIMESTAMP_KEYS:
+        raw = json_data.get(key)
+        if not raw:
+            continue
+        try:
+            return datetime.fromisoformat(str(raw).replace('Z', '+00:00'))
+        except ValueError:
+            continue
+    return None
+
+def query_prize_table(config=None):
+    config = config or load_config('staging')
+    if not config.database_url:
         print("DATABASE_URL not found in .env file")
         return
 
-    # Parse the DATABASE_URL
-    parsed_url = urlparse(database_url)
-    dbname = parsed_url.path[1:]  
-    user = parsed_url.username
-    password = parsed_url.password
-    host = parsed_url.hostname
-    port = parsed_url.port or 5432 
-
     try:
-        conn = psycopg2.connect(
-            dbname=dbname,
-            user=user,
-            password=password,
-            host=host,
-            port=port,
-            sslmode='require'
-        )
-        print("Connected to the database successfully!")
-
-        cur = conn.cursor()
+        # The catalog read can go to the replica; the price write below can't
+        with config.connection(readonly=True) as conn:
+            print("Connected to the database successfully!")
 
-        cur.execute("SELECT purple_mana_new_inv_id, id FROM prize WHERE is_manually_priced = false")
+            with conn.cursor() as cur:
+                with pipelineMetrics.timed('db_read'):
+                    cur.execute("SELECT purple_mana_new_inv_id, id FROM prize WHERE is_manually_priced = false")
 
-        rows = cur.fetchall()
+                    rows = cur.fetchall()
 
         ids = [(row[0], row[1]) for row in rows]
 
@@ -50,14 +59,15 @@ def query_prize_table():
         return []
 
     finally:
-        if 'cur' in locals() and cur:
-            cur.close()
-        if 'conn' in locals() and conn:
-            conn.close()
         print("Database connection closed.")
 
-def make_api_request(purple_mana_id, database_id):
-    base_url = "https://www.purplemana.com/api/trpc/catalogProducts.getOne,catalogProducts.getSalesHistory"
+def make_api_request(purple_mana_id, database_id, base_url=None, session=None, limiter=None):
+    """Fetch one product's tcglow prices; session lets a long-lived caller reuse connections.
+
+    Retries and backoff are httpPolicy's; with a limiter (concurrencyLimiter.AimdLimiter)
+    each attempt waits for a slot.
+    """
+    base_url = base_url or os.getenv('PURPLE_MANA_API_URL', DEFAULT_PURPLE_MANA_API_URL)
     
     # Ensure purple_mana_id is a string and remove any decimal point
     purple_mana_id = str(purple_mana_id).split('.')[0]
@@ -66,11 +76,22 @@ def make_api_request(purple_mana_id, database_id):
     input_param = f"%7B%220%22%3A%7B%22json%22%3A%7B%22id%22%3A%22{numeric_id}%22%7D%7D%2C%221%22%3A%7B%22json%22%3A%7B%22product_id%22%3A{numeric_id}%7D%7D%7D"
     full_url = f"{base_url}?batch=1&input={input_param}"
     
+    # Every condition of a product shares one response
+    cache = responseCache.default_cache()
+    cache_key = f"{base_url}#{numeric_id}"
+    
     try:
-        response = requests.get(full_url)
-        response.raise_for_status()
-        
-        data = response.json()
+        data = cache.get('tcglow', cache_key) if cache else None
+        cached = data is not None
+        if not cached:
+            with pipelineMetrics.timed('api_fetch') as labels:
+                # A batch job: sit out an open circuit rather than fail every queued product
+                response = httpPolicy.get(full_url, session=session, limiter=limiter, wait_for_circuit=True)
+                labels['status'] = response.status_code
+                response.raise_for_status()
+            
+            with pipelineMetrics.timed('parse'):
+                data = response.json()
         
         # # Log the raw data received
         # print(f"Raw data for {purple_mana_id}: {json.dumps(data, indent=2)}")
@@ -80,9 +101,12 @@ def make_api_request(purple_mana_id, database_id):
             if isinstance(json_data, dict):
                 tcglow = json_data.get('tcglow', {})
                 if isinstance(tcglow, dict):
+                    if cache and not cached:
+                        cache.put('tcglow', cache_key, data)
                     processed_data = {
                         "purple_mana_id": purple_mana_id,
                         "tcglow": tcglow,
+                        "priced_at": extract_price_timestamp(json_data),
                     }
                     # print(f"Processed data for {purple_mana_id}: {json.dumps(processed_data, indent=2)}")
                     return database_id, processed_data
@@ -99,59 +123,42 @@ def make_api_request(purple_mana_id, database_id):
     except Exception as e:
         return database_id, {"error": f"Unexpected error: {str(e)}"}
 
-def update_prize_table(results):
-    load_dotenv()
-    database_url = os.getenv('STAGING_DATABASE_URL')
-    if not database_url:
+def update_prize_table(results, config=None):
+    config = config or load_config('staging')
+    if not config.database_url:
         print("DATABASE_URL not found in .env file")
         return
 
-    # Parse the DATABASE_URL
-    parsed_url = urlparse(database_url)
-    dbname = parsed_url.path[1:] 
-    user = parsed_url.username
-    password = parsed_url.password
-    host = parsed_url.hostname
-    port = parsed_url.port or 5432 
-
-    try:
-        conn = psycopg2.connect(
-            dbname=dbname,
-            user=user,
-            password=password,
-            host=host,
-            port=port,
-            sslmode='require'
-        )
-        print("Connected to the database successfully!")
-
-        cur = conn.cursor()
-
-        # Prepare the data for batch update
-        update_data = []
-        for database_id, data in results.items():
-            if 'tcglow' in data and isinstance(data['tcglow'], dict):
-                # Extract condition from purple_mana_id and capitalize each word
-                condition = ' '.join(word.capitalize() for word in data['purple_mana_id'].split('-')[1:])
-                price = data['tcglow'].get(condition)
-                if price is not None:
-                    update_data.append((price, database_id))
-                else:
-                    print(f"No price found for condition '{condition}' in item {data['purple_mana_id']}")
+    # Prepare the data for batch update
+    update_data = []
+    for database_id, data in results.items():
+        if 'tcglow' in data and isinstance(data['tcglow'], dict):
+            # Extract condition from purple_mana_id and capitalize each word
+            condition = condition_from_purple_mana_id(data['purple_mana_id'])
+            price = data['tcglow'].get(condition)
+            if price is not None:
+                update_data.append((price, database_id))
             else:
-                print(f"Invalid data structure for item {database_id}")
+                print(f"No price found for condition '{condition}' in item {data['purple_mana_id']}")
+        else:
+            print(f"Invalid data structure for item {database_id}")
 
-        print(f"Prepared {len(update_data)} items for update")
+    print(f"Prepared {len(update_data)} items for update")
 
-        # Perform batch update
-        if update_data:
-            execute_batch(cur, 
-                          "UPDATE prize SET value = %s WHERE id = %s",
-                          update_data)
-            conn.commit()
-            updated_rows = len(update_data)
-        else:
-            updated_rows = 0
+    try:
+        with config.connection() as conn:
+            print("Connected to the database successfully!")
+
+            # Perform batch update
+            if update_data:
+                with conn.cursor() as cur, pipelineMetrics.timed('db_write'):
+                    execute_batch(cur, 
+                                  "UPDATE prize SET value = %s WHERE id = %s",
+                                  update_data)
+                    conn.commit()
+                updated_rows = len(update_data)
+            else:
+                updated_rows = 0
 
         print(f"Actually updated {updated_rows} rows")
         return updated_rows
@@ -162,22 +169,22 @@ def update_prize_table(results):
         return 0  # Return 0 if there was an error
 
     finally:
-        if 'cur' in locals() and cur:
-            cur.close()
-        if 'conn' in locals() and conn:
-            conn.close()
         print("Database connection closed.")
 
-def main():
-    ids = query_prize_table()
+def main(config=None, session=None):
+    config = config or load_config('staging')
+    with profilingHooks.stage('db_read'):
+        ids = query_prize_table(config) or []
     results = {}
     errors = []
+    # Sets how many requests are in flight; the pool only has to be big enough for its maximum
+    limiter = concurrencyLimiter.AimdLimiter()
     
     def process_batch(batch):
         batch_results = {}
         batch_errors = []
-        with ThreadPoolExecutor(max_workers=32) as executor:
-            future_to_id = {executor.submit(make_api_request, purple_mana_id, database_id): (purple_mana_id, database_id) for purple_mana_id, database_id in batch}
+        with ThreadPoolExecutor(max_workers=limiter.max_limit) as executor:
+            future_to_id = {executor.submit(make_api_request, purple_mana_id, database_id, config.purple_mana_api_url, session, limiter): (purple_mana_id, database_id) for purple_mana_id, database_id in batch}
             for future in as_completed(future_to_id):
                 purple_mana_id, database_id = future_to_id[future]
                 try:
@@ -198,18 +205,19 @@ def main():
                     })
         return batch_results, batch_errors
 
-    # First pass
-    results, errors = process_batch(ids)
+    with profilingHooks.stage('api_fetch'):
+        # First pass; transient failures are retried per request, with backoff, by httpPolicy
+        results, errors = process_batch(ids)
 
-    # Retry failed requests
-    if errors:
-        print(f"Retrying {len(errors)} failed requests...")
-        retry_ids = [(error['purple_mana_id'], error['database_id']) for error in errors]
-        retry_results, retry_errors = process_batch(retry_ids)
-        
-        # Update results and errors
-        results.update(retry_results)
-        errors = retry_errors
+        # Final pass for whatever still failed, e.g. through an outage longer than the circuit wait
+        if errors:
+            print(f"Retrying {len(errors)} failed requests...")
+            retry_ids = [(error['purple_mana_id'], error['database_id']) for error in errors]
+            retry_results, retry_errors = process_batch(retry_ids)
+            
+            # Update results and errors
+            results.update(retry_results)
+            errors = retry_errors
 
     # Save errors to a JSON file
     if errors:
@@ -219,7 +227,8 @@ def main():
             json.dump(errors, f, indent=2)
 
     # Update the prize table with the new values
-    updated_rows = update_prize_table(results)
+    with profilingHooks.stage('db_write'):
+        updated_rows = update_prize_table(results, config)
 
     # Print final summary
     print(f"Processed {len(ids)} items:")
@@ -228,6 +237,14 @@ def main():
     if errors:
         print(f"Error details saved to {filename}")
     print(f"Updated {updated_rows} rows in the prize table.")
+    concurrency = limiter.report()
+    print(f"Purple Mana concurrency: ended at {concurrency['final_limit']}, "
+          f"peaked at {concurrency['max_limit_reached']}, cut {concurrency['decreases']} times")
+
+    pipelineMetrics.inc('items_total', len(results), outcome='ok')
+    pipelineMetrics.inc('items_total', len(errors), outcome='error')
+    pipelineMetrics.export_run('price-api', extra={"concurrency": concurrency})
 
 if __name__ == "__main__":
+    profilingHooks.configure('price-api')
     main()
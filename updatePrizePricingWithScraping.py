@@ -1,78 +1,77 @@
 import os
-from dotenv import load_dotenv
-from urllib.parse import urlparse
 import psycopg2
-import pyautogui
 import time
 import random
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException, StaleElementReferenceException
 import logging
-import undetected_chromedriver as uc
-from fake_useragent import UserAgent
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from screeninfo import get_monitors
-import requests
-from psycopg2.pool import ThreadedConnectionPool
+
+import browserFleet
+import catalogIndex
+import driverSupervisor
+import httpPolicy
+import pipelineMetrics
+import profilingHooks
+import proxyPool
+import scrapeFailures
+import tcgplayerPage
+from pricingConfig import load_config
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
 # Add at the top with other globals
 connection_pool = None
+page_timing_log = None
+# The run's catalog, for result fan-out; get_test_urls() loads it
+catalog_index = None
+# Driver position -> the proxy it is being recycled off, so its replacement gets a different one
+rotating_from = {}
+# Browsers in the run, for the VPN/direct split; scrape_urls() sets it when it starts its own
+fleet_size = 4
 
-def initialize_connection_pool():
-    load_dotenv()
-    database_url = os.getenv('PRODUCTION_DATABASE_URL')
-    if not database_url:
+def initialize_connection_pool(config=None):
+    config = config or load_config('production')
+    if not config.database_url:
         logger.error("DATABASE_URL not found in .env file")
         return None
 
-    parsed_url = urlparse(database_url)
-    dbname = parsed_url.path[1:]  
-    user = parsed_url.username
-    password = parsed_url.password
-    host = parsed_url.hostname
-    port = parsed_url.port or 5432 
-
     try:
-        # Create a pool with minimum 1 connection, maximum 10 connections
-        pool = ThreadedConnectionPool(
-            minconn=1,
-            maxconn=10,
-            dbname=dbname,
-            user=user,
-            password=password,
-            host=host,
-            port=port,
-            sslmode='require'
-        )
+        # The process's shared primary pool; writes go here
+        pool = config.database().pool()
         logger.info("Connection pool created successfully!")
         return pool
-    except psycopg2.Error as e:
+    except (psycopg2.Error, RuntimeError) as e:
         logger.error(f"Error creating connection pool: {e}")
         return None
 
 def get_test_urls(pool):
-    conn = None
-    try:
-        conn = pool.getconn()  # Get connection from pool
+    """One URL per listing with an automatically priced prize, from a fresh catalog index"""
+    global catalog_index
+    catalog_index = catalogIndex.CatalogIndex.from_pool(pool, allow_stale=True)
+    urls = catalog_index.scrape_urls()
+    logger.info(f"Retrieved {len(urls)} unique URLs")
+    return urls
+
+def write_scraped_price(conn, url, price):
+    """Write a price to every auto-priced prize on the listing"""
+    prize_ids = catalog_index.prize_ids_for_url(url) if catalog_index is not None else []
+    with pipelineMetrics.timed('db_write'):
         cursor = conn.cursor()
-        cursor.execute("""
-            SELECT DISTINCT tcgplayer_url 
-            FROM prize 
-            WHERE tcgplayer_url IS NOT NULL 
-            AND is_deleted = false
-            AND is_manually_priced = false
-        """)
-        urls = [row[0] for row in cursor.fetchall()]
-        logger.info(f"Retrieved {len(urls)} unique URLs")
-        return urls
-    finally:
-        if conn:
-            pool.putconn(conn)  # Return connection to pool
+        if prize_ids:
+            cursor.execute("""
+                UPDATE prize 
+                SET value = %s 
+                WHERE id = ANY(%s::uuid[])
+            """, (price, prize_ids))
+        else:
+            cursor.execute("""
+                UPDATE prize 
+                SET value = %s 
+                WHERE tcgplayer_url = %s
+            """, (price, url))
+        conn.commit()
 
 def update_values(conn, value_data):
     cursor = conn.cursor()
@@ -85,6 +84,9 @@ def update_values(conn, value_data):
     conn.commit()
 
 def get_monitor_resolution():
+    # Display libraries fail to import without a screen, so only load them here
+    import pyautogui
+    from screeninfo import get_monitors
     width, height = pyautogui.size()
     monitors = get_monitors()
     print(monitors)
@@ -92,19 +94,35 @@ def get_monitor_resolution():
     return width, height
 
 def initialize_webdriver(instance_num, use_vpn=False):
-    print(f"Starting driver #{instance_num} ({'VPN' if use_vpn else 'Direct'})")
-    chrome_options = uc.ChromeOptions()
-    chrome_options.add_argument('--disable-blink-features=AutomationControlled')
-    chrome_options.add_argument("--disable-infobars")
-    chrome_options.add_argument("--disable-extensions")
-
+    # VPN drivers go out through the proxy pool; without SCRAPER_PROXIES they run direct
+    pool = proxyPool.default_pool() if use_vpn else None
+    old_proxy = rotating_from.pop(instance_num, None)
+    proxy = pool.acquire(exclude=(old_proxy,) if old_proxy else ()) if pool else None
+    if use_vpn and not pool:
+        logger.warning(f"Driver #{instance_num} should use a VPN but SCRAPER_PROXIES is not set, running direct")
+    print(f"Starting driver #{instance_num} ({f'VPN via {proxy}' if proxy else 'Direct'})")
     try: 
-        driver = uc.Chrome(options=chrome_options)
+        driver = browserFleet.launch(instance_num, profile_namespace='single-pass', proxy=proxy)
         return driver
     except Exception as e:
+        if pool:
+            pool.release(proxy)
         print(f"Failed to initialize driver #{instance_num}: {str(e)}")
         raise
 
+def record_proxy_outcome(driver, timer, supervisor=None):
+    """Score the driver's proxy on this page and move the driver off it if it is doing badly"""
+    pool = proxyPool.default_pool()
+    proxy = getattr(driver, 'pullbox_proxy', None)
+    if not pool or not proxy or timer.cached:
+        return
+    if timer.error and timer.error != "no prices":
+        timer.challenged = tcgplayerPage.detect_challenge(driver)
+    pool.record(proxy, ok=not timer.error, seconds=time.perf_counter() - timer.started, challenged=timer.challenged)
+    if supervisor is not None and pool.should_rotate(proxy):
+        rotating_from[supervisor.position] = proxy
+        supervisor.request_recycle('proxy')
+
 def position_to_subquadrant(driver, quadrant):
     logger.debug(f"Positioning to subquadrant {quadrant}")
     screen_width, screen_height = get_monitor_resolution()
@@ -124,61 +142,46 @@ def position_to_subquadrant(driver, quadrant):
         logger.error(f"Failed to position window: {str(e)}")
     time.sleep(random.uniform(0.5, 1))
 
-def process_url_batch(driver, urls, position):
-    """Process a batch of URLs in a single browser window"""
+def process_url_batch(driver, urls, position, supervisor=None):
+    """Process a batch of URLs in a single browser window.
+
+    With a supervisor, urls is the shared UrlQueue and the supervisor decides
+    which browser loads each URL.
+    """
     results = []
     discord_webhook_url = os.getenv('DISCORD_WEBHOOK_URL')
     
     for url in urls:
+        if supervisor is not None:
+            try:
+                driver = supervisor.driver_for_next_page()
+            except Exception:
+                urls.requeue(url)
+                raise
         conn = None
+        outcome = None
+        timer = tcgplayerPage.PageTimer(url, position, proxy=getattr(driver, 'pullbox_proxy', None))
         try:
             # Get a connection from the pool
             conn = connection_pool.getconn()
             
-            # Wait for initial page load
-            driver.get(url)
-            time.sleep(1)
-            
+            prices = tcgplayerPage.cached_listing_prices(url, timer)
+            if prices is None:
+                # Wait for initial page load
+                listing_elements = tcgplayerPage.load_listing_page(driver, url, timer, 20)
+                logger.info(f"Number of listing elements found: {len(listing_elements)}")
 
-            WebDriverWait(driver, 20).until(EC.presence_of_all_elements_located((By.CSS_SELECTOR, '.tcg-standard-button__content')))
-            time.sleep(0.1)
-
-            listing_elements = WebDriverWait(driver, 20).until(
-                EC.presence_of_all_elements_located((By.CSS_SELECTOR, '.listing-item__listing-data'))
-            )
-            time.sleep(1)
-            logger.info(f"Number of listing elements found: {len(listing_elements)}")
-
-            listings = driver.find_elements(By.CSS_SELECTOR, '.listing-item__listing-data')
-            logger.info(f"Number of listings after delay: {len(listings)}")
-            prices = []
+                listings = driver.find_elements(By.CSS_SELECTOR, '.listing-item__listing-data')
+                logger.info(f"Number of listings after delay: {len(listings)}")
             try:
-                price_elements = WebDriverWait(driver, 10).until(
-                    EC.presence_of_all_elements_located((By.CSS_SELECTOR, ".listing-item__listing-data__info__price:not(:empty)"))
-                )
-                print("found elements")
-
-                price_texts = WebDriverWait(driver, 10).until(
-                    lambda x: [el.get_attribute('textContent') for el in price_elements]
-                )
-
-                for price_text in price_texts:
-                    try:
-                        price = float(price_text.replace('$', '').replace(',', ''))
-                        prices.append(price)
-                    except ValueError:
-                        print("no price")
+                if prices is None:
+                    prices = tcgplayerPage.extract_listing_prices(driver, timer)
 
                 if prices:
                     mean_price = round(sum(prices) / len(prices), 2) 
                     adjusted_price = round(mean_price * 1.1, 2)  # Add 10% and round to 2 decimal places
-                    cursor = conn.cursor()
-                    cursor.execute("""
-                        UPDATE prize 
-                        SET value = %s 
-                        WHERE tcgplayer_url = %s
-                    """, (adjusted_price, url))
-                    conn.commit()
+                    write_scraped_price(conn, url, adjusted_price)
+                    scrapeFailures.record(conn, url, ok=True)
                     results.append((url, adjusted_price))  # Store the adjusted price in results
                     logger.info(f"Processed and updated URL: {url} (Original: ${mean_price}, Adjusted: ${adjusted_price})")
                 else:
@@ -186,45 +189,75 @@ def process_url_batch(driver, urls, position):
                     if discord_webhook_url:
                         message = {"content": f"No prices found for card: {url}"}
                         try:
-                            requests.post(discord_webhook_url, json=message)
+                            httpPolicy.post(discord_webhook_url, json=message)
                         except Exception as e:
                             logger.error(f"Failed to send Discord notification: {e}")
                     results.append((url, 0))  # Add with 0 price instead of failing
-                    cursor = conn.cursor()
-                    cursor.execute("""
-                        UPDATE prize 
-                        SET value = %s 
-                        WHERE tcgplayer_url = %s
-                    """, (0, url))
-                    conn.commit()
+                    timer.error = "no prices"
+                    write_scraped_price(conn, url, 0)
+                    scrapeFailures.record(conn, url, ok=False)
             
             except (TimeoutException, StaleElementReferenceException) as e:
+                timer.error = type(e).__name__
+                driverSupervisor.check_error(supervisor, e)
                 if discord_webhook_url:
                     message = {"content": f"Failed to scrape card: {url}\nError: {str(e)}"}
                     try:
-                        requests.post(discord_webhook_url, json=message)
+                        httpPolicy.post(discord_webhook_url, json=message)
                     except Exception as e:
                         logger.error(f"Failed to send Discord notification: {e}")
                 logger.error(f"Error scraping prices: {e}")
+                scrapeFailures.record(conn, url, ok=False)
                 results.append((url, 0))
                 
+        except driverSupervisor.BrowserLost as e:
+            supervisor.lost(e)
+            timer.error = "BrowserLost"
+            if urls.requeue(url):
+                logger.warning(f"Driver #{position} lost while loading {url}, requeued")
+                outcome = 'requeued'
+            else:
+                logger.error(f"Error processing {url}: driver lost twice")
+                results.append((url, 0))
         except Exception as e:
+            timer.error = type(e).__name__
+            try:
+                driverSupervisor.check_error(supervisor, e)
+            except driverSupervisor.BrowserLost as lost:
+                supervisor.lost(lost)
+                if urls.requeue(url):
+                    logger.warning(f"Driver #{position} lost while loading {url}, requeued")
+                    outcome = 'requeued'
+                    continue
             if discord_webhook_url:
                 message = {"content": f"Failed to process card: {url}\nError: {str(e)}"}
                 try:
-                    requests.post(discord_webhook_url, json=message)
+                    httpPolicy.post(discord_webhook_url, json=message)
                 except Exception as e:
                     logger.error(f"Failed to send Discord notification: {e}")
             logger.error(f"Error processing {url}: {e}")
+            scrapeFailures.record(conn, url, ok=False)
             results.append((url, 0))
         finally:
             if conn:
                 # Return the connection to the pool
                 connection_pool.putconn(conn)
+            record_proxy_outcome(driver, timer, supervisor)
+            if supervisor is not None and outcome != 'requeued':
+                supervisor.page_done()
+                if timer.error != 'TimeoutException':
+                    supervisor.succeeded()
+            tcgplayerPage.finish_page(page_timing_log, driver, timer, outcome or ('failed' if timer.error else 'ok'))
     
+    priced = len([price for _, price in results if price])
+    pipelineMetrics.inc('urls_total', priced, driver=position, outcome='ok')
+    pipelineMetrics.inc('urls_total', len(results) - priced, driver=position, outcome='error')
     return results
 
 def cleanup_driver(driver):
+    pool = proxyPool.default_pool()
+    if pool and getattr(driver, 'pullbox_proxy', None):
+        pool.release(driver.pullbox_proxy)
     try:
         driver.close()
         time.sleep(0.5)  # Give it a moment
@@ -232,47 +265,52 @@ def cleanup_driver(driver):
     except Exception as e:
         logger.error(f"Error in cleanup: {e}")
 
-def main():
-    global connection_pool
-    
-    # Initialize the connection pool
-    connection_pool = initialize_connection_pool()
-    if not connection_pool:
-        return
-    
-    # Get monitor resolution once at the start
-    screen_width, screen_height = get_monitor_resolution()
-    
-    # Get test URLs
-    urls = get_test_urls(connection_pool)
-    print(f"Retrieved {len(urls)} URLs to process")
-    
-    drivers = []
+def start_positioned_driver(position):
+    """First half of the fleet goes out through the proxy pool, the second half direct"""
+    driver = initialize_webdriver(position, use_vpn=position <= fleet_size // 2)
+    position_to_subquadrant(driver, position)
+    return driver
+
+def scrape_urls(urls, num_drivers=4, job='scrape-production', drivers=None):
+    """Scrape the URLs across num_drivers browsers and write the prices back.
+
+    Browsers passed in as drivers are used and left open for the caller; the
+    list is updated in place when a browser is recycled.
+    """
+    global page_timing_log, fleet_size
+    page_timing_log = tcgplayerPage.PageTimingLog(job)
+    owns_drivers = drivers is None
+    drivers = [] if owns_drivers else drivers
+    if owns_drivers:
+        fleet_size = num_drivers
+    supervisors = []
     all_results = []
     
     try:
-        # Initialize 4 drivers - 2 VPN, 2 non-VPN
-        for i in range(1, 5):
-            use_vpn = i <= 2
-            driver = initialize_webdriver(i, use_vpn)
-            position_to_subquadrant(driver, i)
-            drivers.append(driver)
-            time.sleep(2)
+        # Initialize drivers - first half VPN, second half non-VPN - all at once
+        with profilingHooks.stage('driver_startup'):
+            if owns_drivers:
+                started = browserFleet.start_fleet(range(1, fleet_size + 1), start_positioned_driver)
+                drivers.extend(started[position] for position in sorted(started))
+            num_drivers = len(drivers)
         
-        # Divide URLs into 4 chunks
-        driver_url_chunks = [urls[i::4] for i in range(4)]
+        # Every driver pulls from one queue, so a recycled or slow browser doesn't strand a chunk
+        url_queue = driverSupervisor.UrlQueue(urls)
+        supervisors = [driverSupervisor.DriverSupervisor(position, start_positioned_driver, cleanup_driver, driver)
+                       for position, driver in enumerate(drivers, start=1)]
         
         # Process URLs with each driver working independently
-        with ThreadPoolExecutor(max_workers=4) as executor:
+        with profilingHooks.stage('scrape'), ThreadPoolExecutor(max_workers=num_drivers) as executor:
             futures = []
-            for idx, (driver, url_chunk) in enumerate(zip(drivers, driver_url_chunks)):
-                time.sleep(3)  # Stagger starts
+            for supervisor in supervisors:
+                time.sleep(browserFleet.START_STAGGER_SECONDS)  # Stagger starts
                 futures.append(
                     executor.submit(
                         process_url_batch,
-                        driver,
-                        url_chunk,
-                        idx + 1
+                        supervisor.driver,
+                        url_queue,
+                        supervisor.position,
+                        supervisor
                     )
                 )
             
@@ -284,15 +322,48 @@ def main():
                 except Exception as e:
                     print(f"Error in batch processing: {e}")
     finally:
-        # Cleanup
-        for driver in drivers:
-            cleanup_driver(driver)
-        
+        # Recycled browsers replace the originals; the caller gets back whatever is still open
+        if supervisors:
+            drivers[:] = [supervisor.driver for supervisor in supervisors if supervisor.driver is not None]
+        if owns_drivers:
+            for driver in drivers:
+                cleanup_driver(driver)
+        page_timing_log.write_summary()
+    
+    return all_results
+
+def export_metrics(job):
+    """The run's metrics, with the proxy pool's report"""
+    pool = proxyPool.default_pool()
+    if pool:
+        pool.export_gauges()
+    pipelineMetrics.export_run(job, extra={"proxies": pool.report()} if pool else None)
+
+def main(config=None, num_drivers=4):
+    global connection_pool
+    config = config or load_config('production')
+    
+    # Initialize the connection pool
+    connection_pool = initialize_connection_pool(config)
+    if not connection_pool:
+        return
+    
+    # Get monitor resolution once at the start
+    screen_width, screen_height = get_monitor_resolution()
+    
+    try:
+        # Get test URLs
+        with profilingHooks.stage('db_read'):
+            urls = get_test_urls(config.database().pool(readonly=True))
+        print(f"Retrieved {len(urls)} URLs to process")
+        scrape_urls(urls, num_drivers=num_drivers, job=f"scrape-{config.env}")
+    finally:
         # Clean up the connection pool
-        if connection_pool:
-            connection_pool.closeall()
-            logger.info("Connection pool closed")
+        config.database().close()
+        logger.info("Database pools closed")
+        export_metrics(f"scrape-{config.env}")
 
 if __name__ == "__main__":
+    profilingHooks.configure('scrape-production')
     main()
     
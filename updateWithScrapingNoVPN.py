@@ -1,21 +1,22 @@
 import os
-from dotenv import load_dotenv
-from urllib.parse import urlparse
 import psycopg2
-import pyautogui
 import time
 import random
+import threading
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException, StaleElementReferenceException
 import logging
-import undetected_chromedriver as uc
-from fake_useragent import UserAgent
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from screeninfo import get_monitors
-import requests
-from psycopg2.pool import ThreadedConnectionPool
+
+import browserFleet
+import catalogIndex
+import driverSupervisor
+import httpPolicy
+import pipelineMetrics
+import profilingHooks
+import scrapeFailures
+import tcgplayerPage
+from pricingConfig import load_config
 import csv
 
 logger = logging.getLogger(__name__)
@@ -23,57 +24,43 @@ logging.basicConfig(level=logging.INFO)
 
 # Add at the top with other globals
 connection_pool = None
+page_timing_log = None
+# The run's catalog, for result fan-out and failure alerts; get_test_urls() loads it
+catalog_index = None
+# Where get_catalog_index() loads from; the replica when there is one
+read_pool = None
+_catalog_lock = threading.Lock()
 
-def initialize_connection_pool():
-    load_dotenv()
-    database_url = os.getenv('STAGING_DATABASE_URL')
-    if not database_url:
+def initialize_connection_pool(config=None):
+    config = config or load_config('staging')
+    if not config.database_url:
         logger.error("DATABASE_URL not found in .env file")
         return None
 
-    parsed_url = urlparse(database_url)
-    dbname = parsed_url.path[1:]  
-    user = parsed_url.username
-    password = parsed_url.password
-    host = parsed_url.hostname
-    port = parsed_url.port or 5432 
-
     try:
-        # Create a pool with minimum 1 connection, maximum 10 connections
-        pool = ThreadedConnectionPool(
-            minconn=1,
-            maxconn=10,
-            dbname=dbname,
-            user=user,
-            password=password,
-            host=host,
-            port=port,
-            sslmode='require'
-        )
+        # The process's shared primary pool; writes go here
+        pool = config.database().pool()
         logger.info("Connection pool created successfully!")
         return pool
-    except psycopg2.Error as e:
+    except (psycopg2.Error, RuntimeError) as e:
         logger.error(f"Error creating connection pool: {e}")
         return None
 
 def get_test_urls(pool):
-    conn = None
-    try:
-        conn = pool.getconn()  # Get connection from pool
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT DISTINCT tcgplayer_url 
-            FROM prize 
-            WHERE tcgplayer_url IS NOT NULL 
-            AND is_deleted = false
-            AND is_manually_priced = false
-        """)
-        urls = [row[0] for row in cursor.fetchall()]
-        logger.info(f"Retrieved {len(urls)} unique URLs")
-        return urls
-    finally:
-        if conn:
-            pool.putconn(conn)  # Return connection to pool
+    """One URL per listing with an automatically priced prize, from a fresh catalog index"""
+    global catalog_index
+    catalog_index = catalogIndex.CatalogIndex.from_pool(pool, allow_stale=True)
+    urls = catalog_index.scrape_urls()
+    logger.info(f"Retrieved {len(urls)} unique URLs")
+    return urls
+
+def get_catalog_index():
+    """The run's catalog index, loaded from read_pool on first use (e.g. in a browser worker)"""
+    global catalog_index
+    with _catalog_lock:
+        if catalog_index is None:
+            catalog_index = catalogIndex.CatalogIndex.from_pool(read_pool or connection_pool, allow_stale=True)
+        return catalog_index
 
 def update_values(conn, value_data):
     cursor = conn.cursor()
@@ -86,6 +73,9 @@ def update_values(conn, value_data):
     conn.commit()
 
 def get_monitor_resolution():
+    # Display libraries fail to import without a screen, so only load them here
+    import pyautogui
+    from screeninfo import get_monitors
     width, height = pyautogui.size()
     monitors = get_monitors()
     print(monitors)
@@ -94,18 +84,18 @@ def get_monitor_resolution():
 
 def initialize_webdriver(instance_num):
     print(f"Starting driver #{instance_num}")
-    chrome_options = uc.ChromeOptions()
-    chrome_options.add_argument('--disable-blink-features=AutomationControlled')
-    chrome_options.add_argument("--disable-infobars")
-    chrome_options.add_argument("--disable-extensions")
-
     try: 
-        driver = uc.Chrome(options=chrome_options)
+        driver = browserFleet.launch(instance_num, profile_namespace='retry')
         return driver
     except Exception as e:
         print(f"Failed to initialize driver #{instance_num}: {str(e)}")
         raise
 
+def start_positioned_driver(position):
+    driver = initialize_webdriver(position)
+    position_to_subquadrant(driver, position)
+    return driver
+
 def position_to_subquadrant(driver, quadrant):
     logger.debug(f"Positioning to subquadrant {quadrant}")
     screen_width, screen_height = get_monitor_resolution()
@@ -125,20 +115,29 @@ def position_to_subquadrant(driver, quadrant):
         logger.error(f"Failed to position window: {str(e)}")
     time.sleep(random.uniform(0.5, 1))
 
-def handle_retry_logic(url, error, retry_count, discord_webhook_url, results):
+def handle_retry_logic(url, error, retry_count, discord_webhook_url, results, conn=None):
     """Helper function to handle retry logic and Discord notifications"""
     if retry_count == 2:  # Only notify on final attempt
+        scrapeFailures.record(conn, url, ok=False)
         if discord_webhook_url:
             message = {"content": f"Failed to process card after {retry_count} attempts: {url}\nError: {str(error)}"}
             try:
-                requests.post(discord_webhook_url, json=message)
+                httpPolicy.post(discord_webhook_url, json=message)
                 add_count_csv(url)
             except Exception as e:
                 logger.error(f"Failed to send Discord notification: {e}")
         logger.error(f"Error processing {url}: {error}")
         results.append((url, None))
     else:
-        time.sleep(random.uniform(1, 2))  # Wait before retry
+        time.sleep(httpPolicy.backoff_delay(retry_count, base=2))  # Wait before retry
+
+def record_failure(url):
+    """scrapeFailures.record() on a connection of its own, for paths that don't hold one"""
+    conn = connection_pool.getconn()
+    try:
+        scrapeFailures.record(conn, url, ok=False)
+    finally:
+        connection_pool.putconn(conn)
 
 def add_count_csv(url):
     """Track failed URLs and their failure counts in a CSV"""
@@ -181,17 +180,8 @@ def add_count_csv(url):
     logger.info(f"Final URL counts after update: {urls_count}")
     if urls_count[url] >= 3 and failed_webhook_url:
         try:
-            conn = connection_pool.getconn()
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT p.image, p.name, b.name as box_name 
-                FROM prize p 
-                JOIN box b ON b.id = p.box_id 
-                WHERE p.tcgplayer_url = %s
-            """, (url,))
-            
-            card_instances = cursor.fetchall()
+            card_instances = [(prize.image, prize.name, box.name)
+                              for prize, box in get_catalog_index().prizes_for_url(url) if box is not None]
             
             # Format the message with card details
             message_content = f"⚠️ Critical: URL has failed 3 or more times:\n{url}\n\n"
@@ -208,98 +198,214 @@ def add_count_csv(url):
                 
             message = {"content": message_content}
             
-            requests.post(failed_webhook_url, json=message)
+            httpPolicy.post(failed_webhook_url, json=message)
             
         except Exception as e:
             logger.error(f"Failed to send critical failure notification: {e}")
+
+def write_scraped_price(conn, url, price, prize_ids_by_url=None):
+    """Write a scraped price to the listed prize ids, or to every auto-priced prize on the listing"""
+    if prize_ids_by_url is not None and url in prize_ids_by_url:
+        prize_ids = list(prize_ids_by_url[url])
+    else:
+        prize_ids = get_catalog_index().prize_ids_for_url(url)
+    with pipelineMetrics.timed('db_write'):
+        cursor = conn.cursor()
+        if prize_ids:
+            cursor.execute("""
+                UPDATE prize 
+                SET value = %s 
+                WHERE id = ANY(%s::uuid[])
+            """, (price, prize_ids))
+        else:
+            # Not in the catalog (added after it was loaded): match the URL as before
+            cursor.execute("""
+                UPDATE prize 
+                SET value = %s 
+                WHERE tcgplayer_url = %s
+            """, (price, url))
+        conn.commit()
+
+def scrape_listing(driver, url, timer, results, prize_ids_by_url=None, supervisor=None):
+    """Up to two attempts at one URL; returns True once its price is written"""
+    discord_webhook_url = os.getenv('DISCORD_WEBHOOK_URL')
+    conn = None
+    retry_count = 0
+    scraped = False
+
+    while retry_count < 2:
+        try:
+            conn = connection_pool.getconn()
+            
+            prices = tcgplayerPage.cached_listing_prices(url, timer)
+            if prices is None:
+                # Wait for initial page load
+                listing_elements = tcgplayerPage.load_listing_page(driver, url, timer, 10)
+                logger.info(f"Number of listing elements found: {len(listing_elements)}")
+
+                listings = driver.find_elements(By.CSS_SELECTOR, '.listing-item__listing-data')
+                logger.info(f"Number of listings after delay: {len(listings)}")
+            try:
+                if prices is None:
+                    prices = tcgplayerPage.extract_listing_prices(driver, timer)
+
+                if prices:
+                    # Success! Update price and break the retry loop
+                    mean_price = round(sum(prices) / len(prices), 2) 
+                    adjusted_price = round(mean_price * 1.1, 2)
+                    write_scraped_price(conn, url, adjusted_price, prize_ids_by_url)
+                    scrapeFailures.record(conn, url, ok=True)
+                    results.append((url, adjusted_price))
+                    scraped = True
+                    logger.info(f"Processed and updated URL: {url} (Original: ${mean_price}, Adjusted: ${adjusted_price})")
+                    break  # Exit retry loop on success
+                else:
+                    retry_count += 1  # Increment retry count
+                    timer.error = "no prices"
+                    if retry_count == 2:  # Only notify on final attempt
+                        scrapeFailures.record(conn, url, ok=False)
+                        if discord_webhook_url:
+                            message = {"content": f"No prices found for card after {retry_count} attempts: {url}"}
+                            try:
+                                httpPolicy.post(discord_webhook_url, json=message)
+                            except Exception as e:
+                                logger.error(f"Failed to send Discord notification: {e}")
+                        results.append((url, None))
+                    else:
+                        timer.sleep(httpPolicy.backoff_delay(retry_count, base=2))  # Wait before retry
+            
+            except (TimeoutException, StaleElementReferenceException) as e:
+                retry_count += 1
+                timer.error = type(e).__name__
+                driverSupervisor.check_error(supervisor, e)
+                handle_retry_logic(url, e, retry_count, discord_webhook_url, results, conn)
+                
+        except driverSupervisor.BrowserLost:
+            raise
+        except Exception as e:
+            retry_count += 1
+            timer.error = type(e).__name__
+            driverSupervisor.check_error(supervisor, e)
+            handle_retry_logic(url, e, retry_count, discord_webhook_url, results, conn)
         finally:
             if conn:
                 connection_pool.putconn(conn)
+                conn = None
+    return scraped
 
-def process_url_batch(driver, urls, position):
-    """Process a batch of URLs in a single browser window"""
+def process_url_batch(driver, urls, position, prize_ids_by_url=None, supervisor=None):
+    """Process a batch of URLs in a single browser window.
+
+    With a supervisor, urls is the shared UrlQueue and the supervisor decides
+    which browser loads each URL.
+    """
     results = []
-    discord_webhook_url = os.getenv('DISCORD_WEBHOOK_URL')
     
     for url in urls:
-        conn = None
-        retry_count = 0
-        
-        while retry_count < 2:
+        if supervisor is not None:
             try:
-                conn = connection_pool.getconn()
-                
-                # Wait for initial page load
-                driver.get(url)
-                time.sleep(1)
-                
-                WebDriverWait(driver, 10).until(EC.presence_of_all_elements_located((By.CSS_SELECTOR, '.tcg-standard-button__content')))
-                time.sleep(0.1)
+                driver = supervisor.driver_for_next_page()
+            except Exception:
+                urls.requeue(url)
+                raise
+        timer = tcgplayerPage.PageTimer(url, position)
+        try:
+            scraped = scrape_listing(driver, url, timer, results, prize_ids_by_url, supervisor)
+        except driverSupervisor.BrowserLost as e:
+            supervisor.lost(e)
+            timer.error = "BrowserLost"
+            if urls.requeue(url):
+                logger.warning(f"Driver #{position} lost while loading {url}, requeued")
+                tcgplayerPage.finish_page(page_timing_log, driver, timer, 'requeued')
+                continue
+            logger.error(f"Error processing {url}: driver lost twice")
+            results.append((url, None))
+            scraped = False
+        if supervisor is not None:
+            supervisor.page_done()
+            if scraped or timer.error != 'TimeoutException':
+                supervisor.succeeded()
+        
+        tcgplayerPage.finish_page(page_timing_log, driver, timer, 'ok' if scraped else 'failed')
+    
+    priced = len([price for _, price in results if price is not None])
+    pipelineMetrics.inc('urls_total', priced, driver=position, outcome='ok')
+    pipelineMetrics.inc('urls_total', len(results) - priced, driver=position, outcome='error')
+    return results
 
-                listing_elements = WebDriverWait(driver, 10).until(
-                    EC.presence_of_all_elements_located((By.CSS_SELECTOR, '.listing-item__listing-data'))
-                )
-                time.sleep(1)
-                logger.info(f"Number of listing elements found: {len(listing_elements)}")
+def process_url_batch_tabs(driver, urls, position, prize_ids_by_url=None, supervisor=None, tabs=4):
+    """Like process_url_batch, but with several pages loading at once in tabs of one browser.
 
-                listings = driver.find_elements(By.CSS_SELECTOR, '.listing-item__listing-data')
-                logger.info(f"Number of listings after delay: {len(listings)}")
-                prices = []
+    The browser is recycled between runs rather than mid-batch, since that
+    would throw away every tab's page in flight. When it is lost anyway, the
+    pages that were in flight go back on the queue (or are reported failed)
+    and the supervisor's replacement takes over the rest of the queue.
+    """
+    results = []
+    discord_webhook_url = os.getenv('DISCORD_WEBHOOK_URL')
+
+    def on_page(url, prices, timer):
+        scraped = False
+        if prices:
+            mean_price = round(sum(prices) / len(prices), 2)
+            adjusted_price = round(mean_price * 1.1, 2)
+            conn = connection_pool.getconn()
+            try:
+                write_scraped_price(conn, url, adjusted_price, prize_ids_by_url)
+                scrapeFailures.record(conn, url, ok=True)
+            finally:
+                connection_pool.putconn(conn)
+            results.append((url, adjusted_price))
+            scraped = True
+            logger.info(f"Processed and updated URL: {url} (Original: ${mean_price}, Adjusted: ${adjusted_price})")
+        elif timer.error == "no prices":
+            record_failure(url)
+            if discord_webhook_url:
+                message = {"content": f"No prices found for card after {timer.attempts} attempts: {url}"}
                 try:
-                    price_elements = WebDriverWait(driver, 10).until(
-                        EC.presence_of_all_elements_located((By.CSS_SELECTOR, ".listing-item__listing-data__info__price:not(:empty)"))
-                    )
-                    print("found elements")
+                    httpPolicy.post(discord_webhook_url, json=message)
+                except Exception as e:
+                    logger.error(f"Failed to send Discord notification: {e}")
+            results.append((url, None))
+        else:
+            record_failure(url)
+            handle_retry_logic(url, timer.error, 2, discord_webhook_url, results)
+        if supervisor is not None:
+            supervisor.page_done()
+        tcgplayerPage.finish_page(page_timing_log, driver, timer, 'ok' if scraped else 'failed')
 
-                    price_texts = WebDriverWait(driver, 10).until(
-                        lambda x: [el.get_attribute('textContent') for el in price_elements]
-                    )
+    lost_idle = False
+    while True:
+        if supervisor is not None:
+            driver = supervisor.driver_for_next_page()
+        loader = None
+        try:
+            loader = tcgplayerPage.TabLoader(driver, tabs, position, timeout=20)
+            loader.run(urls, on_page)
+            break
+        except Exception as e:
+            if not driverSupervisor.is_browser_lost(e):
+                raise
+            in_flight = loader.in_flight if loader is not None else []
+            # A plain list of URLs can't be resumed on a new browser, so without a supervisor it ends
+            # here; nor does a second browser in a row that is lost before it loads anything
+            requeue = supervisor is not None and not (lost_idle and not in_flight)
+            lost_idle = not in_flight
+            if requeue:
+                supervisor.lost(e)
+            for url, timer in in_flight:
+                if requeue and urls.requeue(url):
+                    logger.warning(f"Driver #{position} lost while loading {url}, requeued")
+                    tcgplayerPage.finish_page(page_timing_log, driver, timer, 'requeued')
+                    continue
+                timer.error = "BrowserLost"
+                on_page(url, None, timer)
+            if not requeue:
+                raise
 
-                    for price_text in price_texts:
-                        try:
-                            price = float(price_text.replace('$', '').replace(',', ''))
-                            prices.append(price)
-                        except ValueError:
-                            print("no price")
-
-                    if prices:
-                        # Success! Update price and break the retry loop
-                        mean_price = round(sum(prices) / len(prices), 2) 
-                        adjusted_price = round(mean_price * 1.1, 2)
-                        cursor = conn.cursor()
-                        cursor.execute("""
-                            UPDATE prize 
-                            SET value = %s 
-                            WHERE tcgplayer_url = %s
-                        """, (adjusted_price, url))
-                        conn.commit()
-                        results.append((url, adjusted_price))
-                        logger.info(f"Processed and updated URL: {url} (Original: ${mean_price}, Adjusted: ${adjusted_price})")
-                        break  # Exit retry loop on success
-                    else:
-                        retry_count += 1  # Increment retry count
-                        if retry_count == 2:  # Only notify on final attempt
-                            if discord_webhook_url:
-                                message = {"content": f"No prices found for card after {retry_count} attempts: {url}"}
-                                try:
-                                    requests.post(discord_webhook_url, json=message)
-                                except Exception as e:
-                                    logger.error(f"Failed to send Discord notification: {e}")
-                            results.append((url, None))
-                        else:
-                            time.sleep(random.uniform(1, 2))  # Wait before retry
-                
-                except (TimeoutException, StaleElementReferenceException) as e:
-                    retry_count += 1
-                    handle_retry_logic(url, e, retry_count, discord_webhook_url, results)
-                    
-            except Exception as e:
-                retry_count += 1
-                handle_retry_logic(url, e, retry_count, discord_webhook_url, results)
-            finally:
-                if conn:
-                    connection_pool.putconn(conn)
-    
+    priced = len([price for _, price in results if price is not None])
+    pipelineMetrics.inc('urls_total', priced, driver=position, outcome='ok')
+    pipelineMetrics.inc('urls_total', len(results) - priced, driver=position, outcome='error')
     return results
 
 def cleanup_driver(driver):
@@ -310,46 +416,51 @@ def cleanup_driver(driver):
     except Exception as e:
         logger.error(f"Error in cleanup: {e}")
 
-def main():
-    global connection_pool
-    
-    # Initialize the connection pool
-    connection_pool = initialize_connection_pool()
-    if not connection_pool:
-        return
-    
-    # Get monitor resolution once at the start
-    screen_width, screen_height = get_monitor_resolution()
-    
-    # Get test URLs
-    urls = get_test_urls(connection_pool)
-    print(f"Retrieved {len(urls)} URLs to process")
-    
-    drivers = []
+def scrape_urls(urls, num_drivers=2, prize_ids_by_url=None, job='scrape-staging', drivers=None, tabs=1):
+    """Scrape the given URLs across num_drivers browsers and write the prices back.
+
+    Browsers passed in as drivers are used and left open for the caller; the
+    list is updated in place when a browser is recycled. With tabs > 1 each
+    browser keeps that many pages loading at once.
+    """
+    global page_timing_log
+    page_timing_log = tcgplayerPage.PageTimingLog(job)
+    owns_drivers = drivers is None
+    drivers = [] if owns_drivers else drivers
+    num_drivers = num_drivers if owns_drivers else len(drivers)
+    supervisors = []
     all_results = []
     
     try:
-        # Initialize 2 drivers (no VPN)
-        for i in range(1, 3):
-            driver = initialize_webdriver(i)
-            position_to_subquadrant(driver, i)
-            drivers.append(driver)
-            time.sleep(2)
+        # Initialize drivers (no VPN), all at once
+        with profilingHooks.stage('driver_startup'):
+            if len(drivers) < num_drivers:
+                started = browserFleet.start_fleet(range(len(drivers) + 1, num_drivers + 1), start_positioned_driver)
+                drivers.extend(started[position] for position in sorted(started))
+            num_drivers = len(drivers)
         
-        # Divide URLs into 2 chunks (instead of 4)
-        driver_url_chunks = [urls[i::2] for i in range(2)]
+        # Every driver pulls from one queue, so a recycled or slow browser doesn't strand a chunk
+        url_queue = driverSupervisor.UrlQueue(urls)
+        supervisors = [driverSupervisor.DriverSupervisor(position, start_positioned_driver, cleanup_driver, driver)
+                       for position, driver in enumerate(drivers, start=1)]
         
         # Process URLs with each driver working independently
-        with ThreadPoolExecutor(max_workers=2) as executor:
+        with ThreadPoolExecutor(max_workers=num_drivers) as executor:
             futures = []
-            for idx, (driver, url_chunk) in enumerate(zip(drivers, driver_url_chunks)):
-                time.sleep(3)
+            for supervisor in supervisors:
+                time.sleep(browserFleet.START_STAGGER_SECONDS)
+                if tabs > 1:
+                    futures.append(executor.submit(process_url_batch_tabs, supervisor.driver, url_queue,
+                                                   supervisor.position, prize_ids_by_url, supervisor, tabs))
+                    continue
                 futures.append(
                     executor.submit(
                         process_url_batch,
-                        driver,
-                        url_chunk,
-                        idx + 1
+                        supervisor.driver,
+                        url_queue,
+                        supervisor.position,
+                        prize_ids_by_url,
+                        supervisor
                     )
                 )
             
@@ -361,15 +472,49 @@ def main():
                 except Exception as e:
                     print(f"Error in batch processing: {e}")
     finally:
+        # Recycled browsers replace the originals; the caller gets back whatever is still open
+        if supervisors:
+            drivers[:] = [supervisor.driver for supervisor in supervisors if supervisor.driver is not None]
         # Cleanup
-        for driver in drivers:
-            cleanup_driver(driver)
-        
+        if owns_drivers:
+            for driver in drivers:
+                cleanup_driver(driver)
+        page_timing_log.write_summary()
+    
+    return all_results
+
+def main(config=None, num_drivers=2, isolate=False, tabs=1):
+    global connection_pool
+    config = config or load_config('staging')
+    
+    # Initialize the connection pool
+    connection_pool = initialize_connection_pool(config)
+    if not connection_pool:
+        return
+    
+    # Get monitor resolution once at the start
+    screen_width, screen_height = get_monitor_resolution()
+    
+    # Get test URLs
+    with profilingHooks.stage('db_read'):
+        urls = get_test_urls(config.database().pool(readonly=True))
+    print(f"Retrieved {len(urls)} URLs to process")
+    
+    try:
+        with profilingHooks.stage('scrape'):
+            if isolate:
+                import browserWorkers
+                browserWorkers.scrape_urls(urls, config, num_workers=num_drivers, job=f"scrape-{config.env}")
+            else:
+                scrape_urls(urls, num_drivers=num_drivers, job=f"scrape-{config.env}", tabs=tabs)
+    finally:
         # Clean up the connection pool
         if connection_pool:
-            connection_pool.closeall()
-            logger.info("Connection pool closed")
+            config.database().close()
+            logger.info("Database pools closed")
+        pipelineMetrics.export_run(f"scrape-{config.env}")
 
 if __name__ == "__main__":
+    profilingHooks.configure('scrape-staging')
     main()
     